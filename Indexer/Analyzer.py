@@ -4,18 +4,19 @@ LICENSE file, which is part of this source code package.
 """
 
 from .EacCpf import EacCpf
-from io import StringIO
 from datetime import datetime
 from mako.template import Template
 from lxml import etree
 
 from . import Cfg
+from . import Metrics
 from . import Timer
 from . import Utils
 import inspect
 import logging
 import os
 import shutil
+import time
 
 
 class Analyzer(object):
@@ -24,28 +25,27 @@ class Analyzer(object):
     produce an objective set of rudimentary metrics. These metrics may be used
     by an archivist or end user to make a quick, subjective assessment of the
     state or quality of a single document in relation to a whole collection.
+    When a shard is specified, only the documents of the records in that
+    shard are analyzed, and the HTML report of the whole collection is built
+    when the shard file hash indexes are merged.
     """
 
-    def __init__(self, source, output, update=False):
+    def __init__(self, source, output, update=False, shard=None):
         self.coordinates = {} # dictionary for geocoordinates
         self.hashIndex = {}
         self.logger = logging.getLogger()
         # set parameters
         self.output = output
+        self.shard = shard
         self.source = source
         self.update = update
         # load validation schema
-        modpath = os.path.abspath(inspect.getfile(self.__class__))
-        schema = os.path.dirname(modpath) + os.sep + 'transform' + os.sep + 'eaccpf.xsd'
         try:
-            with open(schema, 'r') as f:
-                schema_data = f.read()
-                schema_root = etree.XML(schema_data)
-                xmlschema = etree.XMLSchema(schema_root)
-                self.parser = etree.XMLParser(schema=xmlschema)
-                self.logger.info("Loaded EAC-CPF schema {0}".format(schema))
+            self.schema = Utils.loadSchema(Utils.EACCPF_SCHEMA)
+            self.logger.info("Loaded EAC-CPF schema {0}".format(Utils.EACCPF_SCHEMA))
         except Exception:
-            self.logger.error("Could not load schema file {0}".format(schema))
+            self.schema = None
+            self.logger.error("Could not load schema file {0}".format(Utils.EACCPF_SCHEMA))
 
     def _getResourceRelations(self, Data):
         """
@@ -58,11 +58,14 @@ class Analyzer(object):
     def _getSectionContentCount(self, Tag, Data):
         """
         Get the number of characters between the open and closing section tags.
+        Return 0 if the document has no such section.
         """
         starttag = "<" + Tag + ">"
         endtag = "</" + Tag + ">"
-        start = Data.index(starttag)
-        end = Data.index(endtag)
+        start = Data.find(starttag)
+        end = Data.find(endtag)
+        if start < 0 or end < 0:
+            return 0
         return end - start - len(starttag)
 
     def _getSectionContentCounts(self, Data):
@@ -70,6 +73,8 @@ class Analyzer(object):
         Get a dictionary with content length counts for each section of the
         document.
         """
+        if isinstance(Data, bytes):
+            Data = Data.decode('utf-8')
         counts = {}
         counts['control'] = self._getSectionContentCount("control", Data)
         counts['identity'] = self._getSectionContentCount("identity", Data)
@@ -87,17 +92,16 @@ class Analyzer(object):
         """
         Determine if the document is conformant to the EAC-CPF schema.
         """
+        if isinstance(Data, str):
+            Data = Data.encode('utf-8')
+        parser = etree.XMLParser()
         try:
-            # etree.parse(StringIO(Data), self.parser)
-            etree.parse(StringIO(Data))
+            doc = etree.fromstring(Data, parser)
+        except etree.XMLSyntaxError:
+            return False, [str(entry.message) for entry in parser.error_log]
+        if self.schema is None or self.schema.validate(doc):
             return True, []
-        except:
-            logging.error("Could not parse source file", exc_info=True)
-            errors = []
-            for entry in self.parser.error_log:
-                error = str(entry.message)
-                errors.append(error)
-            return False, errors
+        return False, [str(entry.message) for entry in self.schema.error_log]
 
     def analyzeFile(self, Source, Filename, Output):
         """
@@ -137,7 +141,7 @@ class Analyzer(object):
             analysis['has maintenance record'] = doc.hasMaintenanceRecord()
             analysis['has record identifier'] = True if doc.getRecordId() != None else False
             analysis['has resource relations'] = doc.hasResourceRelations()
-            analysis['the entity existence dates'] = doc.getExistDates()
+            analysis['the entity existence dates'] = list(doc.getExistDates())
             analysis['the entity type'] = doc.getEntityType()
             analysis['the entity local type'] = doc.getLocalType()
             analysis['the parsing errors'] = errors
@@ -163,17 +167,22 @@ class Analyzer(object):
         with analysis data to the output path.
         """
         records = []
-        for filename in [f for f in os.listdir(self.source) if f.endswith(".xml")]:
+        for filename in [f for f in os.listdir(self.source) if f.endswith(".xml") and Utils.inShard(f, self.shard)]:
             # if the file has not changed since the last run then skip it
             fileHash = Utils.getFileHash(self.source + os.sep + filename)
             if self.update:
                 if filename in self.hashIndex and self.hashIndex[filename] == fileHash:
                     self.logger.info("No change since last update: {0}".format(filename))
+                    Metrics.count('analyze', 'skipped')
                     continue
             # process the file
             records.append(filename)
             self.hashIndex[filename] = fileHash
+            start = time.perf_counter()
             self.analyzeFile(self.source, filename, self.output)
+            Metrics.timeDocument('analyze', filename, start)
+            Metrics.count('analyze', 'processed')
+            Metrics.countFile('analyze', 'bytes_read', self.source + os.sep + filename)
         return records
 
     def buildHtmlReport(self, Source, Output, Update):
@@ -211,6 +220,13 @@ class Analyzer(object):
         except:
             self.logger.error("Could not write HTML report file", exc_info=Cfg.LOG_EXC_INFO)
 
+    def merge(self):
+        """
+        Merge the shard file hash indexes, then build the HTML report.
+        """
+        Utils.mergeShardIndexes(self.output)
+        self.buildHtmlReport(self.output, self.output, True)
+
     def run(self):
         """
         Execute analysis operations using specified parameters.
@@ -220,13 +236,13 @@ class Analyzer(object):
             if not os.path.exists(self.output):
                 os.makedirs(self.output)
             if not self.update:
-                Utils.cleanOutputFolder(self.output)
+                Utils.cleanOutputFolder(self.output, Shard=self.shard)
             # check state
             assert os.path.exists(self.source), self.logger.error("Source path does not exist: {0}".format(self.source))
             assert os.path.exists(self.output), self.logger.error("Output path does not exist: {0}".format(self.output))
             # create an index of file hashes, so that we can track what has changed
             if self.update:
-                self.hashIndex = Utils.loadFileHashIndex(self.output)
+                self.hashIndex = Utils.loadFileHashIndex(self.output, Shard=self.shard)
             # analyze files
             records = self.analyzeFiles()
             # remove records from the index that were deleted in the source
@@ -236,20 +252,32 @@ class Analyzer(object):
             # remove files from the output folder that are not in the index
             if self.update:
                 self.logger.info("Clearing orphaned files from the output folder")
-                Utils.purgeFolder(self.output, self.hashIndex)
-            # build the HTML report
-            self.buildHtmlReport(self.output, self.output, self.update)
+                Utils.purgeFolder(self.output, self.hashIndex, shard=self.shard)
+            # build the HTML report, once all shards are complete
+            if not self.shard:
+                self.buildHtmlReport(self.output, self.output, self.update)
             # write the updated file hash index
-            Utils.writeFileHashIndex(self.hashIndex, self.output)
+            Utils.writeFileHashIndex(self.hashIndex, self.output, Shard=self.shard)
+        Metrics.recordTime('analyze', t.elapsed, t.cpu)
         # log execution time
-        self.logger.info("Analyzer finished in {0}:{1}:{2}".format(t.hours, t.minutes, t.seconds))
+        self.logger.info("Analyzer finished in {0}".format(t))
 
 
-def analyze(params, update=False):
+def analyze(params, update=False, shard=None):
     """
     Execute processing actions with the specified parameters.
     """
     source = params.get("analyze", "input")
     output = params.get("analyze", "output")
-    analyzer = Analyzer(source, output, update)
-    analyzer.run()
\ No newline at end of file
+    analyzer = Analyzer(source, output, update, shard)
+    analyzer.run()
+
+def merge(params):
+    """
+    Merge the file hash indexes written by each shard of the analysis, and
+    build the HTML report.
+    """
+    source = params.get("analyze", "input")
+    output = params.get("analyze", "output")
+    analyzer = Analyzer(source, output)
+    analyzer.merge()
\ No newline at end of file
@@ -17,3 +17,6 @@ def is_debugging():
 HASH_INDEX_FILENAME = ".index.yml"
 LOG_EXC_INFO = True if is_debugging() else False
 LOG_FORMAT = "%(asctime)s - %(filename)-10.10s %(lineno)03d - %(levelname)-5s - %(message)s"
+MANIFEST_FILENAME = ".manifest.yml"
+POSTED_INDEX_FILENAME = ".posted.yml"
+VALIDATION_REPORT_FILENAME = "validation.yml"
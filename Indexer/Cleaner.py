@@ -6,6 +6,7 @@ LICENSE file, which is part of this source code package.
 from lxml import etree
 
 import Cfg
+import Metrics
 import Timer
 import Utils
 import hashlib
@@ -14,35 +15,57 @@ import logging
 import os
 import re
 import shutil
+import time
+
+# an ampersand that does not start an entity or character reference
+AMPERSAND = re.compile(r'&(?![A-Za-z]+[0-9]*;|#[0-9]+;|#x[0-9a-fA-F]+;)')
+# the encoding attribute of the XML declaration, in decoded text
+ENCODING_DECLARATION = re.compile(r'^(\s*<\?xml[^>]*encoding\s*=\s*["\'])[A-Za-z0-9._-]+(["\'])')
+ENTITY_REFERENCE = re.compile(r'&#?\w+;')
+# junk characters before the first tag on the first line
+PRE_HEADER_GARBAGE = re.compile(r'^[^<\n]*<')
+# opening span tags, with or without attributes, and closing span tags
+SPAN_TAG = re.compile(r'</?span(?:\s[^>]*)?>')
+QUARANTINE_REPORT_FILENAME = "report.yml"
 
-import codecs
-import sys
 
 class Cleaner(object):
     """
     Corrects common errors in XML files and validates the file against an 
-    external schema.
+    external schema. When a shard is specified, only the files of the records
+    in that shard are cleaned, and the file hash index and quarantine report
+    are written as shard-local files to be merged later.
     """
 
-    def __init__(self, output, source, update=False):
+    def __init__(self, output, source, update=False, quarantine=None, shard=None):
         self.hashIndex = {}
         self.log = logging.getLogger()
+        self.quarantined = {}
+        self.records = []
         # set parameters
         self.output = output
+        self.quarantine = quarantine
+        self.shard = shard
         self.source = source
         self.update = update
         
-    def _fixEncoding(self, Text):
-        try:
-            outp = codecs.encode(codecs.decode(Text, 'utf-16le'), 'utf-8')
-            return outp
-        except:
-            print((sys.exc_info()))
-            
-        
+    def _fixEncoding(self, Data, Filename):
+        """
+        Decode the raw file data to text. The encoding is sniffed from the
+        byte order mark or XML declaration, and the XML declaration is then
+        rewritten to match the UTF-8 encoding of the cleaned output file.
+        """
+        text, encoding = Utils.decodeText(Data)
+        if encoding != 'utf-8':
+            self.log.debug("Decoded {0} from {1}".format(Filename, encoding))
+            text = ENCODING_DECLARATION.sub(r'\1utf-8\2', text, count=1)
+        return text
+
     def _fixAmpersands(self, Text):
-        outp = re.sub(r'&(?![A-Za-z]+[0-9]*;|#[0-9]+;|#x[0-9a-fA-F]+;)', r'&amp;', Text)
-        return outp
+        """
+        Escape ampersands that do not start an entity or character reference.
+        """
+        return AMPERSAND.sub('&amp;', Text)
 
     def _fixDateFields(self, Xml):
         """
@@ -75,9 +98,18 @@ class Cleaner(object):
                 except KeyError:
                     pass
             return Text
-        return re.sub("&#?\w+;", fixup, Html)
+        return ENTITY_REFERENCE.sub(fixup, Html)
+
+    def _releaseFile(self, Filename):
+        """
+        Remove the file from the quarantine report, and its copy from the
+        quarantine folder.
+        """
+        if self.quarantined.pop(Filename, None) is not None and self.quarantine:
+            if os.path.exists(self.quarantine + os.sep + Filename):
+                os.remove(self.quarantine + os.sep + Filename)
 
-    def _removeEmptyDateFields(self, Text):
+    def _removeEmptyDateFields(self, Text, Filename):
         """
         Remove any empty fromDate or toDate tags.
         """    
@@ -92,10 +124,10 @@ class Cleaner(object):
                     item.getparent().remove(item)
             return etree.tostring(xml,pretty_print=True,encoding='unicode')
         except:
-            self.log.error("Could not remove empty date fields: "+self.fn)
+            self.log.error("Could not remove empty date fields: "+Filename)
             return Text
     
-    def _removeEmptyStandardDateFields(self, Text):
+    def _removeEmptyStandardDateFields(self, Text, Filename):
         """
         Remove any fromDate or toDate tags that have empty standardDate attributes.
         """
@@ -110,85 +142,146 @@ class Cleaner(object):
                     item.attrib.pop('standardDate')
             return etree.tostring(xml,pretty_print=True,encoding='unicode')
         except:
-            self.log.error("Could not remove empty standardDate fields: "+self.fn)
+            self.log.error("Could not remove empty standardDate fields: "+Filename)
             return Text
     
     def _removeSpanTags(self, Text):
         """
-        Remove all <span> and </span> tags from the markup.
+        Remove all <span> and </span> tags from the markup, including span
+        tags with attributes, in a single pass over the document.
         """
-        try:
-            # replace simple cases first
-            Text = Text.replace("<span>","")
-            Text = Text.replace("</span>","")
-            # replace spans with attributes
-            for span in re.findall("<span \w*=\".*\">",Text):
-                Text = Text.replace(span,'')
-        except:
-            self.log.error("Could not remove span tags: "+self.fn)
-        finally:
-            return Text
-            
+        return SPAN_TAG.sub('', Text)
+
     def _removePreHeaderGarbage(self, Text):
-        #Remove junk characters from the beginning of the XML file, before the <?xml> tag.
-        return re.sub('^(.*?)<', '<', Text)
+        """
+        Remove junk characters from the beginning of the XML file, before the
+        <?xml> tag.
+        """
+        return PRE_HEADER_GARBAGE.sub('<', Text, count=1)
+
+    def _loadQuarantineReport(self):
+        """
+        Load the report of the files quarantined by earlier runs. If a shard
+        is specified, load the shard-local report, or the entries for the
+        shard from the merged report if the shard has no report of its own.
+        """
+        report = Utils.tryReadYaml(self.quarantine, Utils.getShardFilename(QUARANTINE_REPORT_FILENAME, self.shard))
+        if self.shard and not report:
+            report = Utils.tryReadYaml(self.quarantine, QUARANTINE_REPORT_FILENAME)
+            report = dict([(f, report[f]) for f in report if Utils.inShard(f, self.shard)])
+        return report
+
+    def _quarantineFile(self, Filename, Reason):
+        """
+        Record that the file could not be cleaned. Where a quarantine folder
+        has been configured, copy the source file there for manual repair.
+        """
+        self.log.error("Could not clean {0}: {1}".format(Filename, Reason))
+        self.quarantined[Filename] = str(Reason)
+        Metrics.count('clean', 'failed')
+        if self.quarantine:
+            shutil.copy(self.source + os.sep + Filename, self.quarantine)
 
     def clean(self):
         """
         Read all files from source directory, apply fixes to common errors in 
         documents. Write cleaned files to the output directory.
         """
-        # list of records that have been discovered
-        records = []
-        # for each file in the source folder
         for filename in os.listdir(self.source):
-            #try:
-                if filename.startswith('.'):
-                    continue
-                else:
-                    records.append(filename)
-                # read data
-                #TODO: Add encoding param to Utils.read instead of copying this here.
-                with open(self.source + os.sep + filename, 'r', encoding='utf-16-le') as f:
-                    data = f.read().encode('utf-8').decode()
-                #data = Utils.read(self.source, filename)
-                #data.replace('\n', '').replace('\t', '')
-                
-                self.fn = filename
-                fileHash = hashlib.sha1(data.encode('utf-8')).hexdigest()
-                # if we are doing an update and the file has not changed then
-                # skip it
-                if self.update:
-                    if filename in self.hashIndex and self.hashIndex[filename] == fileHash:
-                        #self.log.info("No change since last update " + filename)
-                        continue
-                # record the file hash
-                self.hashIndex[filename] = fileHash
-                # fix problems
-                if filename.endswith(".xml"):
-                    data = self.fixEacCpf(data)
-                elif filename.endswith(".htm") or filename.endswith(".html"):
-                    data = self.fixHtml(data)
-                else:
-                    pass
-                # write data to specified file in the output directory.
-                outfile_path = self.output + os.sep + filename
-                #print(outfile_path)
-                with open(outfile_path,'w', encoding='utf-8') as outfile:
-                    try:
-                        outfile.write(data)
-                    except:
-                        print("FAIL: " + outfile_path)
-                        shutil.copy(self.source + os.sep + filename, 'C:\\Users\\Adam_Bradley\\Projects\\eac.20160218.quar')
-                #self.log.info("Stored document " + filename)
-            #except Exception:
-            #    self.log.error("Could not complete processing on " + filename, exc_info=Cfg.LOG_EXC_INFO)
+            start = time.perf_counter()
+            self.cleanFile(filename)
+            Metrics.timeDocument('clean', filename, start)
         # return the list of processed records
-        return records
+        return self.records
+
+    def cleanFile(self, Filename):
+        """
+        Apply fixes to common errors in the source file and write the cleaned
+        file to the output directory. When updating, files that have not
+        changed since the last run are skipped. Return True if the cleaned
+        file is in the output directory.
+        """
+        if Filename.startswith('.') or not Utils.inShard(Filename, self.shard):
+            return False
+        # add the file to the list of records that have been discovered
+        self.records.append(Filename)
+        # read data
+        with open(self.source + os.sep + Filename, 'rb') as f:
+            raw = f.read()
+        fileHash = hashlib.sha1(raw).hexdigest()
+        Metrics.count('clean', 'bytes_read', len(raw))
+        # if we are doing an update and the file has not changed then
+        # skip it
+        if self.update:
+            if Filename in self.hashIndex and self.hashIndex[Filename] == fileHash:
+                Metrics.count('clean', 'skipped')
+                return Filename not in self.quarantined
+        # the file is quarantined again if it still can not be cleaned
+        self._releaseFile(Filename)
+        # decode the file contents
+        try:
+            data = self._fixEncoding(raw, Filename)
+        except (LookupError, UnicodeDecodeError) as e:
+            self._quarantineFile(Filename, e)
+            return False
+        # record the file hash
+        self.hashIndex[Filename] = fileHash
+        # fix problems
+        if Filename.endswith(".xml"):
+            data = self.fixEacCpf(data, Filename)
+        elif Filename.endswith(".htm") or Filename.endswith(".html"):
+            data = self.fixHtml(data)
+        else:
+            pass
+        # write data to specified file in the output directory.
+        outfile_path = self.output + os.sep + Filename
+        try:
+            with open(outfile_path, 'w', encoding='utf-8') as outfile:
+                outfile.write(data)
+        except UnicodeEncodeError as e:
+            # lone surrogates and the like can survive decoding
+            os.remove(outfile_path)
+            del self.hashIndex[Filename]
+            self._quarantineFile(Filename, e)
+            return False
+        Metrics.count('clean', 'processed')
+        Metrics.countFile('clean', 'bytes_written', outfile_path)
+        return True
 
-    def fixEacCpf(self, Data):
+    def complete(self, Partial=False):
         """
-        Clean problems that are typical of EAC-CPF files.
+        Synchronize the output folder and file hash index with the records
+        cleaned in this run, and report on files that could not be cleaned.
+        If only some of the source files were cleaned in this run, then the
+        records that exist in the source folder are kept.
+        """
+        records = self.records
+        if Partial:
+            records = [f for f in os.listdir(self.source) if not f.startswith('.') and Utils.inShard(f, self.shard)]
+        # remove records from the index that were deleted in the source
+        if self.update:
+            self.log.info("Clearing orphaned records from the file hash index")
+            Utils.purgeIndex(records, self.hashIndex)
+        # remove files from the output that are not in the index
+        if self.update:
+            self.log.info("Clearing orphaned files from the output folder")
+            Utils.purgeFolder(self.output, self.hashIndex, shard=self.shard)
+        # write the updated file hash index
+        Utils.writeFileHashIndex(self.hashIndex, self.output, Shard=self.shard)
+        # release quarantined files that were deleted in the source
+        for filename in [f for f in list(self.quarantined) if not os.path.exists(self.source + os.sep + f)]:
+            self._releaseFile(filename)
+        # report on files that could not be cleaned
+        if self.quarantined:
+            self.log.error("Could not clean {0} files".format(len(self.quarantined)))
+        if self.quarantine:
+            filename = Utils.getShardFilename(QUARANTINE_REPORT_FILENAME, self.shard)
+            Utils.writeYaml(self.quarantine, filename, self.quarantined)
+
+    def fixEacCpf(self, Data, Filename=''):
+        """
+        Clean problems that are typical of EAC-CPF files. The file name is
+        used to report problems.
         """
         #print(Data)
         # data = self._fixEntityReferences(data)
@@ -199,8 +292,8 @@ class Cleaner(object):
         data = self._removePreHeaderGarbage(data)
         data = self._fixDateFields(data)
         data = self._removeSpanTags(data)
-        data = self._removeEmptyDateFields(data)
-        data = self._removeEmptyStandardDateFields(data) # XML needs to be valid before we can do this
+        data = self._removeEmptyDateFields(data, Filename)
+        data = self._removeEmptyStandardDateFields(data, Filename) # XML needs to be valid before we can do this
         return data
     
     def fixHtml(self, Data):
@@ -215,45 +308,80 @@ class Cleaner(object):
         data = data.replace('&', 'and')
         return data
     
+    def merge(self):
+        """
+        Merge the shard file hash indexes and quarantine reports.
+        """
+        Utils.mergeShardIndexes(self.output)
+        if self.quarantine:
+            Utils.mergeShardIndexes(self.quarantine, QUARANTINE_REPORT_FILENAME)
+
+    def prepare(self):
+        """
+        Load the file hash index and prepare the output and quarantine
+        folders before cleaning.
+        """
+        # create an index of file hashes, so that we can track what has changed
+        if self.update:
+            self.hashIndex = Utils.loadFileHashIndex(self.output, Shard=self.shard)
+        # clear output folder
+        if not os.path.exists(self.output):
+            os.makedirs(self.output)
+        if not self.update:
+            Utils.cleanOutputFolder(self.output, Shard=self.shard)
+        # check state
+        assert os.path.exists(self.source), self.log.error("Source path does not exist: " + self.source)
+        assert os.path.exists(self.output), self.log.error("Output path does not exist: " + self.output)
+        # when updating, files quarantined by earlier runs are kept until
+        # they are cleaned again, as unchanged files may not be cleaned in
+        # this run. Otherwise the quarantine is for the current run only.
+        self.quarantined = {}
+        if self.quarantine and self.update:
+            if not os.path.exists(self.quarantine):
+                os.makedirs(self.quarantine)
+            self.quarantined = self._loadQuarantineReport()
+        elif self.quarantine:
+            # the reports of the other shards are kept until they are merged
+            keep = [QUARANTINE_REPORT_FILENAME] + Utils.getShardFilenames(self.quarantine, QUARANTINE_REPORT_FILENAME)
+            Utils.cleanOutputFolder(self.quarantine, Shard=self.shard, Keep=keep if self.shard else None)
+        self.records = []
+
     def run(self):
         """
         Execute the clean operation using specified parameters.
-        @todo this needs to be cleaned up and simplified
         """
         with Timer.Timer() as t:
-            # create an index of file hashes, so that we can track what has changed
-            if self.update:
-                self.hashIndex = Utils.loadFileHashIndex(self.output)
-            # clear output folder
-            if not os.path.exists(self.output):
-                os.makedirs(self.output)
-            if not self.update:
-                Utils.cleanOutputFolder(self.output)
-            # check state
-            assert os.path.exists(self.source), self.log.error("Source path does not exist: " + self.source)
-            assert os.path.exists(self.output), self.log.error("Output path does not exist: " + self.output)
-            # clean data
-            records = self.clean()
-            # remove records from the index that were deleted in the source
-            if self.update:
-                self.log.info("Clearing orphaned records from the file hash index")
-                Utils.purgeIndex(records, self.hashIndex)
-            # remove files from the output that are not in the index
-            if self.update:
-                self.log.info("Clearing orphaned files from the output folder")
-                Utils.purgeFolder(self.output, self.hashIndex)
-            # write the updated file hash index
-            Utils.writeFileHashIndex(self.hashIndex, self.output)
+            self.prepare()
+            self.clean()
+            self.complete()
+        Metrics.recordTime('clean', t.elapsed, t.cpu)
         # log execution time
-        self.log.info("Cleaner finished in {0}:{1}:{2}".format(t.hours, t.minutes, t.seconds))
-        print(("Cleaner finished in {0}:{1}:{2}".format(t.hours, t.minutes, t.seconds)))
+        self.log.info("Cleaner finished in {0}".format(t))
+        print(("Cleaner finished in {0}".format(t)))
 
 
-def clean(params, update=False):
+def _getCleaner(params, update=False, shard=None):
     """
-    Execute cleaning operations with specified parameters.
+    Create a cleaner with the specified parameters.
     """
     output = params.get("clean","output")
     source = params.get("clean","input")
-    cleaner = Cleaner(output, source, update)
+    if params.has_option("clean", "quarantine"):
+        quarantine = params.get("clean", "quarantine")
+    else:
+        quarantine = None
+    return Cleaner(output, source, update, quarantine, shard)
+
+def clean(params, update=False, shard=None):
+    """
+    Execute cleaning operations with specified parameters.
+    """
+    cleaner = _getCleaner(params, update, shard)
     cleaner.run()
+
+def merge(params):
+    """
+    Merge the file hash indexes written by each shard of the clean.
+    """
+    cleaner = _getCleaner(params)
+    cleaner.merge()
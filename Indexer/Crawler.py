@@ -8,11 +8,13 @@ from .EacCpf import EacCpf
 from .HtmlPage import HtmlPage
 
 import Cfg
+import Metrics
 import Timer
 import Utils
 import logging
 import os
 import re
+import time
 
 
 class Crawler(object):
@@ -59,6 +61,23 @@ class Crawler(object):
     cache of any files not present in our index. The cache should now reflect
     the contents of the source.
 
+    Notification
+    ------------
+
+    When a notify function is set, it is called with the file name of each
+    record in the output folder as the record is crawled, whether or not the
+    record changed since the last run. This lets the Pipeline start cleaning
+    records before the crawl is complete.
+
+    Sharding
+    --------
+
+    When a shard is specified, the Crawler only processes the records in
+    that shard, and writes a shard-local file hash index, so that several
+    nodes can crawl the same source into the same output folder. The
+    digital object cache is shared by all shards, so it is only purged once
+    the shard indexes have been merged.
+
     Digital Objects
     ---------------
 
@@ -71,9 +90,13 @@ class Crawler(object):
 
     """
 
-    def __init__(self, actions, base, source, output, cache_path, cache_url, exclude=None, sleep=1.0, update=False):
+    def __init__(self, actions, base, source, output, cache_path, cache_url, exclude=None, sleep=1.0, update=False,
+                 shard=None):
         self.hashIndex = {}
         self.log = logging.getLogger()
+        self.notify = None # function called with each record in the output
+        self.pageRecords = {} # records produced from each HTML page
+        self.pageSources = {} # source files read for each HTML page
         self.records = [] # list of records that have been discovered
         # parameters
         self.actions = actions
@@ -81,6 +104,7 @@ class Crawler(object):
         self.cache = DigitalObjectCache(cache_path, cache_url)
         self.exclude = exclude if exclude else []
         self.output = output
+        self.shard = shard
         self.sleep = sleep
         self.source = source
         self.update = update
@@ -93,6 +117,68 @@ class Crawler(object):
         self.base = "{}/".format(self.base) if self.base and not self.base.endswith('/') else self.base
         self.source = "{}/".format(self.source) if self.source and not self.source.endswith('/') else self.source
 
+    def _crawlPage(self, Path, Filename, BaseUrl):
+        """
+        Execute the crawl actions on the HTML page and the EAC-CPF document
+        that it links to. Record the source files that were read and the
+        records that were produced for the page, so that the page can be
+        crawled again when one of its source files changes.
+        """
+        page = os.path.abspath(Path + os.sep + Filename)
+        sources = [page]
+        start = len(self.records)
+        started = time.perf_counter()
+        self.log.debug("Reading {0}".format(Filename))
+        Metrics.countFile('crawl', 'bytes_read', page)
+        try:
+            html = HtmlPage(Path, Filename, BaseUrl)
+            if 'html-all' in self.actions:
+                self.process_html(html)
+            elif 'html-entity' in self.actions and html.hasEacCpfAlternate():
+                self.process_html(html)
+            elif 'html' in self.actions and html.hasEacCpfAlternate():
+                # this action is for backward compatibility.
+                # 'html-entity' is more descriptive and should be used
+                # instead
+                self.process_html(html)
+            elif html.hasEacCpfAlternate():
+                metadata_url = html.getEacCpfUrl()
+                presentation_url = html.getUrl()
+                eaccpf_path = self.source + metadata_url.replace(self.base, '')
+                sources.append(os.path.abspath(eaccpf_path))
+                if not os.path.exists(eaccpf_path):
+                    self.log.warning("EAC-CPF resource not available at {0}".format(eaccpf_path))
+                else:
+                    Metrics.countFile('crawl', 'bytes_read', eaccpf_path)
+                    eaccpf = EacCpf(eaccpf_path, metadata_url, presentation_url)
+                    if 'eaccpf' in self.actions:
+                        self.process_eaccpf(eaccpf)
+                    if 'eaccpf-thumbnail' in self.actions:
+                        self.process_eaccpf_thumbnail(eaccpf)
+                    if 'eaccpf-digitalobject' in self.actions:
+                        self.process_eaccpf_digital_objects(eaccpf)
+                    if 'digitalobject' in self.actions:
+                        # this action is for backward compatibility.
+                        # 'eaccpf-digitalobject' is more descriptive
+                        # and should be used instead
+                        self.process_eaccpf_digital_objects(eaccpf)
+        except:
+            Metrics.count('crawl', 'failed')
+            self.log.error("Could not complete processing for {0}".format(Filename), exc_info=Cfg.LOG_EXC_INFO)
+        self.pageRecords[page] = self.records[start:]
+        self.pageSources[page] = sources
+        for record in self.pageRecords[page]:
+            Metrics.timeDocument('crawl', record, started)
+
+    def _getBaseUrl(self, Path):
+        """
+        Get the assumed public URL of the folder in the source.
+        """
+        folder = os.path.relpath(Path, self.source)
+        base_url = self.base + ('' if folder == '.' else folder.replace(os.sep, '/'))
+        base_url += '/' if not base_url.endswith('/') else ''
+        return base_url
+
     def _is_excluded(self, path):
         """
         Return True if the file or directory should be excluded based on
@@ -104,6 +190,13 @@ class Crawler(object):
                 return True
         return False
 
+    def _notify(self, Filename):
+        """
+        Notify the listener that the record is in the output folder.
+        """
+        if self.notify:
+            self.notify(Filename)
+
     def crawlFileSystem(self):
         """
         Crawl file system for HTML files. Execute the specified indexing
@@ -111,49 +204,55 @@ class Crawler(object):
         specified number of seconds after fetching data. The Update parameter
         controls whether we should process the file only if it has changed.
         """
+        self.pageRecords = {}
+        self.pageSources = {}
         for path, sub_dirs, files in os.walk(self.source):
             # remove excluded subdirectories from the traversal list
             for sub_dir in [d for d in sub_dirs if self._is_excluded(d)]:
                 sub_dirs.remove(sub_dir)
             # construct an assumed public url for the path
-            base_url = self.base + path.replace(self.source, '')
-            base_url += '/' if not base_url.endswith('/') else ''
+            base_url = self._getBaseUrl(path)
             # scan the current path
             self.log.debug("Scanning {0} ({1})".format(path, base_url))
             for filename in [f for f in files if f.endswith(".htm") or f.endswith(".html")]:
-                self.log.debug("Reading {0}".format(filename))
-                try:
-                    html = HtmlPage(path, filename, base_url)
-                    if 'html-all' in self.actions:
-                        self.process_html(html)
-                    elif 'html-entity' in self.actions and html.hasEacCpfAlternate():
-                        self.process_html(html)
-                    elif 'html' in self.actions and html.hasEacCpfAlternate():
-                        # this action is for backward compatibility.
-                        # 'html-entity' is more descriptive and should be used
-                        # instead
-                        self.process_html(html)
-                    elif html.hasEacCpfAlternate():
-                        metadata_url = html.getEacCpfUrl()
-                        presentation_url = html.getUrl()
-                        eaccpf_path = self.source + metadata_url.replace(self.base, '')
-                        if not os.path.exists(eaccpf_path):
-                            self.log.warning("EAC-CPF resource not available at {0}".format(eaccpf_path))
-                        else:
-                            eaccpf = EacCpf(eaccpf_path, metadata_url, presentation_url)
-                            if 'eaccpf' in self.actions:
-                                self.process_eaccpf(eaccpf)
-                            if 'eaccpf-thumbnail' in self.actions:
-                                self.process_eaccpf_thumbnail(eaccpf)
-                            if 'eaccpf-digitalobject' in self.actions:
-                                self.process_eaccpf_digital_objects(eaccpf)
-                            if 'digitalobject' in self.actions:
-                                # this action is for backward compatibility.
-                                # 'eaccpf-digitalobject' is more descriptive
-                                # and should be used instead
-                                self.process_eaccpf_digital_objects(eaccpf)
-                except:
-                    self.log.error("Could not complete processing for {0}".format(filename), exc_info=Cfg.LOG_EXC_INFO)
+                self._crawlPage(path, filename, base_url)
+
+    def crawlPaths(self, Paths):
+        """
+        Crawl the HTML pages that are affected by the changed source file
+        paths: the changed pages themselves, and the pages that link to a
+        changed EAC-CPF document. Remove the records of pages that were
+        deleted, or that no longer produce them, from the output folder and
+        the file hash index. The source folder must have been crawled by this
+        Crawler first, so that it knows which files each page was crawled
+        from. Return the file names of the records that were removed.
+        """
+        paths = set([os.path.abspath(p) for p in Paths])
+        pages = set([p for p in paths if p.endswith(".htm") or p.endswith(".html")])
+        for page in [p for p in self.pageSources if paths.intersection(self.pageSources[p])]:
+            pages.add(page)
+        self.records = []
+        previous = []
+        for page in sorted(pages):
+            previous.extend(self.pageRecords.pop(page, []))
+            self.pageSources.pop(page, None)
+            path, filename = os.path.split(page)
+            folder = os.path.relpath(path, self.source)
+            folders = folder.split(os.sep) if folder != '.' else []
+            if os.path.exists(page) and not [f for f in folders if self._is_excluded(f)]:
+                self._crawlPage(path, filename, self._getBaseUrl(path))
+        # records that are still produced by another page are kept
+        current = set([r for records in self.pageRecords.values() for r in records])
+        removed = sorted(set([r for r in previous if r not in current]))
+        for filename in removed:
+            self.hashIndex.pop(filename, None)
+            if os.path.exists(self.output + os.sep + filename):
+                os.remove(self.output + os.sep + filename)
+        if removed and not self.shard:
+            self.cache.purge(list(self.hashIndex.keys()))
+        Utils.writeFileHashIndex(self.hashIndex, self.output, Shard=self.shard)
+        self.log.info("Crawled {0} changed pages. Removed {1} records.".format(len(pages), len(removed)))
+        return removed
 
     def crawlWebSite(self):
         """
@@ -163,6 +262,16 @@ class Crawler(object):
         """
         self.log.error("Web site crawling is not implemented")
 
+    def merge(self):
+        """
+        Merge the shard file hash indexes in the output folder, then purge
+        the digital object cache of the objects of records that are no longer
+        in the index.
+        """
+        if os.path.exists(self.output):
+            index = Utils.mergeShardIndexes(self.output)
+            self.cache.purge(list(index.keys()))
+
     def process_eaccpf(self, doc):
         """
         Execute crawl actions on the EAC-CPF document.
@@ -172,6 +281,8 @@ class Crawler(object):
         if self._is_excluded(record_filename):
             self.log.debug("Document excluded {0}".format(record_filename))
             return
+        if not Utils.inShard(record_filename, self.shard):
+            return
         # add the document file name to the list of documents that exist in the
         # source and have been processed
         self.records.append(record_filename)
@@ -179,14 +290,17 @@ class Crawler(object):
         # if the file has not changed since the last run then skip it
         if self.update and record_filename in self.hashIndex and self.hashIndex[record_filename] == file_hash:
             self.log.debug("EAC-CPF has not changed since last update")
-            return
+            Metrics.count('crawl', 'skipped')
         else:
             # store the file
             self.log.debug("EAC-CPF is new or changed since last run")
             doc.write(self.output)
+            Metrics.count('crawl', 'processed')
+            Metrics.countFile('crawl', 'bytes_written', self.output + os.sep + record_filename)
             # record the document hash so that we can track whether its changed
             # on the next processing run
             self.hashIndex[record_filename] = file_hash
+        self._notify(record_filename)
 
     def process_eaccpf_digital_objects(self, doc):
         """
@@ -204,6 +318,8 @@ class Crawler(object):
                 if self._is_excluded(object_filename) or self._is_excluded(metadata_filename):
                     self.log.debug("Digital object excluded {0}".format(dobj_id))
                     return
+                if not Utils.inShard(metadata_filename, self.shard):
+                    continue
                 # add the digital object metadata file name to the list of
                 # documents that have been processed
                 self.records.append(metadata_filename)
@@ -211,6 +327,8 @@ class Crawler(object):
                 # if the file has not changed since the last run then skip it
                 if self.update and metadata_filename in self.hashIndex and self.hashIndex[metadata_filename] == record_hash:
                     self.log.debug("Digital object has not changed since last update")
+                    Metrics.count('crawl', 'skipped')
+                    self._notify(metadata_filename)
                     continue
                 else:
                     self.log.debug("Digital object is new or changed since last run")
@@ -220,10 +338,14 @@ class Crawler(object):
                     cache_record = self.cache.put(metadata_filename, dobj_path)
                     # store the digital object metadata in the cache
                     dobj.write(self.output, Filename=metadata_filename, Id=dobj_id, CacheRecord=cache_record)
+                    Metrics.count('crawl', 'processed')
+                    Metrics.countFile('crawl', 'bytes_written', self.output + os.sep + metadata_filename)
                     # record the metadata hash so that we can track whether its
                     # changed on the next processing run
                     self.hashIndex[metadata_filename] = record_hash
+                    self._notify(metadata_filename)
             except:
+                Metrics.count('crawl', 'failed')
                 msg = "Could not write digital object {0}".format(doc.getFileName())
                 self.log.error(msg, exc_info=Cfg.LOG_EXC_INFO)
 
@@ -245,6 +367,8 @@ class Crawler(object):
                 if self._is_excluded(object_filename) or self._is_excluded(metadata_filename):
                     self.log.debug("Thumbnail excluded {0}".format(dobj_id))
                     return
+                if not Utils.inShard(metadata_filename, self.shard):
+                    return
                 # add the digital object metadata file name to the list of
                 # documents that have been processed
                 self.records.append(metadata_filename)
@@ -252,6 +376,8 @@ class Crawler(object):
                 # if the file has not changed since the last run then skip it
                 if self.update and metadata_filename in self.hashIndex and self.hashIndex[metadata_filename] == record_hash:
                     self.log.debug("Thumbnail has not changed since last update")
+                    Metrics.count('crawl', 'skipped')
+                    self._notify(metadata_filename)
                     return
                 else:
                     self.log.debug("Thumbnail is new or changed since last run")
@@ -261,10 +387,14 @@ class Crawler(object):
                     cache_record = self.cache.put(metadata_filename, dobj_path)
                     # store the digital object metadata in the cache
                     dobj.write(self.output, Filename=metadata_filename, Id=eaccpf_id, CacheRecord=cache_record)
+                    Metrics.count('crawl', 'processed')
+                    Metrics.countFile('crawl', 'bytes_written', self.output + os.sep + metadata_filename)
                     # record the metadata hash so that we can track whether its
                     # changed on the next processing run
                     self.hashIndex[metadata_filename] = record_hash
+                    self._notify(metadata_filename)
             except:
+                Metrics.count('crawl', 'failed')
                 msg = "Could not write thumbnail for {0}".format(doc.getFileName())
                 self.log.error(msg, exc_info=Cfg.LOG_EXC_INFO)
 
@@ -272,14 +402,14 @@ class Crawler(object):
         """
         Store the HTML page content in the output folder.
         """
-        if self._is_excluded(html.filename):
+        if self._is_excluded(html.filename) or not Utils.inShard(html.filename, self.shard):
             return
         self.records.append(html.filename)
         # if the file has not changed since the last run then skip it
         file_hash = Utils.getFileHash(html.source)
         if self.update and html.filename in self.hashIndex and self.hashIndex[html.filename] == file_hash:
             self.log.debug("HTML has not changed since last update {0}".format(html.filename))
-            return
+            Metrics.count('crawl', 'skipped')
         else:
             self.log.debug("HTML is new or changed since last run")
             # ISSUE #32 - if the document does not have a DC.Identifier value
@@ -288,8 +418,11 @@ class Crawler(object):
                 pass
             # store the document in the output folder
             html.write(self.output)
+            Metrics.count('crawl', 'processed')
+            Metrics.countFile('crawl', 'bytes_written', self.output + os.sep + html.filename)
             # record the new or updated file hash
             self.hashIndex[html.filename] = file_hash
+        self._notify(html.filename)
 
     def run(self):
         """
@@ -300,16 +433,16 @@ class Crawler(object):
             assert os.path.exists(self.source), self.log.error("Input path does not exist: {0}".format(self.source))
             if not os.path.exists(self.output):
                 os.makedirs(self.output)
-            Utils.cleanOutputFolder(self.output, Update=self.update)
+            Utils.cleanOutputFolder(self.output, Update=self.update, Shard=self.shard)
             assert os.path.exists(self.output), self.log.error("Output path does not exist: {0}".format(self.output))
             # purge the image cache
-            if not self.update:
+            if not self.update and not self.shard:
                 self.cache.purge()
             # create an index of files hashes so that we can track which files
             # have changed since the last run
             self.records = []
             if self.update:
-                self.hashIndex = Utils.loadFileHashIndex(self.output)
+                self.hashIndex = Utils.loadFileHashIndex(self.output, Shard=self.shard)
             # crawl the document source
             if 'http://' in self.source or 'https://' in self.source:
                 self.crawlWebSite()
@@ -323,18 +456,20 @@ class Crawler(object):
                 Utils.purgeIndex(self.records, self.hashIndex)
                 # remove files from the metadata cache that are not in the index
                 self.log.info("Clearing orphaned files from the output folder")
-                Utils.purgeFolder(self.output, self.hashIndex)
+                Utils.purgeFolder(self.output, self.hashIndex, shard=self.shard)
                 # remove files from the image cache that are not in the index
-                self.log.info("Clearing orphaned files from the image cache")
-                self.cache.purge(list(self.hashIndex.keys()))
+                if not self.shard:
+                    self.log.info("Clearing orphaned files from the image cache")
+                    self.cache.purge(list(self.hashIndex.keys()))
             # write the updated file index
-            Utils.writeFileHashIndex(self.hashIndex, self.output)
+            Utils.writeFileHashIndex(self.hashIndex, self.output, Shard=self.shard)
+        Metrics.recordTime('crawl', t.elapsed, t.cpu)
         # log execution time
-        self.log.info("Crawler finished in {0}:{1}:{2}".format(t.hours, t.minutes, t.seconds))
+        self.log.info("Crawler finished in {0}".format(t))
 
-def crawl(params, update):
+def _getCrawler(params, update=False, shard=None):
     """
-    Execute crawl operations using the specified parameters.
+    Create a crawler with the specified parameters.
     """
     # required configuration values
     actions = params.get("crawl", "actions").split(",")
@@ -346,6 +481,20 @@ def crawl(params, update):
     sleep = params.getfloat("crawl", "sleep") if params.has_option("crawl","sleep") else 0.0
     cache_url = params.get("crawl", "cache-url") if params.has_option("crawl", "cache-url") else '/'
     cache_path = params.get("crawl", "cache") if params.has_option("crawl", "cache") else ''
+    return Crawler(actions, base, source, output, cache_path=cache_path, cache_url=cache_url, sleep=sleep, exclude=exclude, update=update,
+                   shard=shard)
+
+def crawl(params, update, shard=None):
+    """
+    Execute crawl operations using the specified parameters.
+    """
     # create the crawler then start processing
-    crawler = Crawler(actions, base, source, output, cache_path=cache_path, cache_url=cache_url, sleep=sleep, exclude=exclude, update=update)
+    crawler = _getCrawler(params, update, shard)
     crawler.run()
+
+def merge(params):
+    """
+    Merge the file hash indexes written by each shard of the crawl.
+    """
+    crawler = _getCrawler(params)
+    crawler.merge()
@@ -34,14 +34,11 @@ def load_metadata_on_demand(func):
             ### Step 1: find the local path to the HTML file
             pth = self.source.split('/')
             url = self.metadata_url.replace('http://','').replace('https://','').split('/')
-            pth.reverse()
-            url.reverse()
-            for a,b in zip(pth, url):
-                if a == b:
-                    pth.remove(a)
-                    url.remove(b)
-            pth.reverse()
-            url.reverse()
+            # remove the trailing path components that the file system path
+            # and the URL have in common
+            while pth and url and pth[-1] == url[-1]:
+                pth.pop()
+                url.pop()
             # the web site and file system roots
             url_base = 'http://' + '/'.join(url)
             pth_base = '/'.join(pth)
@@ -134,7 +131,7 @@ class DigitalObject(object):
         """
         record = self.getRecord()
         data = yaml.dump(record, default_flow_style=False, indent=4)
-        return hashlib.sha1(data).hexdigest()
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
 
     def getLocalType(self):
         """
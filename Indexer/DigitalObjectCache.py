@@ -51,7 +51,7 @@ class DigitalObjectCache(object):
         existwidth, existheight = img.size
         if (Width < existwidth or Height < existheight):
             size = Width, Height
-            img.thumbnail(size, Image.ANTIALIAS)
+            img.thumbnail(size, Image.LANCZOS)
         # save the image to the a file
         fmt = ext.upper()
         fmt = 'JPEG' if fmt == 'JPG' else fmt
@@ -47,7 +47,8 @@ class EacCpf(object):
         self.ns = { DOC_KEY: DOC_NS, ESRC_KEY: ESRC_NS, XLINK_KEY: XLINK_NS }
         self.presentation = PresentationUrl
         self.source = Source
-        data = Utils.load_from_source(Source)
+        # parse the bytes, as lxml rejects text with an encoding declaration
+        data = Utils.load_from_source(Source, Binary=True)
         self.xml = etree.fromstring(data)
         # some documents may be missing the fully specified eac-cpf document
         # namespace attributes, which will result in failures during subsequent
@@ -492,7 +493,7 @@ class EacCpf(object):
         root[0].set(source, self.source)
         # write the data to the specified path
         path = Path + os.sep + self.getFileName()
-        with open(path, 'w') as outfile:
+        with open(path, 'wb') as outfile:
             data = etree.tostring(self.xml, pretty_print=True)
             outfile.write(data)
         self.log.info("Stored EAC-CPF document " + self.getFileName())
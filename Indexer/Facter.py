@@ -7,8 +7,10 @@ LICENSE file, which is part of this source code package.
 from EacCpf import EacCpf
 
 import Cfg
+import Metrics
 import Timer
 import Utils
+import ast
 import logging
 import os
 import time
@@ -19,15 +21,18 @@ class Facter(object):
     """
     Takes an EAC-CPF record, executes a semantic analysis of the contents and
     attempts to extract people, places, things, concepts from free text or 
-    structured fields.
+    structured fields. When a shard is specified, only the records in that
+    shard are processed, and the file hash index and caches are written as
+    shard-local files to be merged later.
     """
 
-    def __init__(self, actions, source, output, sleep=1.0, update=False, cachedir=None):
+    def __init__(self, actions, source, output, sleep=1.0, update=False, cachedir=None, shard=None):
         self.hashIndex = {}
         self.logger = logging.getLogger()
         # set parameters
         self.actions = actions
         self.output = output
+        self.shard = shard
         self.sleep = sleep
         self.source = source
         self.update = update
@@ -35,7 +40,7 @@ class Facter(object):
         self.locationCache = {}
         
         if cachedir:
-            self.locationCache = Utils.tryReadYaml(self.cachedir, '.location_cache.yml')
+            self.locationCache = self._loadCache('.location_cache.yml')
         
         """
         #Workaround for "New York, United States"--Nominatim assumes I mean the city.
@@ -56,7 +61,7 @@ class Facter(object):
             ufclass = "{}_Inferrer".format(uf)
             ufm = __import__('inferrers.{}'.format(ufmod), globals(), locals(), [ufclass])
             newuf = getattr(ufm, ufclass)()
-            newuf.cache = Utils.tryReadYaml(self.cachedir, "{}_cache".format(ufclass))
+            newuf.cache = self._loadCache("{}_cache".format(ufclass))
             self.ufs.append(newuf)
 
     def _addValueToDictionary(self, dic, key, value):
@@ -102,6 +107,29 @@ class Facter(object):
             pass
         return street, city, region, postal, country
     
+    def _getAddressMapping(self, Address):
+        """
+        Get the structured address mapping for a geocoder address. Addresses
+        that were persisted in string form, either as the text of a mapping or
+        as a formatted address, are converted to a mapping.
+        """
+        if isinstance(Address, dict):
+            return dict([(Utils.cleanText(key), Address[key]) for key in Address])
+        address = str(Address).strip()
+        if address.startswith('{'):
+            # the text of a mapping is evaluated as a literal only
+            try:
+                value = ast.literal_eval(address)
+                if isinstance(value, dict):
+                    return self._getAddressMapping(value)
+            except (SyntaxError, ValueError):
+                pass
+            self.logger.error("Could not convert location address to a mapping: {0}".format(address))
+            return {}
+        street, city, region, postal, country = self._getAddressParts(address)
+        parts = [('road', street), ('city', city), ('state', region), ('postcode', postal), ('country', country)]
+        return dict([(key, value) for key, value in parts if value])
+
     def _getCalaisResultAsDictionary(self, result):
         """
         Convert Calais result to dictionary structure.
@@ -134,6 +162,16 @@ class Facter(object):
             pass
         return out
 
+    def _loadCache(self, Filename):
+        """
+        Load the cache file. A shard adds the entries that it has cached since
+        the shard caches were last merged.
+        """
+        cache = Utils.tryReadYaml(self.cachedir, Filename)
+        if self.shard:
+            cache.update(Utils.tryReadYaml(self.cachedir, Utils.getShardFilename(Filename, self.shard)))
+        return cache
+
     def infer(self):
         """
         Infer data for each source file.
@@ -156,7 +194,8 @@ class Facter(object):
             actions[type(uf).__name__] = uf.infer
             
         
-        for filename in [f for f in os.listdir(self.source) if f.endswith(".xml")]:
+        for filename in [f for f in os.listdir(self.source) if f.endswith(".xml") and Utils.inShard(f, self.shard)]:
+            start = time.perf_counter()
             self.needsleep = []
             records.append(filename)
             
@@ -166,7 +205,9 @@ class Facter(object):
                 doc = EacCpf(self.source + os.sep + filename)
             except:
                 self.logger.error("Could not load file "+filename)
+                Metrics.count('infer', 'failed')
                 continue
+            Metrics.countFile('infer', 'bytes_read', self.source + os.sep + filename)
             # if the file has not changed don't redo successful inferences.
             file_hash = doc.getHash()
             if self.update and filename in self.hashIndex and self.hashIndex[filename] == file_hash:
@@ -189,6 +230,9 @@ class Facter(object):
             
             Utils.writeYaml(self.output, inferred_data_filename, inferred)
             self.logger.info("Wrote inferred data to {0}".format(inferred_data_filename))
+            Metrics.count('infer', 'processed' if doAll else 'skipped')
+            Metrics.countFile('infer', 'bytes_written', self.output + os.sep + inferred_data_filename)
+            Metrics.timeDocument('infer', filename, start)
             
             # Sleep between requests if needed.
             if self.needsleep: 
@@ -261,16 +305,12 @@ class Facter(object):
                 
                 loc = self.locationCache[place['placeentry']]
                 
-                address = loc['address']
-                newaddr = {}
-                for x in address:
-                    newaddr[Utils.cleanText(x)] = address[x]
-                address = newaddr
+                address = self._getAddressMapping(loc['address'])
                 location = place.copy()
                 location['address'] = address
                 location['coordinates'] = [float(loc['lat']), float(loc['lon'])]
                 # split the address into parts
-                location['country'] = address['country'].strip()
+                location['country'] = address.get('country', '').strip()
                 
                 if 'region' in address:
                     location['region'] = address['region'].strip()
@@ -284,6 +324,45 @@ class Facter(object):
                     
         return locations
 
+    def merge(self):
+        """
+        Merge the shard file hash indexes and caches.
+        """
+        Utils.mergeShardIndexes(self.output)
+        if self.cachedir:
+            Utils.mergeShardIndexes(self.cachedir, '.location_cache.yml', Partitioned=False)
+            for uf in self.ufs:
+                Utils.mergeShardIndexes(self.cachedir, "{}_cache".format(type(uf).__name__), Partitioned=False)
+
+    def migrate(self):
+        """
+        Convert the string form location addresses in the inferred data files
+        and the location cache to structured mappings. Return the list of
+        files that were updated.
+        """
+        updated = []
+        for filename in [f for f in os.listdir(self.output) if f.endswith(".yml") and not f == Cfg.HASH_INDEX_FILENAME]:
+            inferred = Utils.tryReadYaml(self.output, filename)
+            locations = inferred.get('locations') if isinstance(inferred, dict) else None
+            changed = False
+            for location in [l for l in locations or [] if 'address' in l and not isinstance(l['address'], dict)]:
+                location['address'] = self._getAddressMapping(location['address'])
+                changed = True
+            if changed:
+                Utils.writeYaml(self.output, filename, inferred)
+                updated.append(filename)
+                self.logger.info("Migrated location addresses in {0}".format(filename))
+        if self.cachedir:
+            changed = False
+            for loc in [l for l in list(self.locationCache.values()) if 'address' in l and not isinstance(l['address'], dict)]:
+                loc['address'] = self._getAddressMapping(loc['address'])
+                changed = True
+            if changed:
+                Utils.writeYaml(self.cachedir, '.location_cache.yml', self.locationCache)
+                updated.append('.location_cache.yml')
+                self.logger.info("Migrated location addresses in the location cache")
+        return updated
+
     def run(self):
         """
         Execute analysis using the specified parameters.
@@ -293,7 +372,7 @@ class Facter(object):
             if not os.path.exists(self.output):
                 os.makedirs(self.output)
             if not self.update:
-                Utils.cleanOutputFolder(self.output)
+                Utils.cleanOutputFolder(self.output, Shard=self.shard)
             # exit if there are no actions to execute
             if len(self.actions) < 1:
                 return
@@ -314,7 +393,7 @@ class Facter(object):
             assert os.path.exists(self.output), self.logger.error("Output path does not exist: {0}".format(self.output))
             # create an index of file hashes, so that we can track what has changed
             if self.update:
-                self.hashIndex = Utils.loadFileHashIndex(self.output)
+                self.hashIndex = Utils.loadFileHashIndex(self.output, Shard=self.shard)
             # execute inference actions
             records = self.infer()
             if self.update:
@@ -327,19 +406,21 @@ class Facter(object):
                 #Utils.purgeFolder(self.output, self.hashIndex)
 
             # write the updated file hash index
-            Utils.writeFileHashIndex(self.hashIndex, self.output)
+            Utils.writeFileHashIndex(self.hashIndex, self.output, Shard=self.shard)
             
             #Write the location cache.
-            Utils.writeYaml(self.cachedir, '.location_cache.yml', self.locationCache)
+            Utils.writeYaml(self.cachedir, Utils.getShardFilename('.location_cache.yml', self.shard), self.locationCache)
             
             for uf in self.ufs:
                 if uf.cache:
-                    Utils.writeYaml(self.cachedir, "{}_cache".format(type(uf).__name__), uf.cache)
+                    filename = Utils.getShardFilename("{}_cache".format(type(uf).__name__), self.shard)
+                    Utils.writeYaml(self.cachedir, filename, uf.cache)
             
+        Metrics.recordTime('infer', t.elapsed, t.cpu)
         # log execution time
-        self.logger.info("Facter finished in {0}:{1}:{2}".format(t.hours, t.minutes, t.seconds))
+        self.logger.info("Facter finished in {0}".format(t))
 
-def infer(params, update=False):
+def infer(params, update=False, shard=None):
     """
     Execute processing actions with the specified parameters.
     """
@@ -348,5 +429,27 @@ def infer(params, update=False):
     sleep = params.getfloat("infer", "sleep")
     source = params.get("infer", "input")
     cachedir = params.get("infer", "cachedir")
-    facter = Facter(actions, source, output, sleep, update, cachedir)
+    facter = Facter(actions, source, output, sleep, update, cachedir, shard)
     facter.run()
+
+def merge(params):
+    """
+    Merge the file hash indexes and caches written by each shard of the
+    inference.
+    """
+    actions = params.get("infer", "actions").split(",")
+    output = params.get("infer", "output")
+    cachedir = params.get("infer", "cachedir")
+    facter = Facter(actions, None, output, cachedir=cachedir)
+    facter.merge()
+
+def migrate(params):
+    """
+    Convert string form location addresses in the inferred data and location
+    cache to structured mappings. This only needs to be run once on data that
+    was inferred by earlier versions.
+    """
+    output = params.get("infer", "output")
+    cachedir = params.get("infer", "cachedir")
+    facter = Facter([], None, output, cachedir=cachedir)
+    facter.migrate()
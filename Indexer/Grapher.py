@@ -8,6 +8,8 @@ from .HtmlPage import HtmlPage
 from matplotlib import pylab
 
 import Cfg
+import Metrics
+import Timer
 import Utils
 import logging
 import matplotlib.pyplot as plt
@@ -15,6 +17,7 @@ import networkx as nx
 import re
 import os
 import tempfile
+import time
 
 GRAPH_FILE = "graph.gml"
 
@@ -72,9 +75,13 @@ class Grapher(object):
             self.log.debug("Scanning {0} ({1})".format(path, base_url))
             for filename in [f for f in files if f.endswith(".htm") or f.endswith(".html")]:
                 self.log.debug("Reading {0}".format(filename))
+                start = time.perf_counter()
+                Metrics.countFile('graph', 'bytes_read', path + os.sep + filename)
                 try:
                     html = HtmlPage(path, filename, base_url)
-                    if html.hasEacCpfAlternate():
+                    if not html.hasEacCpfAlternate():
+                        Metrics.count('graph', 'skipped')
+                    else:
                         html_id = html.getRecordId()
                         html_url = html.getUrl()
                         html_title = html.getTitle()
@@ -113,8 +120,11 @@ class Grapher(object):
                                     rel_url, title = rel
                                     self.graph.add_node(rel_url, label=title, type="relation")
                                     self.graph.add_edge(metadata_url, rel_url)
+                        Metrics.count('graph', 'processed')
                 except:
+                    Metrics.count('graph', 'failed')
                     self.log.error("Could not complete processing for {0}".format(filename), exc_info=Cfg.LOG_EXC_INFO)
+                Metrics.timeDocument('graph', filename, start)
 
     def graph_inferred(self):
         """
@@ -125,21 +135,24 @@ class Grapher(object):
         """
         Execute analysis operations using specified parameters.
         """
-        # make output folder
-        Utils.cleanOutputFolder(self.output)
-        # check state
-        assert os.path.exists(self.source), self.log.error("Source path does not exist: " + self.source)
-        assert os.path.exists(self.output), self.log.error("Output path does not exist: " + self.output)
-        # execute actions
-        self.graph_entities()
-        # generate a PDF of the graph
-        self.save_graph_as_pdf()
-        # write graph file
-        self.save_graph_as_gexf()
+        with Timer.Timer() as t:
+            # make output folder
+            Utils.cleanOutputFolder(self.output)
+            # check state
+            assert os.path.exists(self.source), self.log.error("Source path does not exist: " + self.source)
+            assert os.path.exists(self.output), self.log.error("Output path does not exist: " + self.output)
+            # execute actions
+            self.graph_entities()
+            # generate a PDF of the graph
+            self.save_graph_as_pdf()
+            # write graph file
+            self.save_graph_as_gexf()
+        Metrics.recordTime('graph', t.elapsed, t.cpu)
 
     def save_graph_as_gexf(self):
         tmp = tempfile.mktemp(prefix="graph-", suffix=".gexf")
         nx.write_gexf(self.graph, tmp)
+        Metrics.countFile('graph', 'bytes_written', tmp)
 
     def save_graph_as_pdf(self):
         tmp = tempfile.mktemp(prefix="graph-", suffix=".pdf")
@@ -159,6 +172,7 @@ class Grapher(object):
         plt.ylim(0, ymax)
 
         plt.savefig(tmp, bbox_inches="tight")
+        Metrics.countFile('graph', 'bytes_written', tmp)
         pylab.close()
         del fig
 
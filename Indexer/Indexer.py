@@ -5,7 +5,10 @@ LICENSE file, which is part of this source code package.
 
 import Cfg
 from configparser import ConfigParser 
+import Metrics
+import Profiler
 import Timer
+import Utils
 import argparse
 import logging
 import sys
@@ -39,15 +42,39 @@ class Indexer(object):
         self.parser.add_argument('--infer',
                                  help="infer concepts, entities, locations from metadata",
                                  action='store_true')
+        self.parser.add_argument('--merge-shards',
+                                 help="merge the indexes written by each shard of a sharded run, then build the analysis report",
+                                 action='store_true', dest='merge_shards')
+        self.parser.add_argument('--migrate',
+                                 help="convert string form location addresses in the inferred data and location cache to structured mappings",
+                                 action='store_true')
+        self.parser.add_argument('--pipeline',
+                                 help="stream documents through the crawl, clean, transform and post stages together, then run the other stages",
+                                 action='store_true')
         self.parser.add_argument('--post',
                                  help="post metadata to Apache Solr index",
                                  action='store_true')
+        self.parser.add_argument('--post-retry',
+                                 help="resend the documents in the post dead letter folder to the Apache Solr index",
+                                 action='store_true', dest='post_retry')
+        self.parser.add_argument('--profile',
+                                 help="profile each stage and write a profile file for each stage to the metrics profile folder",
+                                 choices=Profiler.MODES)
         self.parser.add_argument('--transform',
                                  help="transform metadata to Solr Input Document format",
                                  action='store_true')
+        self.parser.add_argument('--validate',
+                                 help="validate metadata files against the EAC-CPF schema and write an error report",
+                                 action='store_true')
+        self.parser.add_argument('--shard',
+                                 help="process only the records in shard i of N, partitioned by a hash of the record ID",
+                                 metavar='i/N', type=Utils.getShard)
         self.parser.add_argument('--update',
                                  help="process only those files that have changed since the last run",
                                  action='store_true')
+        self.parser.add_argument('--watch',
+                                 help="stream documents through the crawl, clean, transform and post stages, then watch the crawl input and stream each change through them",
+                                 action='store_true')
         self.parser.add_argument('--loglevel',
                                  help="set the logging level",
                                  choices=['DEBUG','INFO','ERROR'],
@@ -78,6 +105,17 @@ class Indexer(object):
         self.logger.addHandler(sh)
         self.logger.setLevel(level)
 
+    def mergeShards(self):
+        """
+        Merge the indexes written by each shard of a sharded run for each
+        configured stage.
+        """
+        for section, module in [('crawl', 'Crawler'), ('clean', 'Cleaner'), ('infer', 'Facter'),
+                                ('transform', 'Transformer'), ('post', 'Poster'), ('analyze', 'Analyzer')]:
+            if self.config.has_section(section):
+                __import__(module).merge(self.config)
+                self.logger.info("Merged the {0} shards".format(section))
+
     def run(self):
         """
         Start processing.
@@ -99,30 +137,67 @@ class Indexer(object):
             sys.exit(e)
         # set options
         Cfg.LOG_EXC_INFO = self.args.trace
+        # configure metrics and profiling
+        Metrics.configure(self.config)
+        if self.args.profile:
+            output = self.config.get("metrics", "profile") if self.config.has_option("metrics", "profile") else Profiler.OUTPUT
+            Profiler.configure(self.args.profile, output)
         # execute commands
         with Timer.Timer() as t:
-            if self.args.crawl:
+            pipelined = []
+            if self.args.pipeline or self.args.watch:
+                import Pipeline
+                pipelined = [stage for stage in Pipeline.STAGES if getattr(self.args, stage)]
+            if self.args.pipeline and not self.args.watch:
+                Pipeline.pipeline(self.config, pipelined, self.args.update, self.args.shard)
+            if self.args.crawl and not 'crawl' in pipelined:
                 import Crawler
-                Crawler.crawl(self.config, self.args.update)
-            if self.args.clean:
+                with Profiler.profile('crawl'):
+                    Crawler.crawl(self.config, self.args.update, self.args.shard)
+            if self.args.clean and not 'clean' in pipelined:
                 import Cleaner
-                Cleaner.clean(self.config, self.args.update)
+                with Profiler.profile('clean'):
+                    Cleaner.clean(self.config, self.args.update, self.args.shard)
+            if self.args.validate:
+                import Validator
+                with Profiler.profile('validate'):
+                    Validator.validate(self.config, self.args.update)
+            if self.args.migrate:
+                import Facter
+                with Profiler.profile('migrate'):
+                    Facter.migrate(self.config)
             if self.args.infer:
                 import Facter
-                Facter.infer(self.config, self.args.update)
+                with Profiler.profile('infer'):
+                    Facter.infer(self.config, self.args.update, self.args.shard)
             if self.args.graph:
                 import Grapher
-                Grapher.graph(self.config, self.args.update)
-            if self.args.transform:
+                with Profiler.profile('graph'):
+                    Grapher.graph(self.config, self.args.update)
+            if self.args.transform and not 'transform' in pipelined:
                 import Transformer
-                Transformer.transform(self.config)
-            if self.args.post:
+                with Profiler.profile('transform'):
+                    Transformer.transform(self.config, self.args.update, self.args.shard)
+            if self.args.post and not 'post' in pipelined:
+                import Poster
+                with Profiler.profile('post'):
+                    Poster.post(self.config, self.args.update, self.args.shard)
+            if self.args.post_retry:
                 import Poster
-                Poster.post(self.config)
+                with Profiler.profile('post-retry'):
+                    Poster.retry(self.config, self.args.shard)
             if self.args.analyze:
                 import Analyzer
-                Analyzer.analyze(self.config, self.args.update)
-        self.logger.info("Indexer finished in {0}:{1}:{2}".format(t.hours, t.minutes, t.seconds))
+                with Profiler.profile('analyze'):
+                    Analyzer.analyze(self.config, self.args.update, self.args.shard)
+            if self.args.merge_shards:
+                self.mergeShards()
+            if self.args.watch:
+                import Watcher
+                Watcher.watch(self.config, pipelined, self.args.shard)
+        # write the run report
+        Metrics.write(self.config)
+        self.logger.info("Indexer finished in {0}".format(t))
 
 
 # entry point
@@ -0,0 +1,265 @@
+"""
+This file is subject to the terms and conditions defined in the
+LICENSE file, which is part of this source code package.
+"""
+
+import datetime
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+
+__description__ = """Records the time, documents and bytes processed by each stage, and writes a run report."""
+
+# document and byte counters recorded for each stage
+COUNTERS = ['processed', 'skipped', 'failed', 'bytes_read', 'bytes_written']
+
+# prefix of the Prometheus metric names
+PROMETHEUS_PREFIX = "indexer"
+
+# default number of seconds that a stage may take to process a document
+# before the document is written to the slow log
+SLOW_THRESHOLD = 1.0
+
+# the metrics of each stage of the run, in the order that the stages were
+# first recorded
+_lock = threading.Lock()
+_run = {'started': time.time(), 'slow_threshold': None}
+_stages = {}
+
+# the seconds that each stage took to process each document, when the slow
+# log is enabled
+_documents = {}
+
+# the stage modules import this module as Metrics, while the Analyzer and the
+# tests import it from the Indexer package. Register it under both names so
+# that every stage records to the same registry.
+sys.modules.setdefault('Metrics', sys.modules[__name__])
+sys.modules.setdefault('Indexer.Metrics', sys.modules[__name__])
+
+
+def _getStage(Stage):
+    """
+    Get the metrics of the stage, adding the stage if it has not been
+    recorded yet. The caller must hold the lock.
+    """
+    if not Stage in _stages:
+        _stages[Stage] = dict([(counter, 0) for counter in COUNTERS])
+        _stages[Stage].update({'wall_seconds': 0.0, 'cpu_seconds': 0.0})
+    return _stages[Stage]
+
+def _writeAtomic(Path, Data):
+    """
+    Write the data to a temporary file, then move it into place, so that
+    readers never see a partly written file.
+    """
+    folder = os.path.dirname(os.path.abspath(Path))
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    temp = "{0}.{1}.tmp".format(Path, os.getpid())
+    with open(temp, 'w') as f:
+        f.write(Data)
+    os.replace(temp, Path)
+
+def addDocumentTimes(Times):
+    """
+    Add the document times recorded by another process, such as a worker
+    process, to the document times of this run.
+    """
+    with _lock:
+        for record_id in Times:
+            times = _documents.setdefault(record_id, {})
+            for stage, seconds in Times[record_id].items():
+                times[stage] = times.get(stage, 0.0) + seconds
+
+def configure(params):
+    """
+    Start a new run. Time each document for the slow log if a slow log is
+    specified in the metrics section of the parameters.
+    """
+    reset()
+    threshold = None
+    if params.has_option("metrics", "slow-log"):
+        threshold = SLOW_THRESHOLD
+        if params.has_option("metrics", "slow-threshold"):
+            threshold = params.getfloat("metrics", "slow-threshold")
+    _run['slow_threshold'] = threshold
+
+def count(Stage, Counter, Value=1):
+    """
+    Add the value to the stage counter.
+    """
+    assert Counter in COUNTERS, "Unknown counter: {0}".format(Counter)
+    with _lock:
+        _getStage(Stage)[Counter] += Value
+
+def countFile(Stage, Counter, Path):
+    """
+    Add the size of the file to the stage byte counter. Files that do not
+    exist are ignored.
+    """
+    try:
+        size = os.path.getsize(Path)
+    except OSError:
+        return
+    count(Stage, Counter, size)
+
+def getDocumentTimes():
+    """
+    Get the seconds that each stage took to process each document, by
+    record ID.
+    """
+    with _lock:
+        return dict([(record_id, dict(times)) for record_id, times in _documents.items()])
+
+def getPrometheus(Report):
+    """
+    Get the run report in the Prometheus text exposition format. Each value
+    is a gauge that describes the last run.
+    """
+    metrics = [
+        ('stage_wall_seconds', "Wall clock time of the stage.", None, 'wall_seconds'),
+        ('stage_cpu_seconds', "CPU time used while the stage ran.", None, 'cpu_seconds'),
+        ('stage_documents', "Documents handled by the stage.", 'status', ['processed', 'skipped', 'failed']),
+        ('stage_bytes', "Bytes read and written by the stage.", 'direction', ['bytes_read', 'bytes_written']),
+        ('stage_throughput', "Documents processed per second of wall clock time.", None, 'throughput'),
+    ]
+    lines = []
+    for name, description, label, keys in metrics:
+        name = "{0}_{1}".format(PROMETHEUS_PREFIX, name)
+        lines.append("# HELP {0} {1}".format(name, description))
+        lines.append("# TYPE {0} gauge".format(name))
+        for stage in Report['stages']:
+            values = Report['stages'][stage]
+            if label is None:
+                lines.append('{0}{{stage="{1}"}} {2}'.format(name, stage, values[keys]))
+            else:
+                for key in keys:
+                    value = key.replace('bytes_', '')
+                    lines.append('{0}{{stage="{1}",{2}="{3}"}} {4}'.format(name, stage, label, value, values[key]))
+    for name, description, value in [
+        ('run_wall_seconds', "Wall clock time of the run.", Report['wall_seconds']),
+        ('run_finished_timestamp_seconds', "Time at which the run finished.", time.time())]:
+        name = "{0}_{1}".format(PROMETHEUS_PREFIX, name)
+        lines.extend(["# HELP {0} {1}".format(name, description), "# TYPE {0} gauge".format(name),
+                      "{0} {1}".format(name, value)])
+    return '\n'.join(lines) + '\n'
+
+def getReport():
+    """
+    Get the run report: the start and end time of the run, and the wall and
+    CPU time, counters and throughput in documents per second of each stage.
+    """
+    finished = time.time()
+    with _lock:
+        stages = dict([(stage, dict(_stages[stage])) for stage in _stages])
+    for stage in list(stages.values()):
+        wall = stage['wall_seconds']
+        stage['throughput'] = stage['processed'] / wall if wall else 0.0
+    return {
+        'started': datetime.datetime.fromtimestamp(_run['started']).isoformat(),
+        'finished': datetime.datetime.fromtimestamp(finished).isoformat(),
+        'wall_seconds': finished - _run['started'],
+        'stages': stages,
+    }
+
+def getSlowDocuments():
+    """
+    Get the documents that took longer than the slow log threshold in any
+    stage, slowest first. Return a list of (record ID, total seconds, list
+    of (stage, seconds)) in the order that the stages ran.
+    """
+    threshold = _run['slow_threshold']
+    if threshold is None:
+        return []
+    with _lock:
+        order = list(_stages.keys())
+        slow = [(record_id, dict(times)) for record_id, times in _documents.items() if max(times.values()) > threshold]
+    documents = []
+    for record_id, times in slow:
+        stages = sorted(times.items(), key=lambda item: order.index(item[0]) if item[0] in order else len(order))
+        documents.append((record_id, sum(times.values()), stages))
+    return sorted(documents, key=lambda document: -document[1])
+
+def recordTime(Stage, Wall, Cpu=0.0):
+    """
+    Add the wall clock and CPU time in seconds to the stage.
+    """
+    with _lock:
+        stage = _getStage(Stage)
+        stage['wall_seconds'] += Wall
+        stage['cpu_seconds'] += Cpu
+
+def reset():
+    """
+    Clear the metrics of all stages, and start a new run.
+    """
+    with _lock:
+        _documents.clear()
+        _stages.clear()
+        _run['started'] = time.time()
+
+def timeDocument(Stage, Filename, Start):
+    """
+    Record the time since the start, from time.perf_counter, that the stage
+    took to process the document, if the slow log is enabled. The times of
+    the documents of a record are added together.
+    """
+    if _run['slow_threshold'] is None:
+        return
+    seconds = time.perf_counter() - Start
+    record_id = os.path.splitext(os.path.basename(Filename))[0]
+    with _lock:
+        times = _documents.setdefault(record_id, {})
+        times[Stage] = times.get(Stage, 0.0) + seconds
+
+def write(params):
+    """
+    Write the JSON run report and the Prometheus textfile to the paths in
+    the metrics section of the parameters, if they are specified.
+    """
+    report = getReport()
+    if params.has_option("metrics", "report"):
+        writeReport(params.get("metrics", "report"), report)
+    if params.has_option("metrics", "prometheus"):
+        writePrometheus(params.get("metrics", "prometheus"), report)
+    if params.has_option("metrics", "slow-log"):
+        writeSlowLog(params.get("metrics", "slow-log"))
+    for stage in report['stages']:
+        values = report['stages'][stage]
+        logging.getLogger().info("{0}: {1} processed, {2} skipped, {3} failed in {4:.3f}s ({5:.1f} documents/s)".format(
+            stage, values['processed'], values['skipped'], values['failed'], values['wall_seconds'], values['throughput']))
+
+def writePrometheus(Path, Report=None):
+    """
+    Write the run report to a Prometheus node exporter textfile.
+    """
+    _writeAtomic(Path, getPrometheus(Report if Report else getReport()))
+
+def writeReport(Path, Report=None):
+    """
+    Write the run report to a JSON file.
+    """
+    _writeAtomic(Path, json.dumps(Report if Report else getReport(), indent=2, sort_keys=True))
+
+def writeSlowLog(Path):
+    """
+    Append a line to the slow log for each document that took longer than
+    the threshold in any stage, with the time that each stage took.
+    """
+    documents = getSlowDocuments()
+    if not documents:
+        return
+    folder = os.path.dirname(os.path.abspath(Path))
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    timestamp = datetime.datetime.now().isoformat(timespec='seconds')
+    with open(Path, 'a') as f:
+        for record_id, total, stages in documents:
+            times = ' '.join(["{0}={1:.3f}s".format(stage, seconds) for stage, seconds in stages])
+            f.write("{0} {1} {2:.3f}s {3}\n".format(timestamp, record_id, total, times))
+    logging.getLogger().warning("{0} documents took longer than {1}s in a stage. See the slow log {2}".format(
+        len(documents), _run['slow_threshold'], Path))
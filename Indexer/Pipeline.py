@@ -0,0 +1,326 @@
+"""
+This file is subject to the terms and conditions defined in the
+LICENSE file, which is part of this source code package.
+"""
+
+import Cfg
+import Metrics
+import Profiler
+import Timer
+import Utils
+import logging
+import os
+import queue
+import threading
+import time
+
+
+__description__ = """Streams documents through the crawl, clean, transform and post stages."""
+
+# stages that can be pipelined, in processing order
+STAGES = ['crawl', 'clean', 'transform', 'post']
+
+# default maximum number of documents waiting for each stage
+QUEUE_SIZE = 100
+
+# default number of worker threads for the clean and transform stages
+WORKERS = 1
+
+
+class Pipeline(object):
+    """
+    Streams documents through consecutive crawl, clean, transform and post
+    stages, rather than running each stage over all documents before the
+    next stage starts. Each document is passed to the next stage through a
+    bounded queue as soon as it has been processed, so that the first
+    documents are posted while later documents are still being crawled. The
+    clean and transform stages each have a pool of worker threads, and the
+    Poster posts batches concurrently as configured.
+
+    Each stage still writes its output folder and file hash index, so that
+    the intermediate documents are available for audit and later runs. When
+    updating, each stage passes unchanged documents on, and the next stage
+    skips them by its own hash index. This lets each stage remove the
+    documents whose sources were deleted once its input has ended.
+
+    Only EAC-CPF documents are streamed through the transform stage. HTML
+    and digital object documents are transformed once the transform input
+    has ended, and are then posted. The YAML records that are merged into
+    documents are indexed when the transform stage starts, so records that
+    are crawled in the same run are merged on the next update.
+
+    When the paths of changed source files are given, only the records
+    produced from those files are crawled and passed through the following
+    stages. Each stage keeps the documents of the records that were not
+    crawled, and removes the documents of the records that no longer exist.
+    The EAC-CPF document of each record is transformed again when any of
+    its documents change.
+
+    The wall clock time of each stage is recorded from the start of the run
+    until the stage is complete, and its CPU time is the time used by the
+    threads of the stage, as the stages run at the same time.
+    """
+
+    def __init__(self, stages, crawler=None, cleaner=None, transformer=None, poster=None, workers=WORKERS,
+                 queue_size=QUEUE_SIZE, output_format='xml'):
+        assert stages and ' '.join(stages) in ' '.join(STAGES), "Pipeline stages must be consecutive: {0}".format(stages)
+        self.local = threading.local()
+        self.cpu = {}
+        self.lock = threading.Lock()
+        self.locks = {}
+        self.log = logging.getLogger()
+        self.paths = None
+        self.streamed = set()
+        # set parameters
+        self.cleaner = cleaner
+        self.crawler = crawler
+        self.output_format = output_format
+        self.poster = poster
+        self.queue_size = queue_size
+        self.stages = stages
+        self.transformer = transformer
+        self.workers = max(workers, 1)
+
+    def _clean(self, Item):
+        """
+        Clean the crawled document. Return the cleaned document.
+        """
+        path, filename = Item
+        if self.cleaner.cleanFile(filename):
+            return self.cleaner.output, filename
+
+    def _complete(self, Stage, Output):
+        """
+        Complete the stage once its input has ended.
+        """
+        if Stage == 'clean':
+            if self.paths is None:
+                self.cleaner.complete()
+            else:
+                self.cleaner.complete(Partial=True)
+        elif Stage == 'transform':
+            transformer = self.transformer
+            if "digitalobjects-to-sid" in transformer.actions:
+                transformer.transformDigitalObjectsToSID(transformer.sources, transformer.output)
+            if "html-to-sid" in transformer.actions:
+                transformer.transformHtmlsToSid(transformer.sources, transformer.output)
+            if self.paths is None:
+                transformer.complete()
+            else:
+                transformer.complete(Partial=True)
+            # pass on the documents that were not streamed
+            if Output:
+                extension = "." + self.output_format
+                if self.paths is None:
+                    filenames = os.listdir(transformer.output)
+                else:
+                    filenames = [f for f in set(transformer.records) if os.path.exists(transformer.output + os.sep + f)]
+                for filename in sorted(filenames):
+                    if filename.endswith(extension) and not filename in self.streamed:
+                        Output.put((transformer.output, filename))
+        elif Stage == 'post' and self.paths is None:
+            # the actions that follow the post, such as optimize
+            actions = self.poster.actions
+            for action in actions[actions.index('post') + 1:] if 'post' in actions else []:
+                getattr(self.poster, action)()
+
+    def _crawl(self, Output):
+        """
+        Crawl the source and pass each record to the next stage as it is
+        crawled.
+        """
+        if Output:
+            self.crawler.notify = lambda filename: Output.put((self.crawler.output, filename))
+        try:
+            if self.paths is None:
+                self.crawler.run()
+            else:
+                self.crawler.crawlPaths(self.paths)
+        except:
+            self.log.error("Could not complete the crawl", exc_info=Cfg.LOG_EXC_INFO)
+
+    def _list(self, Stage, Output):
+        """
+        Pass the documents in the input folder of the first stage to it.
+        """
+        if Stage == 'clean':
+            for filename in sorted(os.listdir(self.cleaner.source)):
+                Output.put((self.cleaner.source, filename))
+        elif Stage == 'transform':
+            for source in [s for s in self.transformer.sources if os.path.exists(s)]:
+                for filename in sorted([f for f in os.listdir(source) if f.endswith(".xml")]):
+                    Output.put((source, filename))
+        elif Stage == 'post':
+            for filename in sorted([f for f in os.listdir(self.poster.source) if f.endswith("." + self.output_format)]):
+                Output.put((self.poster.source, filename))
+
+    def _post(self, Input):
+        """
+        Post the documents as they arrive.
+        """
+        ended = []
+        def stream():
+            for path, filename in iter(Input.get, None):
+                yield filename
+            ended.append(True)
+        try:
+            self.poster.post(stream(), self.output_format)
+        except:
+            self.log.error("Could not complete the post", exc_info=Cfg.LOG_EXC_INFO)
+        # keep the earlier stages from blocking on a full queue
+        if not ended:
+            while Input.get() is not None:
+                pass
+
+    def _timed(self, Stage, Function, *Args):
+        """
+        Call the function, and add the CPU time that the current thread used
+        to the stage. Profile the call as part of the stage, if profiling is
+        enabled.
+        """
+        start = time.thread_time()
+        try:
+            with Profiler.profile(Stage):
+                Function(*Args)
+        finally:
+            with self.lock:
+                self.cpu[Stage] = self.cpu.get(Stage, 0.0) + time.thread_time() - start
+
+    def _transform(self, Item):
+        """
+        Transform the EAC-CPF document. Return the Solr Input Document. When
+        only the changed records are processed, the EAC-CPF document is also
+        transformed when the YAML record to be merged into it has changed.
+        """
+        path, filename = Item
+        if not "eaccpf-to-sid" in self.transformer.actions:
+            return None
+        if not filename.endswith(".xml") and not (self.paths is not None and filename.endswith(".yml")):
+            return None
+        # compiled stylesheets can not be shared between threads
+        if not hasattr(self.local, 'transform'):
+            self.local.transform = Utils.loadTransform(self.transformer.xslt)
+        if self.paths is None:
+            sid_filename = self.transformer.transformFile(path, filename, self.local.transform)
+        else:
+            # the documents of a record may be transformed by two workers
+            record_id = Utils.getRecordIdFromFilename(filename)
+            with self.lock:
+                lock = self.locks.setdefault(record_id, threading.Lock())
+            with lock:
+                sid_filename = self.transformer.transformRecord(record_id, self.local.transform)
+        if sid_filename:
+            self.streamed.add(sid_filename)
+            return self.transformer.output, sid_filename
+
+    def _work(self, Stage, Function, Input, Output):
+        """
+        Apply the stage function to each document in the input queue until
+        the input ends. Pass the result to the output queue.
+        """
+        for item in iter(Input.get, None):
+            start = time.perf_counter()
+            try:
+                result = Function(item)
+            except:
+                self.log.error("Could not process {0}".format(item[1]), exc_info=Cfg.LOG_EXC_INFO)
+                continue
+            finally:
+                Metrics.timeDocument(Stage, item[1], start)
+            if result and Output:
+                Output.put(result)
+
+    def run(self, Paths=None):
+        """
+        Run the stages together. Complete each stage in turn as its input
+        ends. If a list of changed source file paths is given, then only the
+        records produced from those files are processed.
+        """
+        assert Paths is None or self.stages[0] == 'crawl', "Changed paths can only be processed from the crawl stage"
+        self.cpu = {}
+        self.paths = Paths
+        self.locks = {}
+        start = time.perf_counter()
+        with Timer.Timer() as t:
+            # the clean stage reads the crawl output folder as it is written
+            if self.crawler and 'crawl' in self.stages and not os.path.exists(self.crawler.output):
+                os.makedirs(self.crawler.output)
+            if self.cleaner and 'clean' in self.stages:
+                self.cleaner.prepare()
+            if self.poster and 'post' in self.stages and Paths is None:
+                # the actions that precede the post, such as flush
+                actions = self.poster.actions
+                assert 'reindex' not in actions, "The reindex action can not be pipelined"
+                for action in actions[:actions.index('post')] if 'post' in actions else actions:
+                    getattr(self.poster, action)()
+            if self.transformer and 'transform' in self.stages:
+                self.transformer.prepare(Paths is not None)
+                # documents are posted before the manifest is written
+                if 'post' in self.stages:
+                    self.poster.manifest = self.transformer.manifest
+            self.streamed = set()
+            queues = dict([(stage, queue.Queue(self.queue_size)) for stage in self.stages])
+            threads = {}
+            for i, stage in enumerate(self.stages):
+                output = queues[self.stages[i + 1]] if i + 1 < len(self.stages) else None
+                if stage == 'crawl':
+                    threads[stage] = [threading.Thread(target=self._timed, args=(stage, self._crawl, output))]
+                elif stage == 'post':
+                    threads[stage] = [threading.Thread(target=self._timed, args=(stage, self._post, queues[stage]))]
+                else:
+                    function = self._clean if stage == 'clean' else self._transform
+                    threads[stage] = [threading.Thread(target=self._timed,
+                                                       args=(stage, self._work, stage, function, queues[stage], output))
+                                      for _ in range(self.workers)]
+                for thread in threads[stage]:
+                    thread.daemon = True
+                    thread.start()
+            if self.stages[0] != 'crawl':
+                self._list(self.stages[0], queues[self.stages[0]])
+            # end the input of each stage once the stages before it are
+            # complete
+            for i, stage in enumerate(self.stages):
+                if stage != 'crawl':
+                    for _ in threads[stage]:
+                        queues[stage].put(None)
+                for thread in threads[stage]:
+                    thread.join()
+                output = queues[self.stages[i + 1]] if i + 1 < len(self.stages) else None
+                self._timed(stage, self._complete, stage, output)
+                Metrics.recordTime(stage, time.perf_counter() - start, self.cpu.get(stage, 0.0))
+        self.log.info("Pipeline finished in {0}".format(t))
+
+
+def _getPipeline(params, stages, update=False, shard=None):
+    """
+    Construct a pipeline of the specified stages with the specified
+    parameters.
+    """
+    crawler = cleaner = transformer = poster = None
+    if 'crawl' in stages:
+        import Crawler
+        crawler = Crawler._getCrawler(params, update, shard)
+    if 'clean' in stages:
+        import Cleaner
+        cleaner = Cleaner._getCleaner(params, update, shard)
+    if 'transform' in stages:
+        import Transformer
+        transformer = Transformer._getTransformer(params, update, shard)
+    if 'post' in stages:
+        import Poster
+        actions = params.get("post", "actions").split(",")
+        poster = Poster._getPoster(params, actions, update, shard)
+    workers = params.getint("pipeline", "workers") if params.has_option("pipeline", "workers") else WORKERS
+    queue_size = params.getint("pipeline", "queue-size") if params.has_option("pipeline", "queue-size") else QUEUE_SIZE
+    output_format = params.get("transform", "format") if params.has_option("transform", "format") else 'xml'
+    return Pipeline(stages, crawler=crawler, cleaner=cleaner, transformer=transformer, poster=poster, workers=workers,
+                    queue_size=queue_size, output_format=output_format)
+
+def pipeline(params, stages, update=False, shard=None):
+    """
+    Stream documents through the specified stages with the specified
+    parameters. If a shard is specified, only the documents of the records in
+    that shard are processed.
+    """
+    runner = _getPipeline(params, stages, update, shard)
+    runner.run()
@@ -6,43 +6,631 @@ LICENSE file, which is part of this source code package.
 from lxml import etree
 
 import Cfg
+import Metrics
 import Timer
+import Utils
 import argparse
+import hashlib
+import json
 import logging
 import os
+import random
 import requests
+import shutil
 import sys
+import threading
+import zlib
 
-from time import sleep
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from time import perf_counter, sleep, time
+from xml.sax.saxutils import escape
 
 
-__description__ = """Posts Solr Input Documents to a Solr core. Performs flush, delete, commit and optimize commands."""
+__description__ = """Posts Solr Input Documents to a Solr core. Performs flush, delete, commit, optimize and reindex commands."""
+
+# default maximum number of documents and bytes posted in one request
+BATCH_BYTES = 4 * 1024 * 1024
+BATCH_SIZE = 100
+
+# commit policies: a hard commit at the end of the post only, soft commits
+# after each commit interval number of documents, or commitWithin on each
+# update. Every policy ends the post with a hard commit.
+COMMIT_INTERVAL = 10000
+COMMIT_POLICIES = ['hard', 'soft', 'within']
+COMMIT_WITHIN = 10000
+
+# default number of batches posted concurrently
+CONCURRENCY = 1
+
+# batch request bodies are streamed to Solr in chunks of about this many
+# bytes, optionally gzip compressed
+STREAM_CHUNK_BYTES = 64 * 1024
+
+# documents that could not be posted are copied to the dead letter folder
+# with a report of the reason that each one failed
+DEAD_LETTER_REPORT_FILENAME = "report.yml"
+
+# requests that fail with a connection error or one of these status codes are
+# retried with jittered exponential backoff. After a number of consecutive
+# failures the circuit breaker opens and no requests are sent until it resets.
+BACKOFF = 0.5
+BREAKER_RESET = 30.0
+BREAKER_THRESHOLD = 5
+MAX_BACKOFF = 30.0
+RETRIES = 3
+RETRY_STATUS_CODES = [429, 502, 503, 504]
+
+# Solr response time in seconds above which the poster reduces the number of
+# requests in flight, then pauses between requests
+TARGET_LATENCY = 2.0
+
+# update handler for Solr JSON documents, relative to the update handler
+JSON_UPDATE_HANDLER = "/json/docs"
+
+# a reindex posts into a staging core, then makes it live by swapping it with
+# the live core through the CoreAdmin API, or by pointing the live collection
+# alias at it through the Collections API
+SWAP_MODES = ['alias', 'core']
 
 
 class Poster(object):
     """
     Posts Solr Input Documents to a Solr core. Performs post, flush, commit and
-    optimize commands.
+    optimize commands. XML documents are posted to the XML update handler.
+    JSON documents, written one per line by the Transformer, are posted to
+    the JSON document update handler as they are. XML documents that the
+    Transformer recorded in its manifest are also posted as they are, and
+    other XML documents are parsed to remove empty fields. Documents are
+    posted in batches that are limited by document count and size. A batch
+    that Solr rejects is bisected, so that only the documents that caused the
+    failure are reported as failed. Requests are sent through a session that keeps
+    connections to Solr alive, and batches may be posted concurrently by a
+    pool of threads. When Solr responds slowly, the number of requests in
+    flight is reduced until response times recover. Batch request bodies are
+    streamed to Solr in chunks rather than joined in memory, and may be gzip
+    compressed to reduce the bytes sent to a remote Solr. Requests that fail
+    because Solr is unavailable are retried, and documents that still could
+    not be posted are written to a dead letter folder to be resent later.
+    When updating, only new and changed documents are posted, and documents
+    whose files were removed are deleted from the index by ID. A reindex
+    posts all documents into a staging core and swaps it with the live core
+    once the document count has been verified, so that the index remains
+    searchable while it is rebuilt. When a shard is specified, only the
+    documents of the records in that shard are posted and deleted, and the
+    index of posted documents is written as a shard-local file to be merged
+    later. A shard can not flush or reindex the whole core.
     @see: http://code.activestate.com/recipes/577909-basic-interface-to-apache-solr/
     """
 
-    def __init__(self, source, url, actions, logger=None):
+    def __init__(self, source, url, actions, logger=None, batch_size=BATCH_SIZE, batch_bytes=BATCH_BYTES,
+                 concurrency=CONCURRENCY, commit_policy='hard', commit_interval=COMMIT_INTERVAL,
+                 commit_within=COMMIT_WITHIN, target_latency=TARGET_LATENCY, dead_letter=None, retries=RETRIES,
+                 backoff=BACKOFF, max_backoff=MAX_BACKOFF, breaker_threshold=BREAKER_THRESHOLD,
+                 breaker_reset=BREAKER_RESET, update=False, staging=None, swap='core', compress=False, shard=None):
+        assert commit_policy in COMMIT_POLICIES, "Unsupported commit policy: {0}".format(commit_policy)
+        assert swap in SWAP_MODES, "Unsupported swap mode: {0}".format(swap)
+        assert not shard or not [a for a in actions if a in ['flush', 'reindex']], \
+            "The flush and reindex actions can not be run on a shard"
         self.headers = { 'Content-type': 'text/xml; charset=utf-8' }
+        self.json_headers = { 'Content-type': 'application/json; charset=utf-8' }
         if logger:
             self.log = logger
         else:
             self.log = logging.getLogger()
         # set parameters
         self.actions = actions
+        self.backoff = backoff
+        self.batch_bytes = batch_bytes
+        self.batch_size = batch_size
+        self.breaker_reset = breaker_reset
+        self.breaker_threshold = breaker_threshold
+        self.commit_interval = commit_interval
+        self.commit_policy = commit_policy
+        self.commit_within = commit_within
+        self.compress = compress
+        self.concurrency = max(concurrency, 1)
+        self.dead_letter = dead_letter
+        self.max_backoff = max_backoff
+        self.retries = retries
+        self.shard = shard
         self.source = source
-        self.url = url + 'update' if url.endswith('/') else url + '/update'
+        self.staging = [s.strip() for s in staging.split(',') if s.strip()] if staging else []
+        self.swap = swap
+        self.update = update
+        self.index = url.rstrip('/')
+        self.url = self.index + '/update'
+        self.json_url = self.url + JSON_UPDATE_HANDLER
+        self.target_latency = target_latency
+        # smoothed Solr response time and the current limit on the number of
+        # requests in flight
+        self.latency = 0.0
+        self.limit = self.concurrency
+        self.lock = threading.Lock()
+        # raw document bytes and bytes sent to Solr in batch request bodies
+        self.bytes_raw = 0
+        self.bytes_sent = 0
+        # consecutive failed requests and the time until which the circuit
+        # breaker is open
+        self.failures = 0
+        self.open_until = 0.0
+        # content hash and document IDs of the files that have been posted,
+        # of the files written by the Transformer, and of the files read for
+        # posting in this run
+        self.manifest = {}
+        self.postedIndex = {}
+        self.read = {}
+        # keep one connection alive for each concurrent request
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _commit(self, Soft=False):
+        """
+        Commit staged data to the Solr core without expunging deletes. A soft
+        commit makes the documents visible to searches without flushing
+        them to storage.
+        """
+        msg = '<commit softCommit="true"/>' if Soft else '<commit/>'
+        resp = self._request(self.url, msg, self.headers)
+        if resp.status_code == 200:
+            self.log.info("{0} staged data to {1}".format("Soft committed" if Soft else "Committed", self.url))
+        else:
+            self.log.error("Commit failed for {0}\n{1}".format(self.url, resp.content))
+        return resp.status_code
+
+    def _delete(self, Ids):
+        """
+        Delete the documents with the specified IDs from the index, in
+        batches. Return True if all documents were deleted.
+        """
+        for i in range(0, len(Ids), self.batch_size):
+            ids = Ids[i:i + self.batch_size]
+            msg = '<delete>' + ''.join(['<id>{0}</id>'.format(escape(str(id))) for id in ids]) + '</delete>'
+            try:
+                resp = self._request(self.url, msg.encode('utf-8'), self.headers)
+            except Exception as e:
+                self.log.error("Delete failed for {0} documents: {1}".format(len(ids), e))
+                return False
+            if resp.status_code != 200:
+                self.log.error("Delete failed for {0} documents\n{1}".format(len(ids), resp.content))
+                return False
+            self.log.info("Deleted {0} documents".format(len(ids)))
+        return True
+
+    def _deleteRemoved(self, Filenames):
+        """
+        Delete the documents whose files have been removed from the source
+        folder, or whose IDs are no longer in their file, since they were
+        last posted. Return the number of documents deleted.
+        """
+        removed = [f for f in self.postedIndex if f not in Filenames]
+        # IDs that are still present, possibly in a different file
+        current = set()
+        for filename in [f for f in Filenames if f in self.read or f in self.postedIndex]:
+            current.update(self.read[filename][1] if filename in self.read else self.postedIndex[filename]['ids'])
+        ids = []
+        for filename in [f for f in self.postedIndex if f in removed or f in self.read]:
+            ids.extend([i for i in self.postedIndex[filename]['ids'] if i not in current and i not in ids])
+        if ids and not self._delete(ids):
+            # keep the removed files in the index so that their documents
+            # are deleted on the next post
+            return 0
+        for filename in removed:
+            del self.postedIndex[filename]
+        return len(ids)
+
+    def _getBackoff(self, Attempt):
+        """
+        Get the number of seconds to wait before retrying a failed request.
+        The delay is drawn at random up to an exponentially increasing limit,
+        so that concurrent requests do not retry in step.
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** Attempt))
+
+    def _getBody(self, Chunks):
+        """
+        Yield the request body for the list of byte chunks in chunks of about
+        the stream chunk size, gzip compressed when compression is enabled.
+        Count the raw bytes and the bytes sent.
+        """
+        compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if self.compress else None
+        buffer = []
+        size = 0
+        raw = 0
+        sent = 0
+        for chunk in Chunks:
+            raw += len(chunk)
+            if compressor:
+                chunk = compressor.compress(chunk)
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= STREAM_CHUNK_BYTES:
+                sent += size
+                yield b''.join(buffer)
+                buffer = []
+                size = 0
+        if compressor:
+            buffer.append(compressor.flush())
+            size += len(buffer[-1])
+        if size:
+            sent += size
+            yield b''.join(buffer)
+        with self.lock:
+            self.bytes_raw += raw
+            self.bytes_sent += sent
+
+    def _getBatches(self, Documents):
+        """
+        Group (filename, data) documents into batches of at most the batch
+        size number of documents and, where possible, the batch byte budget.
+        A document that is larger than the byte budget is posted on its own.
+        """
+        batch = []
+        size = 0
+        for filename, data in Documents:
+            if batch and (len(batch) >= self.batch_size or size + len(data) > self.batch_bytes):
+                yield batch
+                batch = []
+                size = 0
+            batch.append((filename, data))
+            size += len(data)
+        if batch:
+            yield batch
+
+    def _getCount(self, Url):
+        """
+        Get the number of documents in the Solr core at the specified URL.
+        """
+        data = self._getJson(Url + '/select', {'q': '*:*', 'rows': 0, 'wt': 'json'})
+        return data['response']['numFound']
+
+    def _getDocument(self, Filename, Data, Ids=None):
+        """
+        Get the body fragment and the document IDs for the document file: the
+        <doc> elements of an XML document with empty fields removed, or the
+        JSON documents of a JSON file separated by commas. When the IDs are
+        given, the file is recorded in the Transformer manifest and has no
+        empty fields, so the fragment is taken from the file as it is.
+        """
+        if Filename.endswith(".json"):
+            # JSON documents are compact and have no empty fields, so the
+            # documents are used as they are
+            lines = [line.strip() for line in Data.splitlines() if line.strip()]
+            if Ids is None:
+                Ids = [json.loads(line.decode('utf-8')).get('id') for line in lines]
+            return b','.join(lines), Ids
+        if Ids is not None:
+            start = Data.find(b'<add>')
+            end = Data.rfind(b'</add>')
+            if 0 <= start < end:
+                return Data[start + len(b'<add>'):end].strip(), Ids
+        # load the xml document and strip empty tags
+        xml = etree.fromstring(Data)
+        self.strip_empty_elements(xml)
+        docs = list(xml.iter('doc'))
+        ids = [field.text for doc in docs for field in doc.findall("field[@name='id']")]
+        return b''.join([etree.tostring(doc) for doc in docs]), ids
+
+    def _getJson(self, Url, Params):
+        """
+        Execute a GET request against the Solr API and return the decoded
+        JSON response. Raise an exception if the request fails.
+        """
+        resp = self.session.get(Url, params=Params)
+        if resp.status_code != 200:
+            raise Exception("HTTP {0}: {1}".format(resp.status_code, resp.content[:200]))
+        return resp.json()
+
+    def _getStagingCore(self, Base, Live):
+        """
+        Get the name of the core or collection to reindex into. When swapping
+        collection aliases, this is the first staging collection that the
+        live alias does not point to.
+        """
+        if self.swap == 'core':
+            return self.staging[0]
+        aliases = self._getJson(Base + '/admin/collections', {'action': 'LISTALIASES', 'wt': 'json'}).get('aliases', {})
+        current = aliases.get(Live, '').split(',')
+        for name in self.staging:
+            if name not in current:
+                return name
+        raise Exception("All staging collections are in use by alias {0}".format(Live))
+
+    def _isCircuitClosed(self):
+        """
+        Determine if requests may be sent to Solr. When the circuit breaker
+        has been open for the reset period, a trial request is allowed.
+        """
+        with self.lock:
+            return self.open_until <= time()
+
+    def _listDocuments(self, Source):
+        """
+        List the Solr Input Documents in the source folder that belong to the
+        shard.
+        """
+        return sorted([f for f in os.listdir(Source) if (f.endswith(".xml") or f.endswith(".json"))
+                       and Utils.inShard(f, self.shard)])
+
+    def _post(self, Source, Filenames=None, Format='xml'):
+        """
+        Post the Solr Input Documents in the source folder. If an iterable of
+        file names is given, post those documents in the specified format as
+        the file names arrive, instead of listing the folder. Write documents
+        that could not be posted to the dead letter folder.
+        """
+        # check state
+        assert os.path.exists(Source), self.log.error("Source path does not exist: {0}".format(Source))
+        # load the index of posted documents, so that we can track what has
+        # changed since the last post
+        track = os.path.abspath(Source) == os.path.abspath(self.source)
+        self.postedIndex = Utils.loadFileHashIndex(Source, Cfg.POSTED_INDEX_FILENAME, self.shard) if track else {}
+        previous = dict(self.postedIndex)
+        # streamed documents are still being written, so the manifest is
+        # shared with the writer rather than read from the folder
+        if Filenames is None:
+            self.manifest = Utils.loadFileHashIndex(Source, Cfg.MANIFEST_FILENAME, self.shard)
+        self.read = {}
+        self.bytes_raw = 0
+        self.bytes_sent = 0
+        # post documents
+        posted = []
+        errors = []
+        deleted = 0
+        committed = 0
+        if Filenames is None:
+            filenames = self._listDocuments(Source)
+            streams = [('xml', [f for f in filenames if f.endswith(".xml")]),
+                       ('json', [f for f in filenames if f.endswith(".json")])]
+        else:
+            streams = [(Format, (f for f in Filenames if Utils.inShard(f, self.shard)))]
+        try:
+            for fmt, stream in streams:
+                documents = self._readDocuments(Source, stream)
+                for batch_posted, failed in self._postBatches(self._getBatches(documents), fmt):
+                    posted.extend(batch_posted)
+                    errors.extend(failed)
+                    if self.commit_policy == 'soft' and len(posted) - committed >= self.commit_interval:
+                        committed = len(posted)
+                        self._tryCommit(Soft=True)
+            # the source folder is complete once the stream has ended
+            if Filenames is not None:
+                filenames = self._listDocuments(Source)
+            if track:
+                deleted = self._deleteRemoved(filenames)
+            if posted or deleted:
+                self._tryCommit()
+        finally:
+            # record the documents that were posted and that failed, even if
+            # the post was interrupted
+            if track:
+                for filename in posted:
+                    self.postedIndex[filename] = {'hash': self.read[filename][0], 'ids': self.read[filename][1]}
+                if self.postedIndex != previous:
+                    Utils.writeFileHashIndex(self.postedIndex, Source, Cfg.POSTED_INDEX_FILENAME, self.shard)
+            if self.dead_letter:
+                self._writeDeadLetters(Source, posted, errors)
+        # report on the number of documents posted, failed and bytes sent
+        Metrics.count('post', 'processed', len(posted))
+        Metrics.count('post', 'failed', len(errors))
+        Metrics.count('post', 'bytes_written', self.bytes_sent)
+        self.log.info("Posted {0} documents. Deleted {1} documents. {2} errors.".format(len(posted), deleted, len(errors)))
+        if self.bytes_raw:
+            self.log.info("Sent {0} bytes for {1} bytes of documents ({2:.1%})".format(
+                self.bytes_sent, self.bytes_raw, self.bytes_sent / self.bytes_raw))
+
+    def _postBatch(self, Batch, Format):
+        """
+        Post a batch of documents in a single request. If Solr rejects the
+        batch, then bisect it and post each half so that the documents that
+        caused the failure are identified. Return the list of documents
+        posted and the list of (document, reason) that failed.
+        """
+        start = perf_counter()
+        within = self.commit_within if self.commit_policy == 'within' else None
+        if Format == 'json':
+            chunks = [b'['] + [d if i == 0 else b',' + d for i, (f, d) in enumerate(Batch)] + [b']']
+            params = {'commitWithin': within} if within else None
+            resp = self._request(self.json_url, chunks, self.json_headers, params)
+        else:
+            add = '<add commitWithin="{0}">'.format(within).encode('utf-8') if within else b'<add>'
+            chunks = [add] + [d for f, d in Batch] + [b'</add>']
+            resp = self._request(self.url, chunks, self.headers)
+        if resp.status_code == 200:
+            for filename, _ in Batch:
+                self.log.info("Posted {0}".format(filename))
+                Metrics.timeDocument('post', filename, start)
+            return [f for f, _ in Batch], []
+        if len(Batch) == 1:
+            self.log.error("Post failed for {0}\n{1}".format(Batch[0][0], resp.content))
+            return [], [(Batch[0][0], "HTTP {0}: {1}".format(resp.status_code, resp.content[:200]))]
+        self.log.debug("Post failed for a batch of {0} documents, bisecting".format(len(Batch)))
+        middle = len(Batch) // 2
+        posted, failed = [], []
+        for half in [Batch[:middle], Batch[middle:]]:
+            # a half that could not be sent fails on its own, so that the
+            # documents of the other half are still reported as posted
+            try:
+                half_posted, half_failed = self._postBatch(half, Format)
+            except Exception as e:
+                self.log.error("Post failed for {0}".format(', '.join([f for f, _ in half])), exc_info=Cfg.LOG_EXC_INFO)
+                half_posted, half_failed = [], [(f, str(e)) for f, _ in half]
+            posted += half_posted
+            failed += half_failed
+        return posted, failed
+
+    def _postBatches(self, Batches, Format):
+        """
+        Post the batches, with at most the concurrency number of requests in
+        flight. Yield the list of documents posted and the list of documents
+        that failed for each batch as it completes.
+        """
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            pending = set()
+            for batch in Batches:
+                # wait for a request to complete before reading the next batch
+                while len(pending) >= self.limit:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                # Solr is still slow with one request in flight, so give it
+                # time to recover
+                if self.limit == 1 and self.latency > self.target_latency:
+                    sleep(self.latency - self.target_latency)
+                pending.add(executor.submit(self._sendBatch, batch, Format))
+            for future in wait(pending)[0]:
+                yield future.result()
+
+    def _readDocuments(self, Source, Filenames):
+        """
+        Read the documents to be posted. Yield (filename, data) for each
+        document that could be read. When updating, skip documents that have
+        not changed since they were last posted.
+        """
+        for filename in Filenames:
+            try:
+                self.log.debug("Reading {0}".format(filename))
+                with open(Source + os.sep + filename, 'rb') as f:
+                    raw = f.read()
+                fileHash = hashlib.sha1(raw).hexdigest()
+                Metrics.count('post', 'bytes_read', len(raw))
+                if self.update and filename in self.postedIndex and self.postedIndex[filename]['hash'] == fileHash:
+                    Metrics.count('post', 'skipped')
+                    continue
+                entry = self.manifest.get(filename)
+                ids = entry['ids'] if entry and entry.get('hash') == fileHash else None
+                data, ids = self._getDocument(filename, raw, ids)
+                self.read[filename] = (fileHash, ids)
+                yield filename, data
+            except:
+                Metrics.count('post', 'failed')
+                self.log.error("Could not read {0}".format(filename), exc_info=Cfg.LOG_EXC_INFO)
+
+    def _recordFailure(self):
+        """
+        Record a request that failed because Solr is unavailable or
+        overloaded. Open the circuit breaker when the number of consecutive
+        failures reaches the threshold.
+        """
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.breaker_threshold:
+                self.open_until = time() + self.breaker_reset
+                self.log.error("Solr is unavailable after {0} failed requests. Pausing requests for {1} seconds".format(
+                    self.failures, self.breaker_reset))
+
+    def _recordLatency(self, Seconds):
+        """
+        Record the response time of a Solr request. Halve the number of
+        requests in flight while the smoothed response time is above the
+        target latency, and increase it by one while the response time is
+        well below the target.
+        """
+        with self.lock:
+            self.latency = 0.8 * self.latency + 0.2 * Seconds if self.latency else Seconds
+            if self.latency > self.target_latency and self.limit > 1:
+                self.limit = max(self.limit // 2, 1)
+                self.log.debug("Solr response time {0:.2f}s, reducing requests in flight to {1}".format(self.latency, self.limit))
+            elif self.latency < self.target_latency / 2 and self.limit < self.concurrency:
+                self.limit += 1
+
+    def _request(self, Url, Data, Headers, Params=None):
+        """
+        Post the request to Solr. Retry requests that fail with a connection
+        error or a status that indicates that Solr is unavailable, with
+        jittered exponential backoff. Raise an exception if the request could
+        not be completed or the circuit breaker is open. Data given as a list
+        of byte chunks is streamed as the request body.
+        """
+        if isinstance(Data, list) and self.compress:
+            Headers = dict(Headers, **{'Content-Encoding': 'gzip'})
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                sleep(self._getBackoff(attempt - 1))
+            if not self._isCircuitClosed():
+                raise Exception("Circuit breaker is open, Solr is unavailable")
+            start = time()
+            try:
+                data = self._getBody(Data) if isinstance(Data, list) else Data
+                resp = self.session.post(Url, data=data, headers=Headers, params=Params)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+            else:
+                self._recordLatency(time() - start)
+                if resp.status_code not in RETRY_STATUS_CODES:
+                    with self.lock:
+                        self.failures = 0
+                    return resp
+                error = Exception("HTTP {0}".format(resp.status_code))
+            self._recordFailure()
+            self.log.debug("Request to {0} failed on attempt {1}: {2}".format(Url, attempt + 1, error))
+        raise error
+
+    def _sendBatch(self, Batch, Format):
+        """
+        Post a batch of documents. Return the list of documents posted and
+        the list of (document, reason) that failed.
+        """
+        try:
+            self.log.debug("Posting {0} documents".format(len(Batch)))
+            return self._postBatch(Batch, Format)
+        except Exception as e:
+            self.log.error("Post failed for {0}".format(', '.join([f for f, _ in Batch])), exc_info=Cfg.LOG_EXC_INFO)
+            return [], [(f, str(e)) for f, _ in Batch]
+
+    def _swapCores(self, Base, Live, Staging):
+        """
+        Make the staging core live. Swap the staging core with the live core,
+        or point the live collection alias at the staging collection.
+        """
+        if self.swap == 'core':
+            params = {'action': 'SWAP', 'core': Live, 'other': Staging, 'wt': 'json'}
+            self._getJson(Base + '/admin/cores', params)
+        else:
+            params = {'action': 'CREATEALIAS', 'name': Live, 'collections': Staging, 'wt': 'json'}
+            self._getJson(Base + '/admin/collections', params)
+        self.log.info("Swapped {0} into {1}".format(Staging, Live))
+
+    def _tryCommit(self, Soft=False):
+        """
+        Commit staged data to the Solr core. Log the failure and continue if
+        the commit could not be sent, so that the documents already posted
+        are still recorded.
+        """
+        try:
+            self._commit(Soft)
+        except Exception:
+            self.log.error("Commit failed for {0}".format(self.url), exc_info=Cfg.LOG_EXC_INFO)
+
+    def _writeDeadLetters(self, Source, Posted, Failed):
+        """
+        Copy the documents that could not be posted to the dead letter folder
+        and record the reason that each one failed. Remove documents that
+        were posted from the folder and report.
+        """
+        if not os.path.exists(self.dead_letter):
+            os.makedirs(self.dead_letter)
+        report = Utils.loadFileHashIndex(self.dead_letter, DEAD_LETTER_REPORT_FILENAME, self.shard)
+        resend = os.path.abspath(Source) == os.path.abspath(self.dead_letter)
+        for filename, reason in Failed:
+            if not resend:
+                shutil.copy(Source + os.sep + filename, self.dead_letter)
+            report[filename] = reason
+        for filename in [f for f in Posted if f in report]:
+            del report[filename]
+            if resend:
+                os.remove(self.dead_letter + os.sep + filename)
+        Utils.writeFileHashIndex(report, self.dead_letter, DEAD_LETTER_REPORT_FILENAME, self.shard)
+        if report:
+            self.log.error("{0} documents in dead letter folder {1}".format(len(report), self.dead_letter))
 
     def commit(self):
         """
         Commit staged data to the Solr core.
         """
         msg = '<commit expungeDeletes="true"/>'
-        resp = requests.post(self.url, msg, headers=self.headers)
+        resp = self.session.post(self.url, msg, headers=self.headers)
         if resp.status_code == 200:
             self.log.info("Committed staged data to {0}".format(self.url))
         else:
@@ -54,61 +642,81 @@ class Poster(object):
         Flush all documents from the Solr core at the specified URL.
         """
         msg = "<delete><query>*:*</query></delete>"
-        resp = requests.post(self.url, msg, headers=self.headers)
+        resp = self.session.post(self.url, msg, headers=self.headers)
         if resp.status_code == 200:
             self.log.info("Flushed {0}".format(self.url))
         else:
             self.log.error("Flush failed for {0}\n{1}".format(self.url, resp.content), exc_info=Cfg.LOG_EXC_INFO)
         return resp.status_code
 
+    def merge(self):
+        """
+        Merge the shard indexes of posted documents and dead letter reports.
+        """
+        Utils.mergeShardIndexes(self.source, Cfg.POSTED_INDEX_FILENAME)
+        if self.dead_letter:
+            Utils.mergeShardIndexes(self.dead_letter, DEAD_LETTER_REPORT_FILENAME)
+
     def optimize(self):
         """
         Optimize data in Solr core.
         """
         msg = '<optimize waitSearcher="false"/>'
-        resp = requests.post(self.url, msg, headers=self.headers)
+        resp = self.session.post(self.url, msg, headers=self.headers)
         if resp.status_code == 200:
             self.log.info("Optimized {0}".format(self.url))
         else:
             self.log.error("Optimize failed for {0}\n{1}".format(self.url, resp.content), exc_info=Cfg.LOG_EXC_INFO)
         return resp.status_code
 
-    def post(self):
+    def post(self, Filenames=None, Format='xml'):
         """
         Post Solr Input Documents in the Source directory to the Solr core if
-        they have all required fields.
+        they have all required fields. Documents are posted in batches, and
+        committed according to the commit policy. If an iterable of file names
+        in the Source directory is given, then post those documents in the
+        specified format as they arrive.
         """
-        # check state
-        assert os.path.exists(self.source), self.log.error("Source path does not exist: {0}".format(self.source))
-        # post documents
-        posted = 0
-        errors = 0
-        for filename in [f for f in os.listdir(self.source) if f.endswith(".xml")]:
-            try:
-                self.log.debug("Reading {0}".format(filename))
-                # load the xml document and strip empty tags
-                xml = etree.parse(self.source + os.sep + filename)
-                self.strip_empty_elements(xml)
-                data = etree.tostring(xml)
-                # post the document to the index
-                self.log.debug("Posting {0}".format(filename))
-                resp = requests.post(self.url, data=data, headers=self.headers)
-                if resp.status_code == 200:
-                    posted += 1
-                    self.log.info("Posted {0}".format(filename))
-                else:
-                    errors += 1
-                    self.log.error("Post failed for {0}\n{1}".format(filename, resp.content))
-                    
-                #TODO: Generalize.
-                if 0 == (posted % 500):
-                    self.commit()
-                    sleep(3)
-                
-            except:
-                self.log.error("Post failed for {0}".format(filename), exc_info=Cfg.LOG_EXC_INFO)
-        # report on the number of documents posted, failed
-        self.log.info("Posted {0} documents. {1} errors.".format(posted, errors))
+        self._post(self.source, Filenames, Format)
+
+    def reindex(self):
+        """
+        Rebuild the index without taking it offline. Flush the staging core,
+        post all documents in the source folder to it, and verify that it
+        holds one document for each document ID in the source folder. Then
+        swap the staging core with the live core. The live core is left
+        unchanged if the staging core could not be verified.
+        """
+        assert self.staging, self.log.error("No staging core has been configured")
+        base, live = self.index.rsplit('/', 1)
+        staging = self._getStagingCore(base, live)
+        previous = Utils.tryReadYaml(self.source, Cfg.POSTED_INDEX_FILENAME)
+        url, json_url, update = self.url, self.json_url, self.update
+        try:
+            self.url = base + '/' + staging + '/update'
+            self.json_url = self.url + JSON_UPDATE_HANDLER
+            self.update = False
+            self._request(self.url, b'<delete><query>*:*</query></delete>', self.headers)
+            self._commit()
+            self._post(self.source)
+            expected = len(set([i for _, ids in self.read.values() for i in ids]))
+            count = self._getCount(base + '/' + staging)
+        finally:
+            self.url, self.json_url, self.update = url, json_url, update
+        if count != expected:
+            # the posted index must continue to describe the live core
+            Utils.writeYaml(self.source, Cfg.POSTED_INDEX_FILENAME, previous)
+            raise Exception("Staging core {0} has {1} documents, expected {2}. The live core was not swapped.".format(
+                staging, count, expected))
+        self._swapCores(base, live, staging)
+
+    def retry(self):
+        """
+        Resend the documents in the dead letter folder. Documents that are
+        posted are removed from the folder.
+        """
+        assert self.dead_letter, self.log.error("No dead letter folder has been configured")
+        self._post(self.dead_letter)
 
     def run(self):
         """
@@ -118,7 +726,8 @@ class Poster(object):
             for action in self.actions:
                 f = getattr(self, action)
                 f()
-        self.log.info("Poster finished in {0}:{1}:{2}".format(t.hours, t.minutes, t.seconds))
+        Metrics.recordTime('post', t.elapsed, t.cpu)
+        self.log.info("Poster finished in {0}".format(t))
 
     def strip_empty_elements(self, doc):
         """Remove empty elements from the document.
@@ -135,14 +744,48 @@ class Poster(object):
                 elem.getparent().remove(elem)
 
 
-def post(params):
+def _getPoster(params, actions, update=False, shard=None):
     """
-    Execute post actions
+    Create a poster with the specified parameters.
     """
-    actions = params.get("post", "actions").split(",")
     index = params.get("post", "index")
     source = params.get("post", "input")
-    poster = Poster(source, index, actions)
+    options = {}
+    for key, name, get in [("batch-size", "batch_size", params.getint), ("batch-bytes", "batch_bytes", params.getint),
+                           ("concurrency", "concurrency", params.getint), ("commit-policy", "commit_policy", params.get),
+                           ("commit-interval", "commit_interval", params.getint),
+                           ("commit-within", "commit_within", params.getint),
+                           ("target-latency", "target_latency", params.getfloat),
+                           ("dead-letter", "dead_letter", params.get), ("retries", "retries", params.getint),
+                           ("backoff", "backoff", params.getfloat), ("max-backoff", "max_backoff", params.getfloat),
+                           ("breaker-threshold", "breaker_threshold", params.getint),
+                           ("breaker-reset", "breaker_reset", params.getfloat),
+                           ("staging", "staging", params.get), ("swap", "swap", params.get),
+                           ("compress", "compress", params.getboolean)]:
+        if params.has_option("post", key):
+            options[name] = get("post", key)
+    return Poster(source, index, actions, update=update, shard=shard, **options)
+
+def merge(params):
+    """
+    Merge the indexes of posted documents written by each shard of the post.
+    """
+    poster = _getPoster(params, [])
+    poster.merge()
+
+def post(params, update=False, shard=None):
+    """
+    Execute post actions
+    """
+    actions = params.get("post", "actions").split(",")
+    poster = _getPoster(params, actions, update, shard)
+    poster.run()
+
+def retry(params, shard=None):
+    """
+    Resend the documents in the dead letter folder.
+    """
+    poster = _getPoster(params, ["retry"], shard=shard)
     poster.run()
 
 
@@ -153,6 +796,20 @@ if __name__ == '__main__':
     parser.add_argument("--flush", help="Flush data from the Solr core at the specified URL")
     parser.add_argument("--optimize", help="Optimize data in the Solr core at the specified URL")
     parser.add_argument("--post", help="Post data to the Solr core at the specified URL")
+    parser.add_argument("--reindex", help="Reindex the Solr core at the specified URL through a staging core")
+    parser.add_argument("--retry", help="Resend the documents in the dead letter folder to the Solr core at the specified URL")
+    parser.add_argument("--dead-letter", help="Folder to which documents that could not be posted are written")
+    parser.add_argument("--batch-size", help="Maximum number of documents posted in one request", type=int, default=BATCH_SIZE)
+    parser.add_argument("--batch-bytes", help="Maximum number of bytes posted in one request", type=int, default=BATCH_BYTES)
+    parser.add_argument("--concurrency", help="Number of batches posted concurrently", type=int, default=CONCURRENCY)
+    parser.add_argument("--commit-policy", help="Commit with a final hard commit only, soft commits, or commitWithin",
+                        choices=COMMIT_POLICIES, default='hard')
+    parser.add_argument("--compress", help="Gzip compress the documents posted", action='store_true')
+    parser.add_argument("--commit-within", help="Milliseconds within which Solr should commit each update", type=int,
+                        default=COMMIT_WITHIN)
+    parser.add_argument("--staging", help="Staging core, or comma separated staging collections, to reindex into")
+    parser.add_argument("--swap", help="Swap the staging core with the live core, or the live collection alias",
+                        choices=SWAP_MODES, default='core')
     parser.add_argument("source", help="Post data from the specified path to the Solr core", nargs='?')
     args = parser.parse_args()
     # configure the poster
@@ -168,6 +825,12 @@ if __name__ == '__main__':
     elif args.post and args.source:
         action = "post"
         url = args.post
+    elif args.reindex and args.staging and args.source:
+        action = "reindex"
+        url = args.reindex
+    elif args.retry and args.dead_letter:
+        action = "retry"
+        url = args.retry
     else:
         parser.print_help()
         sys.exit()
@@ -180,5 +843,8 @@ if __name__ == '__main__':
     logger.addHandler(sh)
     logger.setLevel(logging.DEBUG)
     # execute
-    poster = Poster(source, url, [action], logger=logger)
+    poster = Poster(source, url, [action], logger=logger, batch_size=args.batch_size, batch_bytes=args.batch_bytes,
+                    concurrency=args.concurrency, commit_policy=args.commit_policy, commit_within=args.commit_within,
+                    dead_letter=args.dead_letter, staging=args.staging, swap=args.swap,
+                    compress=args.compress)
     poster.run()
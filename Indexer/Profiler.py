@@ -0,0 +1,107 @@
+"""
+This file is subject to the terms and conditions defined in the
+LICENSE file, which is part of this source code package.
+"""
+
+import cProfile
+import contextlib
+import logging
+import os
+import pstats
+import threading
+import tracemalloc
+
+
+__description__ = """Profiles each stage with cProfile or tracemalloc and writes a profile file for each stage."""
+
+# profiling modes
+MODES = ['cprofile', 'tracemalloc']
+
+# default folder to write the profile files to
+OUTPUT = "profile"
+
+# number of stack frames that tracemalloc records for each allocation
+TRACEMALLOC_FRAMES = 10
+
+# number of functions or source lines to log for each stage profile
+TOP = 10
+
+_local = threading.local()
+_lock = threading.Lock()
+_settings = {'mode': None, 'output': OUTPUT}
+_stats = {}
+
+
+def _writeProfile(Stage, Profile):
+    """
+    Add the thread profile to the profile of the stage, and write the stage
+    profile to a .prof file that can be read with pstats or snakeviz.
+    """
+    path = _settings['output'] + os.sep + Stage + ".prof"
+    with _lock:
+        if Stage in _stats:
+            _stats[Stage].add(Profile)
+        else:
+            _stats[Stage] = pstats.Stats(Profile)
+        _stats[Stage].dump_stats(path)
+    return path
+
+def _writeSnapshot(Stage):
+    """
+    Write a snapshot of the memory allocated by the process to a .snapshot
+    file that can be read with tracemalloc.Snapshot.load.
+    """
+    path = _settings['output'] + os.sep + Stage + ".snapshot"
+    snapshot = tracemalloc.take_snapshot()
+    with _lock:
+        snapshot.dump(path)
+    return snapshot, path
+
+def configure(Mode, Output=OUTPUT):
+    """
+    Profile each stage in the specified mode, and write the profile files
+    to the output folder. Tracing memory allocations starts immediately.
+    """
+    assert Mode is None or Mode in MODES, "Unknown profiling mode: {0}".format(Mode)
+    _settings['mode'] = Mode
+    _settings['output'] = Output
+    _stats.clear()
+    if Mode and not os.path.exists(Output):
+        os.makedirs(Output)
+    if Mode == 'tracemalloc' and not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+
+@contextlib.contextmanager
+def profile(Stage):
+    """
+    Profile the calls made by the current thread within the context. With
+    cProfile, the calls of all threads that work on the stage are added to
+    the stage profile. With tracemalloc, a snapshot of the memory allocated
+    by the process is taken when the context exits. Contexts that are
+    nested within a profiled context in the same thread are not profiled
+    separately.
+    """
+    mode = _settings['mode']
+    if not mode or getattr(_local, 'active', False):
+        yield
+        return
+    log = logging.getLogger()
+    _local.active = True
+    profiler = cProfile.Profile() if mode == 'cprofile' else None
+    try:
+        if profiler:
+            profiler.enable()
+        yield
+    finally:
+        _local.active = False
+        if profiler:
+            profiler.disable()
+            path = _writeProfile(Stage, profiler)
+            top = pstats.Stats(profiler).sort_stats('cumulative')
+            log.info("Profile of {0} written to {1}. Top functions by cumulative time: {2}".format(
+                Stage, path, ', '.join(["{0}:{1}({2})".format(*f) for f in top.fcn_list[:TOP]])))
+        else:
+            snapshot, path = _writeSnapshot(Stage)
+            top = snapshot.statistics('lineno')[:TOP]
+            log.info("Memory snapshot of {0} written to {1}. Top allocations:\n{2}".format(
+                Stage, path, '\n'.join([str(s) for s in top])))
@@ -0,0 +1,116 @@
+"""
+This file is subject to the terms and conditions defined in the
+LICENSE file, which is part of this source code package.
+"""
+
+from lxml import etree
+
+import json
+
+
+class SolrInputDocument(object):
+    """
+    Solr Input Document wrapper. The document fields are indexed by name
+    once, so that fields can be found, set, appended and boosted without
+    searching the whole document tree for each field.
+    """
+
+    def __init__(self, xml):
+        """
+        :param xml: Solr Input Document element tree, or its root element
+        """
+        self.xml = xml if isinstance(xml, etree._ElementTree) else etree.ElementTree(xml)
+        self.doc = self.xml.getroot().getchildren()[0]
+        self.fields = {}
+        self.reindex()
+
+    def append(self, Name, Value=None):
+        """
+        Append a new field to the document. Return the field element.
+        """
+        field = etree.SubElement(self.doc, "field", name=Name)
+        if Value is not None:
+            field.text = Value
+        self.fields.setdefault(Name, []).append(field)
+        return field
+
+    def boost(self, Name, Value):
+        """
+        Set the boost value on all fields with the specified name.
+        """
+        for field in self.fields.get(Name, []):
+            field.attrib['boost'] = Value
+
+    def get(self, Name):
+        """
+        Get the list of fields with the specified name.
+        """
+        return list(self.fields.get(Name, []))
+
+    def getValue(self, Name):
+        """
+        Get the value of the first field with the specified name, or None if
+        the document has no such field.
+        """
+        fields = self.fields.get(Name)
+        return fields[0].text if fields else None
+
+    def has(self, Name):
+        """
+        Determine if the document has a field with the specified name.
+        """
+        return Name in self.fields
+
+    def reindex(self):
+        """
+        Rebuild the field index. Call this after the document tree has been
+        modified directly rather than through the wrapper.
+        """
+        self.fields = {}
+        for field in self.doc.iterchildren("field"):
+            self.fields.setdefault(field.get('name'), []).append(field)
+
+    def set(self, Name, Value):
+        """
+        Set the value of all fields with the specified name. If the document
+        has no such field, then append one.
+        """
+        fields = self.fields.get(Name)
+        if fields:
+            for field in fields:
+                field.text = Value
+        else:
+            self.append(Name, Value)
+
+    def strip(self):
+        """
+        Remove the fields that have no value from the document.
+        """
+        for name in list(self.fields):
+            for field in [f for f in self.fields[name] if not f.text]:
+                self.doc.remove(field)
+                self.fields[name].remove(field)
+            if not self.fields[name]:
+                del self.fields[name]
+
+    def tojson(self):
+        """
+        Serialize the document to a compact, UTF-8 encoded Solr JSON document
+        on a single line. Fields with more than one value are written as
+        arrays and empty fields are dropped. Field boosts are not supported by
+        the JSON document format and are not written.
+        """
+        data = {}
+        for name in self.fields:
+            values = [field.text for field in self.fields[name] if field.text]
+            if len(values) == 1:
+                data[name] = values[0]
+            elif values:
+                data[name] = values
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+
+    def tostring(self):
+        """
+        Serialize the document to UTF-8 encoded XML.
+        """
+        return etree.tostring(self.xml, pretty_print=True, xml_declaration=True, encoding='UTF-8')
@@ -3,18 +3,35 @@ This file is subject to the terms and conditions defined in the
 LICENSE file, which is part of this source code package.
 """
 
-import datetime
+import os
+import time
 
 class Timer:
     """
-    Time a procedure.
+    Time a procedure. Record the elapsed wall clock time, and the CPU time
+    used by the process and the child processes that finished in the
+    interval, in seconds. Hours include whole days, and seconds include the
+    fraction of a second.
     """
     def __enter__(self):
-        self.start = datetime.datetime.now()
+        self.start = time.time()
+        self._cpu = self._getCpuTime()
+        self._wall = time.perf_counter()
         return self
 
     def __exit__(self, *args):
-        self.interval = datetime.datetime.now() - self.start
-        s = self.interval.seconds
-        self.hours, remainder = divmod(s, 3600)
-        self.minutes, self.seconds = divmod(remainder, 60)
+        self.elapsed = time.perf_counter() - self._wall
+        self.cpu = self._getCpuTime() - self._cpu
+        minutes, self.seconds = divmod(self.elapsed, 60)
+        self.hours, self.minutes = [int(v) for v in divmod(minutes, 60)]
+
+    def __str__(self):
+        return "{0}:{1:02d}:{2:06.3f}".format(self.hours, self.minutes, self.seconds)
+
+    def _getCpuTime(self):
+        """
+        Get the user and system CPU time of the process and its finished
+        child processes.
+        """
+        t = os.times()
+        return t.user + t.system + t.children_user + t.children_system
@@ -7,29 +7,72 @@ from lxml import etree
 
 import Cfg
 import HtmlPage
+import Metrics
+import SolrInputDocument
 import Timer
 import Utils
+import hashlib
 import logging
+import multiprocessing
 import os
-import yaml
+import threading
+import time
+import traceback
+
+# Solr Input Document output formats
+OUTPUT_FORMATS = ["json", "xml"]
+
+# actions that transform source documents to Solr Input Documents
+TRANSFORM_ACTIONS = ["digitalobjects-to-sid", "eaccpf-to-sid", "html-to-sid"]
+
+# per-process state of transform workers
+_worker = {}
+
 
 class Transformer(object):
     """
-    Transform and merge source data to Solr Input Document format. Transform
-    does not use the --update flag because the operation is purely local and
-    should take an insignificant amount of time to complete.
-    
+    Transform and merge source data to Solr Input Document format. When the
+    --update flag is set, a Solr Input Document is only regenerated when its
+    source document, the YAML records merged into it, or the transform
+    configuration have changed since the last run, and documents whose
+    sources have been deleted are removed from the output folder.
+
+    Each source document is parsed and transformed once. Merge, set-fields and
+    boost actions are then applied to the document in memory, and it is
+    written to the output folder once, either as an XML Solr Input Document
+    or as a single line Solr JSON document. Empty fields are removed from
+    each document before it is written, and the content hash and document
+    IDs of each file written are recorded in a manifest in the output
+    folder, so that the Poster can post the file without parsing it.
+
+    When a shard is specified, only the Solr Input Documents of the records
+    in that shard are generated, and the file hash index and manifest are
+    written as shard-local files to be merged later.
     """
 
-    def __init__(self, sources, output, actions=None, boosts=None, set_fields=None, transform=None):
+    def __init__(self, sources, output, actions=None, boosts=None, set_fields=None, transform=None, workers=1, update=False,
+                 output_format='xml', shard=None):
+        self.configHash = ''
+        self.hashIndex = {}
+        self.invalid = set()
+        self.lock = threading.Lock() # guards the counters, indexes and timings shared by pipeline threads
         self.log = logging.getLogger()
+        self.manifest = {}
+        self.records = []
+        self.timings = {}
+        self.transformed = 0
+        self.yamlIndex = {}
         # set parameters
         self.actions = actions if actions else []
         self.boosts = boosts if boosts else []
         self.output = output
+        self.output_format = output_format
         self.set_fields = set_fields if set_fields else []
+        self.shard = shard
         self.sources = sources
         self.transform = transform
+        self.update = update
+        self.workers = workers
         
         self.ufs = []
         uflist = [ uf for uf in self.actions if uf.startswith('uf') ]
@@ -46,83 +89,101 @@ class Transformer(object):
             self.modpath = os.path.abspath(__file__)
             self.xslt = os.path.dirname(self.modpath) + os.sep + "transform" + os.sep + 'esrc-eaccpf-to-solr.xsl'
 
-    def mergeDigitalObjectIntoSID(self, path, filename, output_path):
+    def __getstate__(self):
         """
-        Merge the digital object record into the Solr Input Document. Do not
-        overwrite existing id, presentation_url and metadata_url fields.
+        Get the state to send to a transform worker process. Locks can not be
+        pickled, so each process creates its own.
         """
-        try:
-            # read the digital object metadata file
-            with open(path + os.sep + filename, 'r') as f:
-                data = f.read()
-                dobj = yaml.load(data)
-            # if there is an existing SID file, then read it
-            if os.path.exists(output_path + os.sep + filename):
-                parser = etree.XMLParser(remove_blank_text=True)
-                xml = etree.parse(output_path + os.sep + filename, parser)
-                root = xml.getroot()
-                doc = root.getchildren()[0]
-            else:
-                # @todo else create an empty SID document object; we won't likely hit this case
-                return
-            # add fields that are not already present in the SID file
-            for field_name in list(dobj.keys()):
-                if field_name.startswith('dobj'):
-                    # if the field already exists then update it, otherwise add it
-                    node = doc.xpath("//field[@name='{0}']".format(field_name))
-                    if node and len(node) > 0:
-                        node[0].text = dobj[field_name]
-                    else:
-                        dobjfield = etree.Element("field", name=field_name)
-                        dobjfield.text = dobj[field_name]
-                        doc.append(dobjfield)
-            # write the updated file
-            output_filename = Utils.getFilenameWithAlternateExtension(filename, 'xml')
-            with open(output_path + os.sep + output_filename,'w') as outfile:
-                xml = etree.tostring(xml, pretty_print=True, xml_declaration=True).decode()
-                outfile.write(xml)
-                #xml.write(outfile, pretty_print=True, xml_declaration=True)
-            self.log.info("Merged digital object into {0}".format(output_filename))
-        except:
-            self.log.error("Could not complete merge processing for {0}".format(filename), exc_info=Cfg.LOG_EXC_INFO)
-    
-    def mergeDigitalObjectsIntoSID(self, Sources, Output):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
         """
-        Merge digital object records into Solr Input Documents.
+        Restore the state in a transform worker process.
         """
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def _getConfigHash(self):
+        """
+        Get a SHA1 hash of the transform configuration. A change to the
+        actions, boosts, field values or stylesheet changes every Solr Input
+        Document, so the hash is part of each document dependency hash.
+        """
+        config = [','.join(self.actions), ','.join(self.boosts), ','.join(self.set_fields), self.output_format]
+        if "eaccpf-to-sid" in self.actions and os.path.exists(self.xslt):
+            config.append(Utils.getFileHash(self.xslt))
+        return hashlib.sha1('\n'.join(config).encode('utf-8')).hexdigest()
+
+    def _getDependencyHash(self, Path, Filename, RecordId=None):
+        """
+        Get a SHA1 hash of everything that a Solr Input Document is generated
+        from: the transform configuration, the source document and the YAML
+        records that are merged into it.
+        """
+        record_id = RecordId if RecordId else Utils.getRecordIdFromFilename(Filename)
+        hashes = [self.configHash, Utils.getFileHash(Path, Filename)]
+        Metrics.countFile('transform', 'bytes_read', Path + os.sep + Filename if Filename else Path)
+        for path, name in sorted(self.yamlIndex.get(record_id, [])):
+            hashes.append(Utils.getFileHash(path, name))
+        return hashlib.sha1('\n'.join(hashes).encode('utf-8')).hexdigest()
+
+    def _getSIDFilename(self, Filename):
+        """
+        Get the output file name of the Solr Input Document for the specified
+        source file name.
+        """
+        return Utils.getFilenameWithAlternateExtension(Filename, self.output_format)
+
+    def _getSource(self, Filename):
+        """
+        Get the source folder of the EAC-CPF document of the Solr Input
+        Document, or None if the document does not exist in the sources.
+        """
+        filename = Utils.getFilenameWithAlternateExtension(Filename, 'xml')
+        for source in [s for s in self.sources if os.path.exists(s + os.sep + filename)]:
+            return source
+        return None
+
+    def _indexSourceYaml(self, Sources):
+        """
+        Build an index of record ID to the source folder and file name of the
+        YAML data files for that record.
+        """
+        index = {}
         for source in [s for s in Sources if os.path.exists(s)]:
             for filename in [f for f in os.listdir(source) if f.endswith(".yml") and not f == Cfg.HASH_INDEX_FILENAME]:
-                self.mergeDigitalObjectIntoSID(source, filename, Output)
-                    
-    def mergeInferredRecordIntoSID(self, path, filename, Output):
+                record_id = Utils.getRecordIdFromFilename(filename)
+                index.setdefault(record_id, []).append((source, filename))
+        return index
+
+    def _isUnchanged(self, Filename, Hash, Output):
         """
-        Merge inferred data into Solr Input Document. Write merged data to 
-        output.
+        Determine if the Solr Input Document was generated from the same
+        dependencies in a prior run and still exists in the output folder.
+        Unchanged documents are counted as skipped.
+        """
+        unchanged = self.update and self.hashIndex.get(Filename) == Hash and os.path.exists(Output + os.sep + Filename)
+        if unchanged:
+            Metrics.count('transform', 'skipped')
+        return unchanged
+
+    def _mergeDigitalObject(self, dobj, sid):
+        """
+        Merge the digital object fields into the in-memory Solr Input Document.
+        """
+        # add fields that are not already present in the SID file
+        for field_name in list(dobj.keys()):
+            if field_name.startswith('dobj'):
+                # if the field already exists then update it, otherwise add it
+                sid.set(field_name, dobj[field_name])
+
+    def _mergeInferredRecord(self, inferred, sid):
+        """
+        Merge inferred data into the in-memory Solr Input Document. Return
+        True if the inferred record has location data and was merged.
         """
-        # read input (inferred) data file
-        with open(path + os.sep + filename, 'r') as infile:
-            data = infile.read()
-            inferred = yaml.load(data)
-        filename = Utils.getFileName(Output)
-        # if there is an existing SID file, then read it into memory,
-        # otherwise create an XML tree to
-        if not os.path.exists(Output):
-            #Actually, don't create a new file here.
-            return
-            root = etree.Element("add")
-            xml = etree.ElementTree(root)
-            doc = etree.Element("doc")
-            root.append(doc)
-            # add required records
-            recordId = etree.Element("field", name="id")
-            recordId.text = Utils.getRecordIdFromFilename(filename)
-            doc.append(recordId)
-        else:
-            # read output (Solr Input Document) data file
-            parser = etree.XMLParser(remove_blank_text=True)
-            xml = etree.parse(Output, parser)
-            root = xml.getroot()
-            doc = root.getchildren()[0]
         # add inferred locations
         # ISSUE #5 the geocoder can return multiple locations when an address is
         # not specific enough. Or, in some cases, a record has multiple events and
@@ -136,84 +197,58 @@ class Transformer(object):
                 # primary entity locaion
                 if count == 0:
                     #address
-                    #address = etree.Element('field', name='address')
-                    #address.text = location['address']
-                    #doc.append(address)
+                    #sid.append('address', location['address'])
                     if 'region' in location:
                         #Thank you, OpenStreetMaps!
                         if 'penna' == location['region']:
                             location['region'] = 'Pennsylvania'
-                
-                    if 'address' in location:
-                        #Workaround for my own stupidity. TODO: Fix in Facter.py, then here. --atb
-                        if 'str' == type(location['address']).__name__:
-                            exec("location['address'] = "+location['address'])
-                        
-                        inus = etree.Element('field', name='in_us')
-                        inus.text = 'true' if 'us' == location['address']['country_code'] else 'false'
-                        doc.append(inus)
-                        # county
-                        if 'county' in location['address']:
-                            county = etree.Element('field', name='county')
-                            county.text = location['address']['county']
-                            doc.append(county)
-                            
-                            if 'region' in location:
-                                crc = etree.Element('field', name='countyregioncountry')
-                                crc.text = '%s, %s, %s' % (location['address']['county'], location['region'],
-                                                           location['address']['country'])
-                                doc.append(crc)
+                    # the Facter persists addresses as mappings. Addresses
+                    # inferred by earlier versions are stored as strings and
+                    # must be converted with the Indexer --migrate option.
+                    address = location.get('address')
+                    if not isinstance(address, dict):
+                        if address:
+                            self.log.warning("Location address is not a mapping. Run the Indexer with --migrate to convert it.")
+                        address = {}
+                    country = address.get('country', location.get('country', ''))
+                    if 'country_code' in address:
+                        sid.append('in_us', 'true' if 'us' == address['country_code'] else 'false')
+                    # county
+                    if 'county' in address:
+                        sid.append('county', address['county'])
+                        if 'region' in location:
+                            sid.append('countyregioncountry', '%s, %s, %s' % (address['county'], location['region'], country))
 
                     # city
                     if 'city' in location:
-                        city = etree.Element('field', name='city')
-                        city.text = location['city']
-                        doc.append(city)
+                        sid.append('city', location['city'])
                         if 'region' in location:
-                            cyrc = etree.Element('field', name='cityregioncountry')
-                            cyrc.text = '%s, %s, %s' % (location['address']['city'], location['region'],
-                                                       location['address']['country'])
-                            doc.append(cyrc)
+                            sid.append('cityregioncountry', '%s, %s, %s' % (address.get('city', location['city']),
+                                                                            location['region'], country))
                                 
                     # state/region
                     if 'region' in location:
-                        region = etree.Element('field', name='region')
-                        region.text = location['region']
-                        doc.append(region)
-                        
-                        rc = etree.Element('field', name='regioncountry')
-                        rc.text = '%s, %s' % (location['region'],
-                                                  location['address']['country'])
-                        doc.append(rc)
+                        sid.append('region', location['region'])
+                        sid.append('regioncountry', '%s, %s' % (location['region'], country))
                     # country
                     if 'country' in location:
-                        country = etree.Element('field', name='country')
-                        country.text = location['country']
-                        doc.append(country)
+                        sid.append('country', location['country'])
                     # coordinates
                     if 'coordinates' in location:
                         lat = location['coordinates'][0]
                         lng = location['coordinates'][1]
                         latlng = str(lat) + "," + str(lng)
-                        coordinates = etree.Element('field', name='location')
-                        coordinates.text = latlng
-                        doc.append(coordinates)
+                        sid.append('location', latlng)
                         # latitude
-                        location_0 = etree.Element('field', name='location_0_coordinate')
-                        location_0.text = str(lat)
+                        sid.append('location_0_coordinate', str(lat))
                         # longitude
-                        doc.append(location_0)
-                        location_1 = etree.Element('field', name='location_1_coordinate')
-                        location_1.text = str(lng)
-                        doc.append(location_1)
+                        sid.append('location_1_coordinate', str(lng))
                 else:
                     # all subsequent locations will be added to the loocation_geohash field
                     lat = location['coordinates'][0]
                     lng = location['coordinates'][1]
                     latlng = str(lat) + "," + str(lng)
-                    coordinates = etree.Element('field', name='location_geohash')
-                    coordinates.text = latlng
-                    doc.append(coordinates)
+                    sid.append('location_geohash', latlng)
                 # increment count
                 count = count + 1
             # @todo: add inferred entities
@@ -239,16 +274,155 @@ class Transformer(object):
             for uf in self.ufs:
                 try:
                     if type(uf).__name__ in inferred:
-                        uf.append(inferred[type(uf).__name__], xml)
+                        uf.append(inferred[type(uf).__name__], sid.xml)
                 except Exception as e:
                     #TODO: Something.
                     pass
+            # user inferrers modify the document tree directly
+            if self.ufs:
+                sid.reindex()
+            return True
+        return False
+
+    def _recordSID(self, Filename, Hash):
+        """
+        Record that the Solr Input Document was generated from dependencies
+        with the specified hash. If the hash is None, the document could not
+        be generated and its entry is removed so that it is retried on the
+        next run.
+        """
+        if Hash:
+            with self.lock:
+                self.hashIndex[Filename] = Hash
+                self.transformed += 1
+            Metrics.count('transform', 'processed')
+            Metrics.countFile('transform', 'bytes_written', self.output + os.sep + Filename)
+        else:
+            with self.lock:
+                self.hashIndex.pop(Filename, None)
+
+    def _setBoosts(self, sid):
+        """
+        Set the boost values on the specified fields of the in-memory Solr
+        Input Document.
+        """
+        for field_name, boost_value in [boost.split(':') for boost in self.boosts]:
+            sid.boost(field_name, boost_value)
+
+    def _setFieldValues(self, sid):
+        """
+        Set the specified field values on the in-memory Solr Input Document.
+        If the field exists, change its value, otherwise add it.
+        """
+        for fieldname, value in [val.split(":") for val in self.set_fields]:
+            sid.set(fieldname, value)
+
+    def _time(self, Stage, Start):
+        """
+        Add the time elapsed since the start time to the stage timing.
+        """
+        elapsed = time.time() - Start
+        with self.lock:
+            self.timings[Stage] = self.timings.get(Stage, 0.0) + elapsed
+
+    def _writeSID(self, sid, filename, Output):
+        """
+        Write the Solr Input Document to the output folder, without empty
+        fields, and record it in the manifest. Documents with a .json file
+        name are written in Solr JSON format.
+        """
+        sid.strip()
+        data = sid.tojson() if filename.endswith(".json") else sid.tostring()
+        with open(Output + os.sep + filename, 'wb') as outfile:
+            outfile.write(data)
+        if os.path.abspath(Output) == os.path.abspath(self.output):
+            record_id = sid.getValue('id')
+            entry = {'hash': hashlib.sha1(data).hexdigest(), 'ids': [record_id] if record_id else []}
+            with self.lock:
+                self.manifest[filename] = entry
+
+    def complete(self, Partial=False):
+        """
+        Complete the transform run. If no documents were transformed, apply
+        the actions to the documents in the output folder. Otherwise remove
+        documents whose sources were deleted and write the file hash index.
+        If only the changed records were transformed in this run, then the
+        documents whose EAC-CPF documents exist in the sources are kept.
+        Write the manifest of the documents in the output folder.
+        """
+        # if no documents were transformed, then apply the actions to the
+        # documents that already exist in the output folder
+        if not [a for a in TRANSFORM_ACTIONS if a in self.actions]:
+            self.processSIDs(self.output)
+        else:
+            # remove documents whose sources were deleted
+            records = self.records
+            if Partial:
+                records = records + [f for f in self.hashIndex if self._getSource(f)]
+            Utils.purgeIndex(records, self.hashIndex)
+            if self.update:
+                # the Poster keeps its index of posted documents in the
+                # same folder
+                Utils.purgeFolder(self.output, self.hashIndex, [Cfg.MANIFEST_FILENAME, Cfg.POSTED_INDEX_FILENAME],
+                                  self.shard)
+            Utils.writeFileHashIndex(self.hashIndex, self.output, Shard=self.shard)
+            self.log.info("Transformed {0} of {1} documents".format(self.transformed, len(self.records)))
+        Utils.purgeIndex(os.listdir(self.output), self.manifest)
+        Utils.writeFileHashIndex(self.manifest, self.output, Cfg.MANIFEST_FILENAME, self.shard)
+
+    def merge(self):
+        """
+        Merge the shard file hash indexes and manifests.
+        """
+        Utils.mergeShardIndexes(self.output)
+        Utils.mergeShardIndexes(self.output, Cfg.MANIFEST_FILENAME)
+
+    def mergeDigitalObjectIntoSID(self, path, filename, output_path):
+        """
+        Merge the digital object record into the Solr Input Document. Do not
+        overwrite existing id, presentation_url and metadata_url fields.
+        """
+        try:
+            # read the digital object metadata file
+            dobj = Utils.readYaml(path, filename)
+            # if there is an existing SID file, then read it
+            output_filename = Utils.getFilenameWithAlternateExtension(filename, 'xml')
+            if not os.path.exists(output_path + os.sep + output_filename):
+                return
+            parser = etree.XMLParser(remove_blank_text=True)
+            sid = SolrInputDocument.SolrInputDocument(etree.parse(output_path + os.sep + output_filename, parser))
+            self._mergeDigitalObject(dobj, sid)
             # write the updated file
-            outfile = open(Output,'w')
-            xml = etree.tostring(xml, pretty_print=True, xml_declaration=True).decode()
-            outfile.write(xml)
-            #xml.write(outfile, pretty_print=True, xml_declaration=True)
-            outfile.close()
+            self._writeSID(sid, output_filename, output_path)
+            self.log.info("Merged digital object into {0}".format(output_filename))
+        except:
+            self.log.error("Could not complete merge processing for {0}".format(filename), exc_info=Cfg.LOG_EXC_INFO)
+    
+    def mergeDigitalObjectsIntoSID(self, Sources, Output):
+        """
+        Merge digital object records into Solr Input Documents.
+        """
+        for source in [s for s in Sources if os.path.exists(s)]:
+            for filename in [f for f in os.listdir(source) if f.endswith(".yml") and not f == Cfg.HASH_INDEX_FILENAME]:
+                self.mergeDigitalObjectIntoSID(source, filename, Output)
+                    
+    def mergeInferredRecordIntoSID(self, path, filename, Output):
+        """
+        Merge inferred data into Solr Input Document. Write merged data to 
+        output.
+        """
+        # read input (inferred) data file
+        inferred = Utils.readYaml(path, filename)
+        filename = Utils.getFileName(Output)
+        # if there is an existing SID file, then read it into memory, otherwise
+        # there is nothing to merge the inferred data into
+        if not os.path.exists(Output):
+            return
+        parser = etree.XMLParser(remove_blank_text=True)
+        sid = SolrInputDocument.SolrInputDocument(etree.parse(Output, parser))
+        if self._mergeInferredRecord(inferred, sid):
+            # write the updated file
+            self._writeSID(sid, filename, os.path.dirname(Output))
             self.log.info("Merged inferred data from {0}".format(filename))
 
     def mergeInferredRecordsIntoSID(self, Sources, Output):
@@ -265,21 +439,97 @@ class Transformer(object):
                 #except Exception:
                 #    self.log.error("Could not complete merge for {0}".format(path), exc_info=Cfg.LOG_EXC_INFO)
 
+    def prepare(self, Partial=False):
+        """
+        Prepare the output folder, and load the file hash index and manifest
+        so that we can track what has changed. Validate the source documents
+        and index the YAML records to be merged, if those actions are
+        specified. If only the changed records will be transformed, they are
+        validated as they are transformed instead.
+        """
+        # create output folder
+        if not os.path.exists(self.output):
+            os.makedirs(self.output)
+        #TODO: Use the output flag instead.
+        # keep the index of posted documents, so that the Poster deletes the
+        # documents of records that are no longer transformed
+        if 'clear' in self.actions and not self.update:
+            Utils.cleanOutputFolder(self.output, Shard=self.shard, Keep=[Cfg.POSTED_INDEX_FILENAME])
+        assert os.path.exists(self.output), self.log.error("Output path does not exist: {0}".format(self.output))
+        # load the file hash index so that we can track what has changed
+        if self.update:
+            self.hashIndex = Utils.loadFileHashIndex(self.output, Shard=self.shard)
+        self.manifest = Utils.loadFileHashIndex(self.output, Cfg.MANIFEST_FILENAME, self.shard)
+        self.configHash = self._getConfigHash()
+        self.records = []
+        self.transformed = 0
+        # execute processing actions
+        if "validate" in self.actions and not Partial:
+            self.invalid = self.validateEacCpfs(self.sources)
+        if 'merge-digitalobjects' in self.actions or "merge-inferred" in self.actions:
+            self.yamlIndex = self._indexSourceYaml(self.sources)
+
+    def processSID(self, xml, filename, Output):
+        """
+        Apply the merge, set-fields and boost actions to the in-memory Solr
+        Input Document, then write it to the output folder.
+        """
+        sid = SolrInputDocument.SolrInputDocument(xml)
+        records = []
+        if self.yamlIndex:
+            record_id = Utils.getRecordIdFromFilename(filename)
+            records = [Utils.readYaml(path, name) for path, name in self.yamlIndex.get(record_id, [])]
+        if 'merge-digitalobjects' in self.actions:
+            start = time.time()
+            for record in records:
+                try:
+                    self._mergeDigitalObject(record, sid)
+                except:
+                    self.log.error("Could not complete merge processing for {0}".format(filename), exc_info=Cfg.LOG_EXC_INFO)
+            self._time('merge-digitalobjects', start)
+        if "merge-inferred" in self.actions:
+            start = time.time()
+            for record in records:
+                try:
+                    self._mergeInferredRecord(record, sid)
+                except:
+                    self.log.error("Could not merge inferred data into {0}".format(filename), exc_info=Cfg.LOG_EXC_INFO)
+            self._time('merge-inferred', start)
+        if "set-fields" in self.actions and not '' in self.set_fields:
+            start = time.time()
+            self._setFieldValues(sid)
+            self._time('set-fields', start)
+        if 'boost' in self.actions:
+            start = time.time()
+            self._setBoosts(sid)
+            self._time('boost', start)
+        start = time.time()
+        self._writeSID(sid, filename, Output)
+        self._time('write', start)
+
+    def processSIDs(self, Source):
+        """
+        Apply the merge, set-fields and boost actions to the Solr Input
+        Documents in the source folder. Each document is read and written
+        once.
+        """
+        parser = etree.XMLParser(remove_blank_text=True)
+        for filename in [f for f in os.listdir(Source) if f.endswith(".xml") and Utils.inShard(f, self.shard)]:
+            try:
+                xml = etree.parse(Source + os.sep + filename, parser)
+                self.processSID(xml, filename, Source)
+            except:
+                self.log.error("Could not process {0}".format(filename), exc_info=Cfg.LOG_EXC_INFO)
+
     def run(self):
         """
         Execute transformations on source documents as specified. Write results 
         to the output path.
         """
         with Timer.Timer() as t:
-            # create output folder
-            if not os.path.exists(self.output):
-                os.makedirs(self.output)
-            
-            #TODO: Use the output flag instead.
-            if 'clear' in self.actions:
-                Utils.cleanOutputFolder(self.output)
-            assert os.path.exists(self.output), self.log.error("Output path does not exist: {0}".format(self.output))
-            # execute processing actions
+            self.prepare()
+            # documents are merged, set and boosted in memory as they are
+            # transformed, then written once
             if "digitalobjects-to-sid" in self.actions:
                 self.transformDigitalObjectsToSID(self.sources, self.output)
             if "eaccpf-to-sid" in self.actions:
@@ -287,70 +537,41 @@ class Transformer(object):
                 self.transformEacCpfsToSID(self.sources, self.output, transform)
             if "html-to-sid" in self.actions:
                 self.transformHtmlsToSid(self.sources, self.output)
-            if 'merge-digitalobjects' in self.actions:
-                self.mergeDigitalObjectsIntoSID(self.sources, self.output)
-            if "merge-inferred" in self.actions:
-                self.mergeInferredRecordsIntoSID(self.sources, self.output)
-            if "set-fields" in self.actions and not '' in self.set_fields:
-                self.setFieldValue(self.output)
-            if 'boost' in self.actions:
-                self.setBoosts(self.output)
-            if "validate" in self.actions:
-                pass
-                
+            self.complete()
         # log execution time
-        self.log.info("Transformer finished in {0}:{1}:{2}".format(t.hours, t.minutes, t.seconds))
+        timings = ["{0} {1:.2f}s".format(stage, self.timings[stage]) for stage in sorted(self.timings)]
+        self.log.info("Transformer stage timings: {0}".format(', '.join(timings)))
+        Metrics.recordTime('transform', t.elapsed, t.cpu)
+        self.log.info("Transformer finished in {0}".format(t))
         
     def setBoosts(self, Source):
         """
         Boost the specified fields for all Solr Input Documents in the source
-        folder.
+        folder. Each document is read and written once.
         """
-        for field_name, boost_value in [boost.split(':') for boost in self.boosts]:
-            for filename in [f for f in os.listdir(Source) if f.endswith(".xml")]:
-                try:
-                    # set field boost values
-                    xml = etree.parse(Source + os.sep + filename)
-                    fields = xml.findall('//field[@name="' + field_name + '"]')
-                    for field in fields:
-                        field.attrib['boost'] = boost_value
-                    # save the updated document
-                    with open(Source + os.sep + filename, 'w') as outfile:
-                        data = etree.tostring(xml, pretty_print=True, xml_declaration=True)
-                        outfile.write(data)
-                    self.log.info("Set boosts: {0}".format(filename))
-                except:
-                    self.log.error("Could not set boosts: {0}".format(filename), exc_info=Cfg.LOG_EXC_INFO)
+        for filename in [f for f in os.listdir(Source) if f.endswith(".xml")]:
+            try:
+                sid = SolrInputDocument.SolrInputDocument(etree.parse(Source + os.sep + filename))
+                self._setBoosts(sid)
+                self._writeSID(sid, filename, Source)
+                self.log.info("Set boosts: {0}".format(filename))
+            except:
+                self.log.error("Could not set boosts: {0}".format(filename), exc_info=Cfg.LOG_EXC_INFO)
 
     def setFieldValue(self, Source):
         """
-        Set the specified field value for all Solr Input Documents.
+        Set the specified field values for all Solr Input Documents. Each
+        document is read and written once.
         """
         parser = etree.XMLParser(remove_blank_text=True)
-        # set the field values
-        for fieldname, value in [val.split(":") for val in self.set_fields]:
-            for filename in [f for f in os.listdir(Source) if f.endswith(".xml")]:
-                try:
-                    # load the document
-                    xml = etree.parse(Source + os.sep + filename, parser)
-                    root = xml.getroot()
-                    doc = root.getchildren()[0]
-                    fields = doc.findall('field[@name="' + fieldname + '"]')
-                    # if the field exists, change its value
-                    if len(fields) > 0:
-                        for field in fields:
-                            field.text = value
-                    else:
-                        newfield = etree.Element("field", name=fieldname)
-                        newfield.text = value
-                        doc.append(newfield)
-                    # save the updated document
-                    with open(Source + os.sep + filename,'w') as outfile:
-                        data = etree.tostring(xml, pretty_print=True, xml_declaration=True)
-                        outfile.write(data)
-                    self.log.info("Set fields in {0}".format(filename))
-                except:
-                    self.log.error("Could not set field in {0}".format(filename), exc_info=Cfg.LOG_EXC_INFO)
+        for filename in [f for f in os.listdir(Source) if f.endswith(".xml")]:
+            try:
+                sid = SolrInputDocument.SolrInputDocument(etree.parse(Source + os.sep + filename, parser))
+                self._setFieldValues(sid)
+                self._writeSID(sid, filename, Source)
+                self.log.info("Set fields in {0}".format(filename))
+            except:
+                self.log.error("Could not set field in {0}".format(filename), exc_info=Cfg.LOG_EXC_INFO)
 
     def transformDigitalObjectToSID(self, path, filename, Output, Transform=None):
         """
@@ -358,8 +579,7 @@ class Transformer(object):
         format.
         """
         # read digital object data
-        with open(path + os.sep + filename, 'r') as f:
-            data = yaml.load(f.read())
+        data = Utils.readYaml(path, filename)
         # create SID document
         root = etree.Element("add")
         doc = etree.SubElement(root, "doc")
@@ -368,11 +588,9 @@ class Transformer(object):
             f.attrib['name'] = key
             if data[key] and len(data[key]) > 0:
                 f.text = data[key]
-        # write XML
-        filename = Utils.getFilenameWithAlternateExtension(filename, "xml")
-        with open(Output + os.sep + filename,'w') as outfile:
-            xml = etree.tostring(root, pretty_print=True, xml_declaration=True)
-            outfile.write(xml)
+        # merge, set fields, boost and write XML
+        filename = self._getSIDFilename(filename)
+        self.processSID(etree.ElementTree(root), filename, Output)
         self.log.info("Transformed dobject to SID: {0}".format(filename))
 
     def transformDigitalObjectsToSID(self, Sources, Output, Transform=None):
@@ -381,27 +599,35 @@ class Transformer(object):
         Input Document format.
         """
         for source in [s for s in Sources if os.path.exists(s)]:
-            for filename in [f for f in os.listdir(source) if Utils.isDigitalObjectYaml(source, f)]:
+            for filename in [f for f in os.listdir(source) if Utils.inShard(f, self.shard) and Utils.isDigitalObjectYaml(source, f)]:
                 path = source + os.sep + filename
+                sid_filename = self._getSIDFilename(filename)
+                self.records.append(sid_filename)
+                dependency_hash = self._getDependencyHash(source, filename)
+                if self._isUnchanged(sid_filename, dependency_hash, Output):
+                    continue
+                start = time.perf_counter()
                 try:
                     self.transformDigitalObjectToSID(source, filename, Output)
+                    self._recordSID(sid_filename, dependency_hash)
                 except:
+                    self._recordSID(sid_filename, None)
+                    Metrics.count('transform', 'failed')
                     msg = "Could not transform digital object to SID: {0}".format(path)
                     self.log.error(msg, exc_info=Cfg.LOG_EXC_INFO)
+                Metrics.timeDocument('transform', filename, start)
 
     def transformEacCpfToSID(self, path, filename, Output, Transform):
         """
         Transform EAC-CPF document to Solr Input Document format using the
         specified XSLT transform file.
         """
+        start = time.time()
         xml = etree.parse(path + os.sep + filename)
-        
         result = Transform(xml)
-        
-        data = etree.tostring(result, pretty_print=True, xml_declaration=True).decode()
-        # write the output file
-        with open(Output + os.sep + filename, 'w') as outfile:
-            outfile.write(data)
+        self._time('xslt', start)
+        # merge, set fields, boost and write the output file
+        self.processSID(result, self._getSIDFilename(filename), Output)
         self.log.info("Transformed EAC-CPF to SID: {0}".format(filename))
 
     def transformEacCpfsToSID(self, Sources, Output, Transform):
@@ -409,16 +635,115 @@ class Transformer(object):
         Transform zero or more paths containing EAC-CPF documents to Solr Input
         Document format.
         """
-        
-        
+        jobs = []
+        hashes = {}
         for source in [s for s in Sources if os.path.exists(s)]:
-            for filename in [f for f in os.listdir(source) if f.endswith(".xml")]:
-                path = source + os.sep + filename
-                try:
-                    self.transformEacCpfToSID(source, filename, Output, Transform)
-                except Exception:
-                    msg = "Could not transform EAC-CPF to SID: {0}".format(path)
-                    self.log.error(msg, exc_info=Cfg.LOG_EXC_INFO)
+            for filename in [f for f in os.listdir(source) if f.endswith(".xml") and Utils.inShard(f, self.shard)]:
+                if not source + os.sep + filename in self.invalid:
+                    sid_filename = self._getSIDFilename(filename)
+                    self.records.append(sid_filename)
+                    # skip documents that have not changed since the last run
+                    hashes[filename] = self._getDependencyHash(source, filename)
+                    if not self._isUnchanged(sid_filename, hashes[filename], Output):
+                        jobs.append((source, filename))
+        if self.workers > 1 and len(jobs) > 1:
+            # each worker compiles the stylesheet once and transforms a shard
+            # of the documents
+            shards = [jobs[i::self.workers] for i in range(self.workers)]
+            pool = multiprocessing.Pool(self.workers, _initTransformWorker, (self,))
+            try:
+                results = pool.map(_transformShard, [(shard, Output) for shard in shards])
+            finally:
+                pool.close()
+                pool.join()
+            errors = []
+            for shard_errors, timings, manifest, documents in results:
+                errors.extend(shard_errors)
+                self.manifest.update(manifest)
+                Metrics.addDocumentTimes(documents)
+                for stage in timings:
+                    self.timings[stage] = self.timings.get(stage, 0.0) + timings[stage]
+        else:
+            errors = self.transformEacCpfShard(jobs, Output, Transform)
+        # report errors from all workers
+        failed = set([os.path.basename(path) for path, error in errors])
+        for source, filename in jobs:
+            self._recordSID(self._getSIDFilename(filename), None if filename in failed else hashes[filename])
+        Metrics.count('transform', 'failed', len(errors))
+        for path, error in errors:
+            self.log.error("Could not transform EAC-CPF to SID: {0}\n{1}".format(path, error))
+        if errors:
+            self.log.error("Could not transform {0} of {1} EAC-CPF documents".format(len(errors), len(jobs)))
+        return errors
+
+    def transformEacCpfShard(self, Jobs, Output, Transform):
+        """
+        Transform a list of (source, filename) EAC-CPF documents to Solr Input
+        Document format. Return a list of (path, error) for the documents that
+        could not be transformed.
+        """
+        errors = []
+        for source, filename in Jobs:
+            start = time.perf_counter()
+            try:
+                self.transformEacCpfToSID(source, filename, Output, Transform)
+            except Exception as e:
+                errors.append((source + os.sep + filename, traceback.format_exc() if Cfg.LOG_EXC_INFO else str(e)))
+            Metrics.timeDocument('transform', filename, start)
+        return errors
+
+    def transformFile(self, Source, Filename, Transform):
+        """
+        Transform the EAC-CPF document in the source folder to a Solr Input
+        Document in the output folder, unless it has not changed since the
+        last run. Return the Solr Input Document file name, or None if the
+        document is invalid or could not be transformed.
+        """
+        if Source + os.sep + Filename in self.invalid or not Utils.inShard(Filename, self.shard):
+            return None
+        sid_filename = self._getSIDFilename(Filename)
+        self.records.append(sid_filename)
+        dependency_hash = self._getDependencyHash(Source, Filename)
+        if self._isUnchanged(sid_filename, dependency_hash, self.output):
+            return sid_filename
+        try:
+            self.transformEacCpfToSID(Source, Filename, self.output, Transform)
+        except:
+            self.log.error("Could not transform EAC-CPF to SID: {0}".format(Source + os.sep + Filename),
+                           exc_info=Cfg.LOG_EXC_INFO)
+            Metrics.count('transform', 'failed')
+            self._recordSID(sid_filename, None)
+            return None
+        self._recordSID(sid_filename, dependency_hash)
+        return sid_filename
+
+    def transformRecord(self, RecordId, Transform):
+        """
+        Transform the EAC-CPF document of the record after one of its files
+        changed. The YAML records to be merged into the document are indexed
+        again, and the document is validated if that action is specified.
+        Return the Solr Input Document file name, or None if the record has no
+        EAC-CPF document, or it is invalid or could not be transformed.
+        """
+        filename = RecordId + ".xml"
+        source = self._getSource(filename)
+        if not source or not Utils.inShard(filename, self.shard):
+            return None
+        if 'merge-digitalobjects' in self.actions or "merge-inferred" in self.actions:
+            yml = RecordId + ".yml"
+            records = [(s, yml) for s in self.sources if os.path.exists(s + os.sep + yml)]
+            if records:
+                self.yamlIndex[RecordId] = records
+            else:
+                self.yamlIndex.pop(RecordId, None)
+        if "validate" in self.actions:
+            errors = Utils.validateFile(source + os.sep + filename)
+            if errors:
+                self.invalid.add(source + os.sep + filename)
+                self.log.error("Invalid EAC-CPF will not be transformed: {0}\n{1}".format(filename, errors[0]['message']))
+            else:
+                self.invalid.discard(source + os.sep + filename)
+        return self.transformFile(source, filename, Transform)
 
     def transformHtmlToSid(self, Html, Output):
         """
@@ -426,17 +751,23 @@ class Transformer(object):
         """
         # create SID document
         data = Html.getHtmlIndexContent()
+        filename = "{0}.{1}".format(data['id'], self.output_format)
+        if not Utils.inShard(filename, self.shard):
+            return
+        self.records.append(filename)
+        dependency_hash = self._getDependencyHash(Html.source, None, data['id'])
+        if self._isUnchanged(filename, dependency_hash, Output):
+            return
+        self._recordSID(filename, None)
         root = etree.Element("add")
         doc = etree.SubElement(root, "doc")
         for key in data:
             f = etree.SubElement(doc, "field")
             f.attrib['name'] = key
             f.text = data[key]
-        # write SID document
-        filename = data['id'] + ".xml"
-        with open(Output + os.sep + filename, 'w') as f:
-            xml = etree.tostring(root, pretty_print=True)
-            f.write(xml)
+        # merge, set fields, boost and write SID document
+        self.processSID(etree.ElementTree(root), filename, Output)
+        self._recordSID(filename, dependency_hash)
         self.log.info("Transformed HTML to SID: {0}".format(filename))
 
     def transformHtmlsToSid(self, Sources, Output):
@@ -445,17 +776,58 @@ class Transformer(object):
         """
         for source in [s for s in Sources if os.path.exists(s)]:
             for filename in [f for f in os.listdir(source) if f.endswith('.htm') or f.endswith('.html')]:
+                start = time.perf_counter()
                 html = HtmlPage.HtmlPage(source, filename=filename)
                 try:
                     self.transformHtmlToSid(html, Output)
                 except:
+                    Metrics.count('transform', 'failed')
                     msg = "Could not transform HTML to SID: {0}".format(filename)
                     self.log.error(msg, exc_info=Cfg.LOG_EXC_INFO)
+                Metrics.timeDocument('transform', filename, start)
+
+    def validateEacCpfs(self, Sources):
+        """
+        Validate the EAC-CPF documents in the source paths against the EAC-CPF
+        schema. Return the set of paths to invalid documents, which are then
+        excluded from transformation.
+        """
+        invalid = set()
+        for source in [s for s in Sources if os.path.exists(s)]:
+            files = [f for f in os.listdir(source) if f.endswith(".xml") and Utils.inShard(f, self.shard)]
+            report = Utils.validate(source, Files=files, Workers=self.workers)
+            for filename in [f for f in report if report[f]]:
+                invalid.add(source + os.sep + filename)
+                self.log.error("Invalid EAC-CPF will not be transformed: {0}\n{1}".format(filename, report[filename][0]['message']))
+        return invalid
 
 
-def transform(params):
+def _initTransformWorker(Transformer_):
     """
-    Execute transform operation with the specified parameters.
+    Initialize a transform worker process. The stylesheet is compiled once
+    per worker, because compiled stylesheets can not be shared between
+    processes.
+    """
+    _worker['transformer'] = Transformer_
+    _worker['transform'] = Utils.loadTransform(Transformer_.xslt)
+
+def _transformShard(Args):
+    """
+    Transform a shard of EAC-CPF documents in a worker process. Return the
+    list of errors, the stage timings, the manifest entries and the document
+    times for the shard.
+    """
+    jobs, output = Args
+    transformer = _worker['transformer']
+    transformer.manifest = {}
+    transformer.timings = {}
+    Metrics.reset()
+    errors = transformer.transformEacCpfShard(jobs, output, _worker['transform'])
+    return errors, transformer.timings, transformer.manifest, Metrics.getDocumentTimes()
+
+def _getTransformer(params, update=False, shard=None):
+    """
+    Create a transformer with the specified parameters.
     """
     actions = params.get("transform", "actions").split(',')
     boosts = params.get("transform", "boost").split(',')
@@ -466,6 +838,29 @@ def transform(params):
         xslt = params.get("transform", "xslt")
     else:
         xslt=None
-        
-    transformer = Transformer(sources, output, actions=actions, boosts=boosts, set_fields=set_fields, transform=xslt)
+    if params.has_option("transform", "workers"):
+        workers = params.getint("transform", "workers")
+    else:
+        workers = 1
+    if params.has_option("transform", "format"):
+        output_format = params.get("transform", "format")
+        assert output_format in OUTPUT_FORMATS, "Unsupported output format: {0}".format(output_format)
+    else:
+        output_format = 'xml'
+    return Transformer(sources, output, actions=actions, boosts=boosts, set_fields=set_fields, transform=xslt,
+                       workers=workers, update=update, output_format=output_format, shard=shard)
+
+def merge(params):
+    """
+    Merge the file hash indexes and manifests written by each shard of the
+    transform.
+    """
+    transformer = _getTransformer(params)
+    transformer.merge()
+
+def transform(params, update=False, shard=None):
+    """
+    Execute transform operation with the specified parameters.
+    """
+    transformer = _getTransformer(params, update, shard)
     transformer.run()
@@ -7,10 +7,14 @@ from lxml import etree
 
 import Cfg
 import calendar
+import codecs
 import datetime
+import functools
 import hashlib
 import logging
+import multiprocessing
 import os
+import re
 import shutil
 import tempfile
 import urllib.request, urllib.error, urllib.parse
@@ -20,6 +24,23 @@ import sys
 
 log = logging.getLogger()
 
+# byte order marks, longest first so that UTF-32 is not mistaken for UTF-16
+ENCODING_BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32-le'),
+    (codecs.BOM_UTF32_BE, 'utf-32-be'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+ENCODING_DECLARATION = re.compile(br'^[^<]*<\?xml[^>]*encoding\s*=\s*["\']([A-Za-z0-9._-]+)["\']')
+ENCODING_SNIFF_LENGTH = 1024
+# the EAC-CPF schema, with local copies of the schemas that it imports
+EACCPF_SCHEMA = os.path.dirname(os.path.abspath(__file__)) + os.sep + "transform" + os.sep + "eaccpf.xsd"
+VALIDATE_CHUNK_SIZE = 16
+
+# compiled schemas, by path
+_schemas = {}
+
 
 def cleanList(L):
     """
@@ -29,10 +50,12 @@ def cleanList(L):
         item = cleanText(item)
     return list
 
-def cleanOutputFolder(Path, Update=False):
+def cleanOutputFolder(Path, Update=False, Shard=None, Keep=None):
     """
-    Clear all files from the output folder. If the folder does not exist
-    then create it.
+    Clear all files from the output folder, except for the files in the keep
+    list. If the folder does not exist then create it. If a shard is
+    specified, clear only the files of the records in that shard, and keep
+    the index files and folders.
     """
     if not os.path.exists(Path):
         os.makedirs(Path)
@@ -40,6 +63,10 @@ def cleanOutputFolder(Path, Update=False):
     if not Update:
         for filename in os.listdir(Path):
             path = Path + os.sep + filename
+            if Keep and filename in Keep:
+                continue
+            if Shard and (filename.startswith('.') or os.path.isdir(path) or not inShard(filename, Shard)):
+                continue
             if os.path.isdir(path):
                 shutil.rmtree(path)
             else:
@@ -56,6 +83,45 @@ def cleanText(Val):
     # clean = clean.replace('\n','')
     return clean
 
+def decodeText(Data):
+    """
+    Decode a byte string to text, using the encoding sniffed from its byte
+    order mark or XML declaration. UTF-8 is tried first where the document
+    does not declare otherwise. Return a tuple of the text and the encoding
+    that was used. Raise UnicodeDecodeError or LookupError if the data can
+    not be decoded.
+    """
+    encoding = detectEncoding(Data)
+    if encoding in ('utf-8', 'utf8'):
+        # fast path: most documents are UTF-8 or plain ASCII
+        return Data.decode('utf-8'), 'utf-8'
+    return Data.decode(encoding), encoding
+
+def detectEncoding(Data, Default='utf-8'):
+    """
+    Sniff the character encoding of a byte string from the byte order mark or
+    the encoding attribute of the XML declaration at the start of the data.
+    Return the default encoding if neither is present.
+    """
+    head = Data[:ENCODING_SNIFF_LENGTH]
+    for bom, encoding in ENCODING_BOMS:
+        if head.startswith(bom):
+            return encoding
+    # UTF-16 documents without a byte order mark begin with an ASCII
+    # character, so the NUL byte of its code unit gives the byte order
+    if head[1:2] == b'\x00' and head[0:1] != b'\x00':
+        return 'utf-16-le'
+    if head[0:1] == b'\x00' and head[1:2] != b'\x00':
+        return 'utf-16-be'
+    match = ENCODING_DECLARATION.search(head)
+    if match:
+        encoding = match.group(1).decode('ascii').lower()
+        # a document that declares UTF-16 without a byte order mark can not
+        # have reached this point, so the declaration is wrong
+        if not encoding.startswith('utf-16'):
+            return encoding
+    return Default
+
 def fixIncorrectDateEncoding(Date):
     """
     Fix date string to make it conform to ISO standard.
@@ -83,7 +149,7 @@ def getFileHash(Path, Filename=None):
     Get a SHA1 hash of the specified file.
     """
     path = Path + os.sep + Filename if Filename else Path
-    with open(path,'r') as f:
+    with open(path,'rb') as f:
         data = f.read()
     return hashlib.sha1(data).hexdigest()
 
@@ -123,6 +189,43 @@ def getRecordIdFromFilename(Filename):
     name, _ = os.path.splitext(Filename)
     return name
 
+def getShard(Value):
+    """
+    Parse a shard specification of the form i/N, where N is the number of
+    shards and i is the shard number from 1 to N. Return an (i, N) tuple.
+    """
+    try:
+        number, count = [int(part) for part in str(Value).split('/')]
+    except ValueError:
+        raise ValueError("Shard must be specified as i/N: {0}".format(Value))
+    if count < 1 or number < 1 or number > count:
+        raise ValueError("Shard number must be from 1 to N: {0}".format(Value))
+    return number, count
+
+def getShardFilename(Filename, Shard):
+    """
+    Get the name of the shard-local copy of an index file. The shard number
+    and count are inserted before the file name extension, so that
+    .index.yml becomes .index.2-of-4.yml for shard 2/4. If no shard is
+    specified, return the file name.
+    """
+    if not Shard:
+        return Filename
+    name, ext = os.path.splitext(Filename)
+    return "{0}.{1}-of-{2}{3}".format(name, Shard[0], Shard[1], ext)
+
+def getShardFilenames(Path, Filename):
+    """
+    Get the names of the shard-local copies of the index file in the
+    specified path, from the oldest to the newest.
+    """
+    if not os.path.exists(Path):
+        return []
+    name, ext = os.path.splitext(Filename)
+    pattern = re.compile(re.escape(name) + r'\.\d+-of-\d+' + re.escape(ext) + '$')
+    filenames = [f for f in os.listdir(Path) if pattern.match(f)]
+    return sorted(filenames, key=lambda f: os.path.getmtime(Path + os.sep + f))
+
 def getTemporaryFileFromResource(source):
     """
     Retrieve the web or file system resource and write it to a temporary file
@@ -139,6 +242,20 @@ def getTemporaryFileFromResource(source):
         shutil.copy(source, temp)
     return temp
 
+def inShard(Filename, Shard):
+    """
+    Determine if the record with the specified file name belongs to the
+    shard. Records are assigned by a SHA1 hash of the record ID, so that
+    every node assigns a record to the same shard, and the files of a record
+    in each stage belong to the same shard. If no shard is specified, every
+    record belongs to it.
+    """
+    if not Shard:
+        return True
+    number, count = Shard
+    record_id = getRecordIdFromFilename(Filename)
+    return int(hashlib.sha1(record_id.encode('utf-8')).hexdigest(), 16) % count == number - 1
+
 def isDigitalObjectYaml(Path, Filename=None):
     """
     Determines if the file at the specified path is an image record in
@@ -181,45 +298,66 @@ def isUrl(Path):
         return True
     return False
 
-def loadFileHashIndex(Path, Filename=Cfg.HASH_INDEX_FILENAME):
+def loadFileHashIndex(Path, Filename=Cfg.HASH_INDEX_FILENAME, Shard=None):
     """
-    Load the file hash index from the specified path.
+    Load the file hash index from the specified path. If a shard is
+    specified, load the shard-local index, or the entries for the shard from
+    the merged index if the shard has no index of its own.
     """
+    if Shard:
+        if os.path.exists(Path + os.sep + getShardFilename(Filename, Shard)):
+            return loadFileHashIndex(Path, getShardFilename(Filename, Shard))
+        index = loadFileHashIndex(Path, Filename)
+        return dict([(key, index[key]) for key in index if inShard(key, Shard)])
     if os.path.exists(Path + os.sep + Filename):
         with open(Path + os.sep + Filename,'r') as f:
             data = f.read()
-            index = yaml.load(data)
+            index = yaml.load(data, Loader=yaml.SafeLoader)
         if index != None:
             return index
     return {}
 
-def load_from_source(Source):
+def load_from_source(Source, Binary=False):
     """
-    Load text data from the specified source.
+    Load text data from the specified source. Return the raw bytes if Binary
+    is set, so that an XML parser can apply the declared encoding.
     """
     if 'http://' in Source or 'https://' in Source:
         response = urllib.request.urlopen(Source)
         data = response.read()
+        if Binary:
+            return data
         # data = unicode(data, errors='replace')
     else:
         assert os.path.exists(Source), "Resource does not exist {0}".format(Source)
-        with open(Source, 'r') as f:
+        with open(Source, 'rb' if Binary else 'r') as f:
             data = f.read()
+            if Binary:
+                return data
             # data = unicode(data, errors='replace')
     # the lxml parser won't accept unicode encoded strings and throws an
     # exception. pass it a str instead
     return str(data)
 
+def loadSchema(Path=EACCPF_SCHEMA):
+    """
+    Load the specified XML schema and return an LXML schema validator. The
+    compiled schema is cached, so that it is compiled only once per process.
+    """
+    path = os.path.abspath(Path)
+    if path not in _schemas:
+        _schemas[path] = etree.XMLSchema(etree.parse(path))
+        log.debug("Compiled schema {0}".format(path))
+    return _schemas[path]
+
 def loadTransform(Path):
     """
     Load the specified XSLT file and return an LXML transformer.
     """
-    with open(Path, 'r') as f:
-        xslt_data = f.read()
-    xslt_root = etree.XML(xslt_data)
+    xslt_root = etree.parse(Path)
     outp = etree.XSLT(xslt_root)
     return outp
-    
+
 
 def map_url_to_local_path(url, site_root_path):
     """
@@ -235,6 +373,32 @@ def map_url_to_local_path(url, site_root_path):
         return site_root_path
     return abs_path
 
+def mergeShardIndexes(Path, Filename=Cfg.HASH_INDEX_FILENAME, Partitioned=True):
+    """
+    Merge the shard-local copies of the index file in the specified path into
+    the index, then remove them. When the index is partitioned by record,
+    each shard index replaces the entries for that shard, so that records
+    that a shard deleted are removed from the merged index. Otherwise the
+    entries of each shard index are added. Shard indexes are merged from the
+    oldest to the newest. Return the merged index.
+    """
+    if not os.path.exists(Path):
+        return {}
+    shards = getShardFilenames(Path, Filename)
+    index = loadFileHashIndex(Path, Filename)
+    for filename in shards:
+        shard = tuple([int(n) for n in re.findall(r'\.(\d+)-of-(\d+)', filename)[-1]])
+        if Partitioned:
+            for key in [k for k in index if inShard(k, shard)]:
+                del index[key]
+        index.update(loadFileHashIndex(Path, filename))
+        log.debug("Merged {0} into {1}".format(filename, Filename))
+    if shards:
+        writeFileHashIndex(index, Path, Filename)
+        for filename in shards:
+            os.remove(Path + os.sep + filename)
+    return index
+
 def parseUnitDate(Date):
     """
     Parse unit date field to produce fromDate and toDate field values.
@@ -274,12 +438,16 @@ def parseUnitDate(Date):
             pass
     return None, None
 
-def purgeFolder(path, file_index):
+def purgeFolder(path, file_index, keep=None, shard=None):
     """
-    Purge all files in path not represented in the file index.
+    Purge all files in path not represented in the file index, except for
+    the files in the keep list. If a shard is specified, purge only the files
+    of the records in that shard, and keep the index files and folders.
     """
-    keys = list(file_index.keys())
+    keys = list(file_index.keys()) + (keep if keep else [])
     for filename in [f for f in os.listdir(path) if f not in keys]:
+        if shard and (filename.startswith('.') or os.path.isdir(path + os.sep + filename) or not inShard(filename, shard)):
+            continue
         file_path = path + os.sep + filename
         if os.path.isfile(file_path):
             os.remove(file_path)
@@ -309,7 +477,7 @@ def readYaml(Path, Filename):
     Load the specified YAML data file.
     """
     with open(Path + os.sep + Filename, 'r') as f:
-        yml = yaml.load(f)
+        yml = yaml.load(f, Loader=yaml.SafeLoader)
     return yml
 
 def resourceExists(Resource):
@@ -343,7 +511,7 @@ def tryReadYaml(Path, Filename):
     """
     try:
         with open(Path + os.sep + Filename, 'r') as f:
-            record = yaml.load(f)
+            record = yaml.load(f, Loader=yaml.SafeLoader)
         if record != None:
             return record
     except:
@@ -362,30 +530,48 @@ def urlToFileSystemPath(Url, FileSystemBase):
         FileSystemBase = FileSystemBase[:-1]
     return "{0}{1}".format(FileSystemBase, parts.path)
 
-def validate(Source, Schema):
+def validate(Source, Schema=EACCPF_SCHEMA, Files=None, Workers=1):
     """
-    Validate a collection of files against an XML schema.
+    Validate a collection of files against an XML schema. Files are validated
+    in a pool of worker processes when more than one worker is specified.
+    Return a dictionary of filename to a list of validation errors, where the
+    list is empty for a valid file.
     """
+    if Files is None:
+        Files = [f for f in os.listdir(Source) if f.endswith(".xml")]
+    paths = [Source + os.sep + f for f in Files]
+    # compile the schema before forking, so that workers inherit it
+    loadSchema(Schema)
+    if Workers > 1 and len(paths) > 1:
+        pool = multiprocessing.Pool(Workers)
+        try:
+            results = pool.map(functools.partial(validateFile, Schema=Schema), paths, chunksize=VALIDATE_CHUNK_SIZE)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [validateFile(path, Schema) for path in paths]
+    return dict(list(zip(Files, results)))
+
+def validateFile(Path, Schema=EACCPF_SCHEMA):
+    """
+    Validate a single file against an XML schema. Return a list of errors,
+    each with the line, column and message, or an empty list if the file is
+    valid.
+    """
+    schema = loadSchema(Schema)
+    parser = etree.XMLParser()
     try:
-        # load schemas
-        infile = open(Schema, 'r')
-        schema_data = infile.read()
-        schema_root = etree.XML(schema_data)
-        schema = etree.XMLSchema(schema_root)
-        infile.close()
-        # create validating parser
-        parser = etree.XMLParser(schema=schema)
-        # validate files against schema
-        files = os.listdir(Source)
-        for filename in files:
-            with open(Source + os.sep + filename,'r') as f:
-                data = f.read()
-            try:
-                etree.fromstring(data, parser)
-            except:
-                pass
-    except:
-        pass
+        doc = etree.parse(Path, parser)
+    except etree.XMLSyntaxError:
+        error_log = parser.error_log
+    except (IOError, OSError) as e:
+        return [{'line': 0, 'column': 0, 'message': str(e)}]
+    else:
+        if schema.validate(doc):
+            return []
+        error_log = schema.error_log
+    return [{'line': e.line, 'column': e.column, 'message': e.message} for e in error_log]
 
 def write(Path, Filename, Data):
     """
@@ -394,11 +580,12 @@ def write(Path, Filename, Data):
     with open(Path + os.sep + Filename, 'w') as f:
         f.write(Data)
 
-def writeFileHashIndex(Data, Path, Filename=Cfg.HASH_INDEX_FILENAME):
+def writeFileHashIndex(Data, Path, Filename=Cfg.HASH_INDEX_FILENAME, Shard=None):
     """
-    Write the file hash index to the specified path.
+    Write the file hash index to the specified path. If a shard is
+    specified, write the shard-local index.
     """
-    writeYaml(Path, Filename, Data)
+    writeYaml(Path, getShardFilename(Filename, Shard), Data)
 
 def writeYaml(Path, Filename, Data):
     """
@@ -0,0 +1,92 @@
+"""
+This file is subject to the terms and conditions defined in the
+LICENSE file, which is part of this source code package.
+"""
+
+import Cfg
+import Metrics
+import Timer
+import Utils
+import logging
+import os
+
+
+class Validator(object):
+    """
+    Validates EAC-CPF documents against the EAC-CPF schema and writes a report
+    of the errors found in each document. The schema is compiled once per
+    process and documents are validated in parallel by a pool of workers.
+    """
+
+    def __init__(self, source, output, schema=None, workers=1, update=False):
+        self.hashIndex = {}
+        self.log = logging.getLogger()
+        self.report = {}
+        # set parameters
+        self.output = output
+        self.schema = schema if schema else Utils.EACCPF_SCHEMA
+        self.source = source
+        self.update = update
+        self.workers = workers
+
+    def validate(self):
+        """
+        Validate the new and changed documents in the source folder. Return
+        the list of documents that were found.
+        """
+        records = [f for f in os.listdir(self.source) if f.endswith(".xml")]
+        changed = []
+        for filename in records:
+            fileHash = Utils.getFileHash(self.source, filename)
+            if self.update and self.hashIndex.get(filename) == fileHash and filename in self.report:
+                Metrics.count('validate', 'skipped')
+                continue
+            self.hashIndex[filename] = fileHash
+            changed.append(filename)
+        for filename, errors in list(Utils.validate(self.source, self.schema, changed, self.workers).items()):
+            self.report[filename] = {'valid': len(errors) == 0, 'errors': errors}
+            Metrics.count('validate', 'failed' if errors else 'processed')
+            Metrics.countFile('validate', 'bytes_read', self.source + os.sep + filename)
+            if errors:
+                self.log.error("{0} does not conform to the schema: {1}".format(filename, errors[0]['message']))
+        return records
+
+    def run(self):
+        """
+        Execute validation using the specified parameters.
+        """
+        with Timer.Timer() as t:
+            # make output folder
+            if not os.path.exists(self.output):
+                os.makedirs(self.output)
+            # check state
+            assert os.path.exists(self.source), self.log.error("Source path does not exist: {0}".format(self.source))
+            assert os.path.exists(self.output), self.log.error("Output path does not exist: {0}".format(self.output))
+            # load the prior report and file hashes, so that we can track what has changed
+            if self.update:
+                self.hashIndex = Utils.loadFileHashIndex(self.output)
+                self.report = Utils.tryReadYaml(self.output, Cfg.VALIDATION_REPORT_FILENAME)
+            records = self.validate()
+            # remove records that were deleted in the source
+            Utils.purgeIndex(records, self.hashIndex)
+            Utils.purgeIndex(records, self.report)
+            # write the report and the updated file hash index
+            Utils.writeYaml(self.output, Cfg.VALIDATION_REPORT_FILENAME, self.report)
+            Utils.writeFileHashIndex(self.hashIndex, self.output)
+            invalid = len([f for f in self.report if not self.report[f]['valid']])
+            self.log.info("Validated {0} documents. {1} invalid.".format(len(self.report), invalid))
+        Metrics.recordTime('validate', t.elapsed, t.cpu)
+        # log execution time
+        self.log.info("Validator finished in {0}".format(t))
+
+
+def validate(params, update=False):
+    """
+    Execute validation with the specified parameters.
+    """
+    source = params.get("validate", "input")
+    output = params.get("validate", "output")
+    schema = params.get("validate", "schema") if params.has_option("validate", "schema") else None
+    workers = params.getint("validate", "workers") if params.has_option("validate", "workers") else 1
+    validator = Validator(source, output, schema, workers, update)
+    validator.run()
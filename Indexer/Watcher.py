@@ -0,0 +1,276 @@
+"""
+This file is subject to the terms and conditions defined in the
+LICENSE file, which is part of this source code package.
+"""
+
+import Cfg
+import Metrics
+import ctypes
+import ctypes.util
+import logging
+import os
+import re
+import select
+import struct
+import time
+
+
+__description__ = """Watches the crawl input folder and streams the records affected by each change through the pipeline."""
+
+# default number of seconds without further changes before changes are
+# processed
+DEBOUNCE = 1.0
+
+# default number of seconds between scans of the folder when polling
+POLL_INTERVAL = 5.0
+
+# inotify event masks and flags, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+# size of the fixed part of an inotify event: wd, mask, cookie, len
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class Watcher(object):
+    """
+    Watches a folder tree for files that are written, created, deleted or
+    moved. Changes are read from inotify on Linux, and the tree is scanned
+    periodically for changed modification times and sizes otherwise, or when
+    polling is requested. Subfolders whose names match an exclude pattern
+    are not watched, as they are not crawled.
+
+    Changes are debounced, so that a file that is written several times, or
+    a batch of files that is copied into the tree, is reported once the
+    tree has been quiet for the debounce interval.
+    """
+
+    def __init__(self, path, exclude=None, debounce=DEBOUNCE, poll_interval=POLL_INTERVAL, polling=False):
+        self.fd = None
+        self.log = logging.getLogger()
+        self.scanned = 0.0 # time of the last scan of the tree
+        self.snapshot = {}
+        self.watches = {} # watched folder for each watch descriptor
+        # parameters
+        self.debounce = debounce
+        self.exclude = [re.compile(p) for p in exclude] if exclude else []
+        self.path = os.path.abspath(path)
+        self.poll_interval = poll_interval
+        # watch the tree
+        assert os.path.isdir(self.path), self.log.error("Watch path does not exist: {0}".format(self.path))
+        if not polling:
+            try:
+                self._initInotify()
+            except (AttributeError, OSError):
+                self.log.warning("Could not watch {0} with inotify. Polling for changes instead.".format(self.path),
+                                 exc_info=Cfg.LOG_EXC_INFO)
+                self.close()
+        if self.fd is None:
+            self.snapshot = self._scan()
+            self.scanned = time.time()
+
+    def _addWatches(self, Path):
+        """
+        Watch the folder and its subfolders. Return the paths of the files
+        that are already in them.
+        """
+        files = []
+        for path, sub_dirs, filenames in os.walk(Path):
+            for sub_dir in [d for d in sub_dirs if self._isExcluded(d)]:
+                sub_dirs.remove(sub_dir)
+            wd = self.libc.inotify_add_watch(self.fd, path.encode('utf-8'), WATCH_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, "Could not watch {0}: {1}".format(path, os.strerror(errno)))
+            self.watches[wd] = path
+            files.extend([os.path.join(path, f) for f in filenames])
+        return files
+
+    def _initInotify(self):
+        """
+        Create the inotify instance and watch the tree.
+        """
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, "Could not initialize inotify: {0}".format(os.strerror(errno)))
+        self.fd = fd
+        self._addWatches(self.path)
+
+    def _isExcluded(self, Name):
+        """
+        Determine if the folder name matches an exclude pattern.
+        """
+        return any([p.match(Name) for p in self.exclude])
+
+    def _poll(self, Timeout):
+        """
+        Scan the tree until a change is found or the timeout elapses. Return
+        the list of changed file paths. The tree is scanned at most once per
+        poll interval, however often this is called.
+        """
+        deadline = None if Timeout is None else time.time() + Timeout
+        while True:
+            delay = self.scanned + self.poll_interval - time.time()
+            if delay > 0:
+                if deadline is not None and time.time() + delay > deadline:
+                    time.sleep(max(deadline - time.time(), 0))
+                    return []
+                time.sleep(delay)
+            snapshot = self._scan()
+            self.scanned = time.time()
+            changes = [p for p in set(snapshot) | set(self.snapshot) if snapshot.get(p) != self.snapshot.get(p)]
+            self.snapshot = snapshot
+            if changes:
+                return changes
+
+    def _read(self, Timeout):
+        """
+        Read inotify events until an event arrives or the timeout elapses.
+        Return the list of changed file paths, or None if events were lost
+        or a watched folder was removed, so that the whole tree must be
+        processed again.
+        """
+        deadline = None if Timeout is None else time.time() + Timeout
+        changes = []
+        while not changes:
+            remaining = None if deadline is None else max(deadline - time.time(), 0)
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if not ready:
+                return changes
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                continue
+            offset = 0
+            rescan = False
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+                offset += EVENT_HEADER.size + length
+                folder = self.watches.get(wd)
+                if mask & IN_Q_OVERFLOW:
+                    rescan = True
+                elif mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                elif folder is None:
+                    continue
+                elif mask & IN_DELETE_SELF:
+                    rescan = rescan or folder == self.path
+                elif mask & IN_ISDIR:
+                    path = os.path.join(folder, name.decode('utf-8', 'replace'))
+                    if mask & (IN_CREATE | IN_MOVED_TO) and not self._isExcluded(os.path.basename(path)):
+                        # files may have been written before the watch was added
+                        changes.extend(self._addWatches(path) if os.path.isdir(path) else [])
+                    elif mask & (IN_DELETE | IN_MOVED_FROM):
+                        # the files that were in the folder are not known
+                        rescan = True
+                else:
+                    changes.append(os.path.join(folder, name.decode('utf-8', 'replace')))
+            if rescan:
+                return None
+        return changes
+
+    def _scan(self):
+        """
+        Get the modification time and size of each file in the tree.
+        """
+        snapshot = {}
+        for path, sub_dirs, filenames in os.walk(self.path):
+            for sub_dir in [d for d in sub_dirs if self._isExcluded(d)]:
+                sub_dirs.remove(sub_dir)
+            for filename in filenames:
+                try:
+                    stat = os.stat(os.path.join(path, filename))
+                except OSError:
+                    continue
+                snapshot[os.path.join(path, filename)] = (stat.st_mtime, stat.st_size)
+        return snapshot
+
+    def changes(self, Timeout=None):
+        """
+        Wait for the tree to change. Return the list of changed file paths,
+        or None if the whole tree must be processed again.
+        """
+        if self.fd is not None:
+            return self._read(Timeout)
+        return self._poll(Timeout)
+
+    def close(self):
+        """
+        Stop watching the tree.
+        """
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            self.watches = {}
+
+    def wait(self, Timeout=None):
+        """
+        Wait for the tree to change, then wait until there have been no
+        further changes for the debounce interval. Return the sorted list of
+        changed file paths, an empty list if there were no changes before
+        the timeout, or None if the whole tree must be processed again.
+        """
+        changes = self.changes(Timeout)
+        if changes is not None and not changes:
+            return []
+        while True:
+            more = self.changes(self.debounce)
+            if more is not None and not more:
+                break
+            changes = None if changes is None or more is None else changes + more
+        return None if changes is None else sorted(set(changes))
+
+
+def watch(params, stages, shard=None, stop=None):
+    """
+    Stream the records in the crawl input folder through the specified
+    stages, then watch the folder and stream the records affected by each
+    change through the stages until the stop event is set. The run report
+    is written after each run. If a shard is specified, only the documents
+    of the records in that shard are processed.
+    """
+    import Pipeline
+    assert stages and stages[0] == 'crawl', "Watch mode requires the crawl stage"
+    source = params.get("crawl", "input")
+    assert not '://' in source, "Watch mode requires a file system crawl input"
+    # optional configuration values
+    exclude = params.get("crawl", "exclude").split(',') if params.has_option("crawl", "exclude") else []
+    debounce = params.getfloat("watch", "debounce") if params.has_option("watch", "debounce") else DEBOUNCE
+    poll_interval = params.getfloat("watch", "poll-interval") if params.has_option("watch", "poll-interval") else POLL_INTERVAL
+    polling = params.getboolean("watch", "polling") if params.has_option("watch", "polling") else False
+    log = logging.getLogger()
+    runner = Pipeline._getPipeline(params, stages, True, shard)
+    # changes made during the first run are read once it is complete
+    watcher = Watcher(source, exclude, debounce, poll_interval, polling)
+    try:
+        Metrics.reset()
+        runner.run()
+        Metrics.write(params)
+        log.info("Watching {0} for changes".format(source))
+        while not (stop and stop.is_set()):
+            changes = watcher.wait(1.0)
+            if changes is None:
+                log.warning("Changes were lost. Updating all records.")
+            elif changes:
+                log.info("Processing {0} changed files".format(len(changes)))
+            else:
+                continue
+            Metrics.reset()
+            runner.run(changes)
+            Metrics.write(params)
+    finally:
+        watcher.close()
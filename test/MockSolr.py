@@ -0,0 +1,201 @@
+"""
+This file is subject to the terms and conditions defined in the
+LICENSE file, which is part of this source code package.
+"""
+
+import argparse
+import gzip
+import http.server
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+
+
+__description__ = """Local mock of the Solr update handler for testing and
+benchmarking the Poster without a Solr server. Accepts XML and JSON updates,
+deletes and commits after a configurable delay, injects errors, and counts
+the requests, documents and bytes that it receives and the time taken to
+handle each update. Keeps the document IDs in each core, and answers document
+count queries and the CoreAdmin SWAP and Collections alias commands."""
+
+
+class MockSolrHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Solr request handler. Queued error status codes are returned for the next
+    update requests, then errors are returned at random at the error rate.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def _getCore(self, Path):
+        """
+        Get the name of the core that the request path addresses, resolving
+        collection aliases.
+        """
+        name = Path.split('/')[2]
+        return self.server.solr.aliases.get(name, name)
+
+    def _read(self):
+        """
+        Read the request body, which may be chunked and gzip compressed.
+        Record the number of bytes received.
+        """
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                chunk = self.rfile.read(size)
+                self.rfile.readline()
+                if size == 0:
+                    break
+                chunks.append(chunk)
+            data = b''.join(chunks)
+        else:
+            data = self.rfile.read(int(self.headers['Content-Length']))
+        with self.server.solr.lock:
+            self.server.solr.bytes += len(data)
+            self.server.solr.encodings.append(self.headers.get('Content-Encoding'))
+        return gzip.decompress(data) if self.headers.get('Content-Encoding') == 'gzip' else data
+
+    def _send(self, Status, Data=None):
+        """
+        Send the response with an optional JSON body.
+        """
+        body = json.dumps(Data).encode('utf-8') if Data is not None else b''
+        self.send_response(Status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _update(self, Path, Data):
+        """
+        Apply an update request to the core.
+        """
+        solr = self.server.solr
+        core = solr.cores.setdefault(self._getCore(Path), set())
+        solr.requests.append((Path, Data))
+        if Path.partition('?')[0].endswith('/json/docs'):
+            docs = json.loads(Data.decode('utf-8'))
+            ids = [str(doc.get('id')).encode('utf-8') for doc in (docs if isinstance(docs, list) else [docs])]
+            solr.updates.append(Data)
+            solr.ids.extend(ids)
+            core.update(ids)
+        elif Data.startswith(b'<add'):
+            ids = re.findall(rb'<field name="id">([^<]*)</field>', Data)
+            solr.updates.append(Data)
+            solr.ids.extend(ids)
+            core.update(ids)
+        elif Data == b'<delete><query>*:*</query></delete>':
+            core.clear()
+        elif Data.startswith(b'<delete>'):
+            core.difference_update(re.findall(rb'<id>([^<]*)</id>', Data))
+        elif Data.startswith(b'<commit'):
+            solr.commits += 1
+
+    def do_GET(self):
+        solr = self.server.solr
+        path, _, query = self.path.partition('?')
+        params = dict(urllib.parse.parse_qsl(query))
+        with solr.lock:
+            if path == '/solr/admin/cores' and params.get('action') == 'SWAP':
+                core, other = params['core'], params['other']
+                solr.cores[core], solr.cores[other] = solr.cores.get(other, set()), solr.cores.get(core, set())
+                return self._send(200, {})
+            if path == '/solr/admin/collections' and params.get('action') == 'LISTALIASES':
+                return self._send(200, {'aliases': dict(solr.aliases)})
+            if path == '/solr/admin/collections' and params.get('action') == 'CREATEALIAS':
+                solr.aliases[params['name']] = params['collections']
+                return self._send(200, {})
+            if path.endswith('/select'):
+                return self._send(200, {'response': {'numFound': len(solr.cores.get(self._getCore(path), set()))}})
+        self._send(404)
+
+    def do_POST(self):
+        solr = self.server.solr
+        with solr.lock:
+            solr.in_flight += 1
+            solr.max_in_flight = max(solr.max_in_flight, solr.in_flight)
+            solr.connections.add(self.client_address)
+        start = time.time()
+        data = self._read()
+        time.sleep(solr.latency)
+        with solr.lock:
+            solr.in_flight -= 1
+            if solr.errors:
+                status = solr.errors.pop(0)
+            elif solr.error_rate and random.random() < solr.error_rate:
+                status = 503
+            else:
+                status = 200
+            if status == 200:
+                self._update(self.path, data)
+            else:
+                solr.failures += 1
+            solr.latencies.append(time.time() - start)
+        self._send(status)
+
+    def log_message(self, *args):
+        pass
+
+
+class MockSolr(object):
+    """
+    Local Solr server that runs the mock request handler in a thread. The
+    server URL addresses the TEST core.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, port=0):
+        """
+        :param latency: seconds to wait before responding to each update
+        :param error_rate: fraction of updates that fail with HTTP 503
+        :param port: port to listen on, or 0 for any free port
+        """
+        self.aliases = {}
+        self.bytes = 0
+        self.commits = 0
+        self.connections = set()
+        self.cores = {}
+        self.encodings = []
+        self.error_rate = error_rate
+        self.errors = []
+        self.failures = 0
+        self.ids = []
+        self.in_flight = 0
+        self.latencies = []
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.max_in_flight = 0
+        self.requests = []
+        self.updates = []
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', port), MockSolrHandler)
+        self.server.daemon_threads = True
+        self.server.solr = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = "http://127.0.0.1:{0}/solr/TEST".format(self.server.server_address[1])
+
+    def close(self):
+        """
+        Stop the server.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__description__)
+    parser.add_argument('--port', help="port to listen on", type=int, default=8983)
+    parser.add_argument('--latency', help="seconds to wait before responding to each update", type=float, default=0.0)
+    parser.add_argument('--error-rate', help="fraction of updates that fail with HTTP 503", type=float, default=0.0)
+    args = parser.parse_args()
+    solr = MockSolr(args.latency, args.error_rate, args.port)
+    print("Mock Solr listening at {0}".format(solr.url))
+    try:
+        while True:
+            time.sleep(10)
+            print("{0} requests, {1} documents, {2} commits, {3} errors, {4} bytes".format(
+                len(solr.requests), len(solr.ids), solr.commits, solr.failures, solr.bytes))
+    except KeyboardInterrupt:
+        solr.close()
@@ -0,0 +1,371 @@
+"""
+This file is subject to the terms and conditions defined in the
+LICENSE file, which is part of this source code package.
+"""
+
+from PIL import Image
+from xml.sax.saxutils import escape, quoteattr
+
+import argparse
+import json
+import os
+import random
+import time
+
+
+__description__ = """Generate a synthetic OHRM style web site for testing and
+benchmarking the indexer at scale. Each entity has an HTML presentation page
+with an EAC meta link, and an EAC-CPF record with name entries, exist dates,
+places, functions, a biographical history with a chronology, relations to
+other entities and published resources, and digital objects. Each digital
+object has an HTML presentation page and a JPEG image. The site is generated
+from a seed, so that the same seed and size always give the same documents."""
+
+# public URL that corresponds with the site folder
+BASE = "http://www.example.org/"
+
+# file that describes the generated site
+MANIFEST = "site.json"
+
+# default random seed
+SEED = 1
+
+# fraction of the entities that have digital objects, and the most digital
+# objects that an entity may have
+DIGITAL_OBJECT_RATE = 0.3
+DIGITAL_OBJECTS = 3
+
+# most relations that an entity may have to other entities. The number of
+# relations follows a power law, so that a few entities are hubs.
+RELATIONS = 40
+
+# fraction of the documents with the markup and entity problems that the
+# Cleaner repairs
+DIRTY_RATE = 0.05
+
+GIVEN_NAMES = ['Alice', 'Arthur', 'Beatrice', 'Charles', 'Doris', 'Edward', 'Elsie', 'Frank', 'George', 'Harold',
+               'Ivy', 'James', 'Jean', 'Kathleen', 'Leonard', 'Margaret', 'Mary', 'Norman', 'Patricia', 'Ronald',
+               'Shirley', 'Thomas', 'Violet', 'William']
+SURNAMES = ['Anderson', 'Brown', 'Campbell', 'Davies', "D'Arcy", 'Evans', 'Fraser', 'Graham', 'Hughes', 'Kelly',
+            'MacDonald', 'Murphy', "O'Neill", 'Robertson', 'Smith', 'Stewart', 'Taylor', 'Thompson', 'Walker',
+            'Wilson']
+ORGANISATION_WORDS = ['Anglican', 'Boys', 'Catholic', 'Children', 'Family', 'Girls', 'Methodist', 'Mission',
+                      'Presbyterian', 'Salvation', 'Training', 'Welfare', 'Youth']
+ORGANISATION_TYPES = ['Home', 'Orphanage', 'Society', 'School', 'Hostel', 'Farm School', 'Reception Centre',
+                      'Department', 'Committee']
+FUNCTIONS = ['Adoption Agency', 'Babies Home', 'Care Provider', 'Children\'s Home', 'Community Service Organisation',
+             'Foster Care Agency', 'Government Department', 'Industrial School', 'Juvenile Justice', 'Reformatory',
+             'Residential Care', 'Training Farm', 'Youth Hostel']
+LOCAL_TYPES = [('corporateBody', 'Organisation'), ('corporateBody', 'Organisation'), ('corporateBody', 'Organisation'),
+               ('person', 'Person'), ('person', 'Person'), ('corporateBody', 'Legislation'),
+               ('corporateBody', 'Event'), ('corporateBody', 'Concept')]
+PLACES = [('Ballarat', -37.5622, 143.8503), ('Bendigo', -36.7570, 144.2794), ('Brunswick', -37.7667, 144.9600),
+          ('Burwood', -37.8490, 145.1150), ('Geelong', -38.1499, 144.3617), ('Kew', -37.8060, 145.0310),
+          ('Melbourne', -37.8136, 144.9631), ('Mildura', -34.2080, 142.1246), ('Sale', -38.1000, 147.0667),
+          ('Shepparton', -36.3833, 145.4000), ('Warrnambool', -38.3833, 142.4833), ('Wodonga', -36.1218, 146.8881)]
+PLACE_ROLES = ['Start Place', 'Location', 'End Place']
+RELATION_TYPES = ['associative', 'associative', 'associative', 'temporal-earlier', 'temporal-later', 'hierarchical']
+RESOURCE_TYPES = ['Archival Collection', 'Book', 'Journal Article', 'Report', 'Online Resource', 'Film']
+WORDS = ['admission', 'after', 'archives', 'boys', 'building', 'care', 'children', 'church', 'committee', 'council',
+         'department', 'during', 'established', 'family', 'farm', 'former', 'girls', 'government', 'home',
+         'institution', 'management', 'moved', 'operated', 'opened', 'orphanage', 'provided', 'records', 'residents',
+         'school', 'society', 'state', 'the', 'the', 'the', 'to', 'training', 'under', 'was', 'welfare', 'which',
+         'with', 'years', 'young']
+
+_DOCUMENT = """<?xml version="1.0" encoding="UTF-8"?>
+<eac-cpf xmlns="urn:isbn:1-931666-33-4" xmlns:xlink="http://www.w3.org/1999/xlink" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="urn:isbn:1-931666-33-4 http://eac.staatsbibliothek-berlin.de/schema/cpf.xsd">
+<control>
+<recordId>{record_id}</recordId>
+<maintenanceStatus>revised</maintenanceStatus>
+<maintenanceAgency>
+<agencyCode>AU-EXMP</agencyCode>
+<agencyName>{agency}</agencyName>
+</maintenanceAgency>
+<languageDeclaration>
+<language languageCode="eng">English</language>
+<script scriptCode="Latn">Latin</script>
+</languageDeclaration>
+<localControl localType="typeOfEntity">
+<term>{local_type}</term>
+</localControl>
+<maintenanceHistory>
+<maintenanceEvent>
+<eventType>created</eventType>
+<eventDateTime standardDateTime="{created}">{created}</eventDateTime>
+<agentType>human</agentType>
+<agent>{agent}</agent>
+</maintenanceEvent>
+</maintenanceHistory>
+</control>
+<cpfDescription>
+<identity>
+<entityId>{presentation_url}</entityId>
+<entityType>{entity_type}</entityType>
+<nameEntry><part>{name}</part>
+<authorizedForm>AACR2</authorizedForm>
+</nameEntry>
+</identity>
+<description>
+<existDates>
+<dateRange>
+<fromDate standardDate="{from_year}-01-01">{from_year}</fromDate>
+<toDate standardDate="{to_year}-12-31">{to_year}</toDate>
+</dateRange>
+</existDates>
+{places}{functions}<biogHist>
+<abstract>{abstract}</abstract>
+{paragraphs}{chronology}</biogHist>
+</description>
+{relations}</cpfDescription>
+</eac-cpf>
+"""
+
+_PAGE = """<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Strict//EN"
+        "http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">
+<head>
+	<meta http-equiv="content-type" content="text/html; charset=utf-8" />
+	<title>{title}</title>
+	<meta name="DC.Title" lang="en" content={title_attr} />
+	<meta name="DC.Creator" lang="en" content="Example Heritage Resource Project" />
+	<meta name="DC.Description" lang="en" content={description_attr} />
+	<meta name="DC.Date.Created" scheme="ISO8601" lang="en" content="{created}" />
+	<meta name="DC.Type" lang="en" content="Document" />
+	<meta name="DC.Format" scheme="IMT" lang="en" content="text/html" />
+	<meta name="DC.Identifier" scheme="URL" lang="en" content="{url}" />
+	<meta name="Generator" content="Online Heritage Resource Manager (OHRM) V Alpha 2.15+++" />
+{meta}	<link rel="stylesheet" href="../site/stylesheets/master.css" type="text/css" media="screen" />
+	<script type="text/javascript" src="../site/js/main.js"></script>
+</head>
+<body id="{body_id}">
+<!-- header -->
+<div id="header"><a href="../browse.htm">Browse</a></div>
+<script type="text/javascript">
+	document.getElementById('header').className = 'js';
+</script>
+<div id="content">
+{content}</div>
+<div id="footer"><p>Example Heritage Resource Project</p></div>
+</body>
+</html>
+"""
+
+
+def _getEacCpf(Entity, Summaries):
+    """
+    Get the EAC-CPF document of the entity.
+    """
+    places = ''.join(['<place>\n<placeRole>{0}</placeRole>\n<placeEntry latitude="{2}" longitude="{3}">{1}</placeEntry>\n'
+                      '</place>\n'.format(role, *place) for role, place in Entity['places']])
+    functions = ''.join(['<function>\n<term>{0}</term>\n</function>\n'.format(escape(f)) for f in Entity['functions']])
+    paragraphs = ''.join(['<p>{0}</p>\n'.format(p) for p in Entity['paragraphs']])
+    chronology = ''.join(['<chronItem>\n<dateRange><fromDate standardDate="{0}-01-01">{0}</fromDate>\n</dateRange>\n'
+                          '<placeEntry>{1}</placeEntry>\n<event>{2}</event>\n</chronItem>\n'.format(*item)
+                          for item in Entity['chronology']])
+    # the schema does not allow empty lists
+    places = '<places>\n{0}</places>\n'.format(places) if places else ''
+    functions = '<functions>\n{0}</functions>\n'.format(functions) if functions else ''
+    chronology = '<chronList>\n{0}</chronList>\n'.format(chronology) if chronology else ''
+    relations = []
+    for index, relation_type in Entity['related']:
+        other = Summaries[index]
+        relations.append('<cpfRelation cpfRelationType="{0}" xlink:type="simple" xlink:href="{1}">\n'
+                         '<relationEntry localType="{2}">{3} ({4} - {5})</relationEntry>\n'
+                         '</cpfRelation>\n'.format(relation_type, other['presentation_url'], other['local_type'],
+                                                   escape(other['name']), other['from_year'], other['to_year']))
+    for resource_type, title in Entity['resources']:
+        relations.append('<resourceRelation resourceRelationType="other">\n'
+                         '<relationEntry localType="published">{0}: {1}</relationEntry>\n'
+                         '<objectXMLWrap>\n<bibref xmlns="urn:isbn:1-931666-22-9">\n<title render="italic">{1}</title>\n'
+                         '</bibref>\n</objectXMLWrap>\n</resourceRelation>\n'.format(resource_type, title))
+    for object_id, url, title, year in Entity['objects']:
+        relations.append('<resourceRelation resourceRelationType="other" xlink:type="simple" xlink:href="{0}">\n'
+                         '<relationEntry localType="digitalObject">{1}</relationEntry>\n'
+                         '<objectXMLWrap>\n<archref xmlns="urn:isbn:1-931666-22-9">\n<unittitle>{1}</unittitle>\n'
+                         '<unitdate>{2}</unitdate>\n<abstract>{1}</abstract>\n</archref>\n</objectXMLWrap>\n'
+                         '<descriptiveNote><p>Include in Gallery</p></descriptiveNote>\n</resourceRelation>\n'.format(url, title, year))
+    relations = '<relations>\n{0}</relations>\n'.format(''.join(relations)) if relations else ''
+    abstract = Entity['abstract']
+    if Entity['dirty']:
+        # markup and double escaped entities, as exported by older OHRM sites
+        abstract = abstract.replace(' ', ' <span style="font-style:italic">&amp;amp;</span> ', 1)
+    return _DOCUMENT.format(abstract=abstract, agency=Entity['agency'], agent=escape(Entity['agent']),
+                            chronology=chronology, created=Entity['created'], entity_type=Entity['entity_type'],
+                            from_year=Entity['from_year'], functions=functions, local_type=Entity['local_type'],
+                            name=escape(Entity['name']), paragraphs=paragraphs, places=places,
+                            presentation_url=Entity['presentation_url'], record_id=Entity['record_id'],
+                            relations=relations, to_year=Entity['to_year'])
+
+def _getEntity(Index, Summaries, Seed, Base):
+    """
+    Get the full description of the entity. The description is generated from
+    its own random sequence, so that each entity can be generated separately.
+    """
+    rng = random.Random("{0}-{1}-entity".format(Seed, Index))
+    entity = dict(Summaries[Index])
+    related = set([rng.randrange(len(Summaries)) for _ in range(min(int(rng.paretovariate(1.2)), RELATIONS))])
+    entity.update({
+        'abstract': _getWords(rng, rng.randint(10, 40)),
+        'agency': "Example Heritage Resource",
+        'agent': "{0} {1}".format(rng.choice(GIVEN_NAMES), rng.choice(SURNAMES)),
+        'created': "{0}-{1:02d}-{2:02d}".format(rng.randint(2005, 2014), rng.randint(1, 12), rng.randint(1, 28)),
+        'dirty': rng.random() < DIRTY_RATE,
+        'functions': rng.sample(FUNCTIONS, rng.randint(0, 4)),
+        'objects': [],
+        'paragraphs': [_getWords(rng, rng.randint(30, 120)) for _ in range(rng.randint(1, 6))],
+        'places': [(rng.choice(PLACE_ROLES), rng.choice(PLACES)) for _ in range(rng.randint(0, 3))],
+        'related': [(i, rng.choice(RELATION_TYPES)) for i in sorted(related - set([Index]))],
+        'resources': [(rng.choice(RESOURCE_TYPES), _getWords(rng, rng.randint(3, 8))) for _ in range(rng.randint(0, 4))],
+    })
+    entity['chronology'] = [(rng.randint(entity['from_year'], entity['to_year']), rng.choice(PLACES)[0],
+                             _getWords(rng, rng.randint(5, 15))) for _ in range(rng.randint(0, 5))]
+    if entity['dirty']:
+        entity['agency'] = "Find &amp;amp; Connect"
+    if rng.random() < DIGITAL_OBJECT_RATE:
+        for i in range(rng.randint(1, DIGITAL_OBJECTS)):
+            object_id = "D{0:06d}{1}".format(Index, i)
+            title = "{0} {1}".format(rng.choice(['Photograph of', 'Image of', 'Plan of', 'Letter from']), entity['name'])
+            year = rng.randint(entity['from_year'], entity['to_year'])
+            entity['objects'].append((object_id, "{0}objects/{1}.htm".format(Base, object_id), title, year))
+    return entity, rng
+
+def _getName(Rng, LocalType):
+    """
+    Get a random name for an entity of the local type.
+    """
+    if LocalType == 'Person':
+        return "{0}, {1}".format(Rng.choice(SURNAMES), Rng.choice(GIVEN_NAMES))
+    if LocalType == 'Legislation':
+        return "{0} Act {1}".format(Rng.choice(ORGANISATION_WORDS), Rng.randint(1860, 2000))
+    if LocalType == 'Event':
+        return "{0} {1} Inquiry".format(Rng.choice(PLACES)[0], Rng.choice(ORGANISATION_WORDS))
+    return "{0} {1} {2}".format(Rng.choice(PLACES)[0], Rng.choice(ORGANISATION_WORDS), Rng.choice(ORGANISATION_TYPES))
+
+def _getObjectPage(Entity, ObjectId, Url, Title, Year):
+    """
+    Get the HTML presentation page of the digital object.
+    """
+    content = '<h1>{0}</h1>\n<p>{1}</p>\n<a href="../biogs/{2}b.htm">{3}</a>\n' \
+              '<img id="dothumb" class="img imgShadow" src="../objects/images/{4}.jpg" border="0" alt={5} />\n'.format(
+                  escape(Title), Year, Entity['record_id'], escape(Entity['name']), ObjectId, quoteattr(Title))
+    return _PAGE.format(body_id="dobject", content=content, created=Entity['created'], description_attr=quoteattr(Title),
+                        meta='', title=escape(Title), title_attr=quoteattr(Title), url=Url)
+
+def _getPage(Entity, Summaries):
+    """
+    Get the HTML presentation page of the entity.
+    """
+    title = "{0} - {1} - Example Heritage Resource".format(Entity['name'], Entity['local_type'])
+    content = ['<h1>{0}</h1>\n'.format(escape(Entity['name'])),
+               '<p class="dates">{0} - {1}</p>\n'.format(Entity['from_year'], Entity['to_year']),
+               '<p class="abstract">{0}</p>\n'.format(Entity['abstract'])]
+    content.extend(['<p>{0}</p>\n'.format(p) for p in Entity['paragraphs']])
+    content.append('<ul class="related">\n')
+    for index, _ in Entity['related']:
+        other = Summaries[index]
+        content.append('<li><a href="../biogs/{0}b.htm">{1}</a></li>\n'.format(other['record_id'], escape(other['name'])))
+    content.append('</ul>\n')
+    for object_id, url, object_title, _ in Entity['objects']:
+        content.append('<a href="../objects/{0}.htm"><img src="../objects/images/{0}.jpg" alt={1} /></a>\n'.format(
+            object_id, quoteattr(object_title)))
+    meta = '\t<meta name="EAC" lang="en" content="{0}" />\n'.format(Entity['metadata_url'])
+    return _PAGE.format(body_id="biogs", content=''.join(content), created=Entity['created'],
+                        description_attr=quoteattr(Entity['abstract']), meta=meta, title=escape(title),
+                        title_attr=quoteattr(title), url=Entity['presentation_url'])
+
+def _getSummary(Index, Seed, Base):
+    """
+    Get the name, type and dates of the entity, which are used by the entities
+    that relate to it.
+    """
+    rng = random.Random("{0}-{1}".format(Seed, Index))
+    entity_type, local_type = rng.choice(LOCAL_TYPES)
+    record_id = "E{0:06d}".format(Index)
+    from_year = rng.randint(1850, 1990)
+    return {
+        'entity_type': entity_type,
+        'from_year': from_year,
+        'local_type': local_type,
+        'metadata_url': "{0}eac/{1}.xml".format(Base, record_id),
+        'name': _getName(rng, local_type),
+        'presentation_url': "{0}biogs/{1}b.htm".format(Base, record_id),
+        'record_id': record_id,
+        'to_year': min(from_year + rng.randint(1, 100), 2014),
+    }
+
+def _getWords(Rng, Count):
+    """
+    Get a sentence of random words.
+    """
+    return ' '.join([Rng.choice(WORDS) for _ in range(Count)]).capitalize() + '.'
+
+def _write(Path, Data):
+    """
+    Write the text to the file.
+    """
+    with open(Path, 'w', encoding='utf-8') as f:
+        f.write(Data)
+
+def _writeImage(Path, Rng):
+    """
+    Write a JPEG image of a random size with a few coloured blocks.
+    """
+    width, height = Rng.randint(160, 800), Rng.randint(120, 600)
+    image = Image.new('RGB', (width, height), tuple([Rng.randint(0, 255) for _ in range(3)]))
+    for _ in range(Rng.randint(2, 6)):
+        x, y = Rng.randrange(width), Rng.randrange(height)
+        block = (Rng.randint(8, width // 2), Rng.randint(8, height // 2))
+        image.paste(tuple([Rng.randint(0, 255) for _ in range(3)]), (x, y, min(x + block[0], width), min(y + block[1], height)))
+    image.save(Path, 'JPEG', quality=75)
+
+def get_manifest(Output):
+    """
+    Get the description of the site in the output folder, or None if there is
+    no site in the folder.
+    """
+    try:
+        with open(Output + os.sep + MANIFEST, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def make_site(Output, Size, Seed=SEED, Base=BASE):
+    """
+    Write a site with the specified number of entities to the output folder.
+    The site is not written again if the folder already holds the site for
+    the size, seed and base. Return the description of the site.
+    """
+    manifest = get_manifest(Output)
+    if manifest and [manifest['size'], manifest['seed'], manifest['base']] == [Size, Seed, Base]:
+        return manifest
+    for folder in ['biogs', 'eac', 'objects', 'objects' + os.sep + 'images']:
+        os.makedirs(Output + os.sep + folder, exist_ok=True)
+    start = time.time()
+    summaries = [_getSummary(i, Seed, Base) for i in range(Size)]
+    objects = 0
+    relations = 0
+    for index in range(Size):
+        entity, rng = _getEntity(index, summaries, Seed, Base)
+        _write(Output + os.sep + "eac" + os.sep + entity['record_id'] + ".xml", _getEacCpf(entity, summaries))
+        _write(Output + os.sep + "biogs" + os.sep + entity['record_id'] + "b.htm", _getPage(entity, summaries))
+        for object_id, url, title, year in entity['objects']:
+            _write(Output + os.sep + "objects" + os.sep + object_id + ".htm", _getObjectPage(entity, object_id, url, title, year))
+            _writeImage(Output + os.sep + "objects" + os.sep + "images" + os.sep + object_id + ".jpg", rng)
+        objects += len(entity['objects'])
+        relations += len(entity['related'])
+    manifest = {'base': Base, 'digital_objects': objects, 'entities': Size, 'relations': relations, 'seed': Seed,
+                'seconds': time.time() - start, 'size': Size}
+    _write(Output + os.sep + MANIFEST, json.dumps(manifest, indent=2, sort_keys=True))
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__description__)
+    parser.add_argument('output', help="folder to write the site to")
+    parser.add_argument('--size', help="number of entities", type=int, default=1000)
+    parser.add_argument('--seed', help="random seed", type=int, default=SEED)
+    parser.add_argument('--base', help="public URL of the site", default=BASE)
+    args = parser.parse_args()
+    manifest = make_site(args.output, args.size, args.seed, args.base)
+    print("{0} entities, {1} digital objects, {2} relations in {3:.1f} s".format(
+        manifest['entities'], manifest['digital_objects'], manifest['relations'], manifest['seconds']))
@@ -0,0 +1,65 @@
+"""
+This file is subject to the terms and conditions defined in the
+LICENSE file, which is part of this source code package.
+"""
+
+from Indexer import Cleaner
+
+import argparse
+import inspect
+import os
+import tempfile
+import timeit
+
+
+__description__ = """Time the Cleaner text rules over the problem documents in
+test/exceptions, and over the same documents repeated with increasing amounts
+of span markup to show that the cost grows linearly with document size."""
+
+
+def load_exceptions(Path):
+    """
+    Load the text of each XML and HTML document in the specified folder.
+    """
+    documents = {}
+    for filename in sorted(os.listdir(Path)):
+        if filename.endswith(('.xml', '.htm', '.html')):
+            with open(Path + os.sep + filename, 'r', encoding='utf-8') as f:
+                documents[filename] = f.read()
+    return documents
+
+
+def run(Repeat, Scales):
+    """
+    Execute the benchmark and print timings.
+    """
+    module_path = os.path.dirname(os.path.abspath(inspect.getfile(run)))
+    documents = load_exceptions(module_path + os.sep + "exceptions")
+    temp = tempfile.mkdtemp()
+    cleaner = Cleaner.Cleaner(temp, temp)
+    rules = [
+        ('_fixAmpersands', cleaner._fixAmpersands),
+        ('_fixEntityReferences', cleaner._fixEntityReferences),
+        ('_removePreHeaderGarbage', cleaner._removePreHeaderGarbage),
+        ('_removeSpanTags', cleaner._removeSpanTags),
+    ]
+    corpus = ''.join(documents.values())
+    print("{0} documents, {1} characters, best of {2}".format(len(documents), len(corpus), Repeat))
+    for name, rule in rules:
+        best = min(timeit.repeat(lambda: [rule(d) for d in documents.values()], number=1, repeat=Repeat))
+        print("{0:<26} {1:>9.2f} ms".format(name, best * 1000))
+    # heavy markup: the cost per character should stay flat as spans increase
+    print("\n_removeSpanTags on heavy markup")
+    unit = '<span style="font-style:italic">text</span> & <span>more</span>\n'
+    for scale in Scales:
+        data = corpus + unit * scale
+        best = min(timeit.repeat(lambda: cleaner._removeSpanTags(data), number=1, repeat=Repeat))
+        print("{0:>8} spans {1:>9.2f} ms {2:>8.1f} ns/char".format(scale * 2, best * 1000, best * 1e9 / len(data)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__description__)
+    parser.add_argument('--repeat', help="number of timing repetitions", type=int, default=5)
+    parser.add_argument('--scales', help="comma separated span counts", default="1000,10000,100000")
+    args = parser.parse_args()
+    run(args.repeat, [int(s) for s in args.scales.split(',')])
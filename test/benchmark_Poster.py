@@ -0,0 +1,101 @@
+"""
+This file is subject to the terms and conditions defined in the
+LICENSE file, which is part of this source code package.
+"""
+
+from Indexer import Poster
+from test.MockSolr import MockSolr
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+
+__description__ = """Time the Poster against a local mock Solr update handler
+for different batch sizes and numbers of concurrent requests. Report documents
+per second, the median and 99th percentile request latency measured by the
+mock, and the bytes sent. The mock responds to each update after a fixed
+delay, so that the cost of a remote Solr is modelled without running one."""
+
+
+def make_corpus(Output, Size, Format):
+    """
+    Write the specified number of synthetic Solr Input Documents to the
+    output folder in XML or JSON format.
+    """
+    text = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 20
+    for i in range(Size):
+        doc = {"id": "B{0:07d}".format(i), "title": "Entity {0}".format(i), "type": "Person", "abstract": text,
+               "function": ["Research", "Teaching"]}
+        if Format == 'json':
+            data = json.dumps(doc, separators=(',', ':')) + "\n"
+        else:
+            fields = [(name, value) for name in doc for value in (doc[name] if isinstance(doc[name], list) else [doc[name]])]
+            data = "<?xml version='1.0' encoding='UTF-8'?>\n<add>\n  <doc>\n" + \
+                   "".join(['    <field name="{0}">{1}</field>\n'.format(n, v) for n, v in fields]) + "  </doc>\n</add>\n"
+        with open(Output + os.sep + "B{0:07d}.{1}".format(i, Format), 'w') as f:
+            f.write(data)
+
+
+def percentile(Values, Percent):
+    """
+    Get the value at the specified percentile of the values.
+    """
+    values = sorted(Values)
+    return values[int(round(Percent / 100.0 * (len(values) - 1)))] if values else 0.0
+
+
+def run_post(Source, Size, BatchSize, Concurrency, Latency, ErrorRate, Compress):
+    """
+    Post the corpus to a new mock Solr server and print the timings.
+    """
+    solr = MockSolr(latency=Latency, error_rate=ErrorRate)
+    try:
+        poster = Poster.Poster(Source, solr.url, ['post'], batch_size=BatchSize, concurrency=Concurrency,
+                               compress=Compress, backoff=0.01)
+        start = time.time()
+        poster.post()
+        elapsed = time.time() - start
+        print("{0:>6} {1:>6} {2:>10.1f} {3:>10.1f} {4:>10.1f} {5:>12} {6:>12} {7:>8}".format(
+            BatchSize, Concurrency, Size / elapsed, percentile(solr.latencies, 50) * 1000,
+            percentile(solr.latencies, 99) * 1000,
+            poster.bytes_raw, poster.bytes_sent, solr.failures))
+    finally:
+        solr.close()
+
+
+def run(Size, Batches, Concurrency, Latency, ErrorRate, Format, Compress):
+    """
+    Execute the benchmark and print timings.
+    """
+    temp = tempfile.mkdtemp()
+    try:
+        make_corpus(temp, Size, Format)
+        print("{0} {1} documents, {2:.0f} ms latency, {3:.0%} errors{4}".format(
+            Size, Format, Latency * 1000, ErrorRate, ", gzip" if Compress else ""))
+        print("{0:>6} {1:>6} {2:>10} {3:>10} {4:>10} {5:>12} {6:>12} {7:>8}".format(
+            "batch", "conc", "docs/s", "p50 ms", "p99 ms", "raw bytes", "sent bytes", "errors"))
+        for batch_size in Batches:
+            for concurrency in Concurrency:
+                run_post(temp, Size, batch_size, concurrency, Latency, ErrorRate, Compress)
+    finally:
+        shutil.rmtree(temp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__description__)
+    parser.add_argument('--size', help="number of documents to post", type=int, default=2000)
+    parser.add_argument('--batches', help="comma separated batch sizes", default="1,10,100")
+    parser.add_argument('--concurrency', help="comma separated numbers of concurrent requests", default="1,4")
+    parser.add_argument('--latency', help="mock Solr response delay in seconds", type=float, default=0.01)
+    parser.add_argument('--error-rate', help="fraction of requests that fail with HTTP 503", type=float, default=0.0)
+    parser.add_argument('--format', help="document format", choices=['json', 'xml'], default='xml')
+    parser.add_argument('--compress', help="gzip compress request bodies", action='store_true')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+    run(args.size, [int(b) for b in args.batches.split(',')], [int(c) for c in args.concurrency.split(',')],
+        args.latency, args.error_rate, args.format, args.compress)
@@ -0,0 +1,247 @@
+"""
+This file is subject to the terms and conditions defined in the
+LICENSE file, which is part of this source code package.
+"""
+
+from Indexer import Analyzer
+from Indexer import Cleaner
+from Indexer import Crawler
+from Indexer import Metrics
+from Indexer import Poster
+from Indexer import Timer
+from Indexer import Transformer
+from test import SyntheticSite
+from test.MockSolr import MockSolr
+
+import argparse
+import datetime
+import inspect
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+
+
+__description__ = """Time each indexing stage over synthetic OHRM style sites
+of increasing size. The crawl and graph stages read the site, the clean stage
+reads the EAC-CPF documents of the site, and the transform, post and analyze
+stages read the output of the stage before them. Documents are posted to a
+local mock Solr server. Report the wall clock and CPU time and documents per
+second of each stage, append the results and the commit that was measured to
+a results file, and compare them with the last results for the same site
+from another commit. A stage that processes no documents, or that fails on
+any document, is reported as failed rather than timed."""
+
+# stages that can be benchmarked, in the order that they run
+STAGES = ['crawl', 'clean', 'transform', 'post', 'analyze', 'graph']
+
+# default results file
+RESULTS = "benchmark_results.jsonl"
+
+
+def get_commit():
+    """
+    Get a description of the commit that is being measured, or None if the
+    source is not in a git working tree.
+    """
+    module_path = os.path.dirname(os.path.abspath(inspect.getfile(get_commit)))
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=module_path,
+                                       stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_results(Path):
+    """
+    Load the results of earlier runs from the results file.
+    """
+    if not os.path.exists(Path):
+        return []
+    with open(Path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def find_baseline(Results, Result, Commit=None):
+    """
+    Find the last result for the same site size, seed and worker count from
+    the specified commit, or from any other commit if none is specified.
+    """
+    key = [Result['size'], Result['seed'], Result['workers']]
+    for result in reversed(Results):
+        if [result['size'], result['seed'], result['workers']] != key:
+            continue
+        if Commit and result['commit'] and result['commit'].startswith(Commit):
+            return result
+        if not Commit and result['commit'] != Result['commit']:
+            return result
+    return None
+
+
+def run_analyze(Site, Work, Manifest, Workers):
+    """
+    Analyze the cleaned EAC-CPF documents.
+    """
+    Analyzer.Analyzer(Work + os.sep + "clean", Work + os.sep + "analyze").run()
+
+
+def run_clean(Site, Work, Manifest, Workers):
+    """
+    Clean the EAC-CPF documents of the site.
+    """
+    Cleaner.Cleaner(Work + os.sep + "clean", Site + os.sep + "eac").run()
+
+
+def run_crawl(Site, Work, Manifest, Workers):
+    """
+    Crawl the site for EAC-CPF documents and digital objects.
+    """
+    os.makedirs(Work + os.sep + "cache")
+    crawler = Crawler.Crawler(['eaccpf', 'eaccpf-digitalobject'], Manifest['base'], Site, Work + os.sep + "crawl",
+                              Work + os.sep + "cache", Manifest['base'] + "cache", sleep=0.0)
+    crawler.run()
+
+
+def run_graph(Site, Work, Manifest, Workers):
+    """
+    Build the entity graph of the site. The graph is not drawn, as laying out
+    a large graph takes much longer than building it. Return the number of
+    pages in the graph.
+    """
+    from Indexer import Grapher
+    grapher = Grapher.Grapher(Site + os.sep, Work + os.sep + "graph", '', Manifest['base'],
+                              ['entity-type', 'local-type', 'function', 'relation'], [])
+    grapher.graph_entities()
+    return len([n for n, data in grapher.graph.nodes(data=True) if data.get('type') == 'html'])
+
+
+def run_post(Site, Work, Manifest, Workers):
+    """
+    Post the Solr Input Documents to a new mock Solr server. Return the number
+    of documents that the server received.
+    """
+    solr = MockSolr()
+    try:
+        Poster.Poster(Work + os.sep + "transform", solr.url, ['post'], backoff=0.01).post()
+        return len(solr.ids)
+    finally:
+        solr.close()
+
+
+def run_transform(Site, Work, Manifest, Workers):
+    """
+    Transform the cleaned EAC-CPF documents to Solr Input Documents.
+    """
+    module_path = os.path.dirname(os.path.abspath(inspect.getfile(run_transform)))
+    xslt = module_path + os.sep + "transform" + os.sep + "test.xsl"
+    Transformer.Transformer([Work + os.sep + "clean"], Work + os.sep + "transform", actions=['eaccpf-to-sid'],
+                            transform=xslt, workers=Workers).run()
+
+
+def run_stage(Stage, Site, Work, Manifest, Workers):
+    """
+    Run the stage and get its timings and counters. The stage counters are
+    read from the metrics registry that the stage modules record to.
+    """
+    Metrics.reset()
+    error = None
+    documents = None
+    with Timer.Timer() as t:
+        try:
+            documents = globals()['run_' + Stage](Site, Work, Manifest, Workers)
+        except Exception as e:
+            error = "{0}: {1}".format(e.__class__.__name__, e)
+    counters = Metrics.getReport()['stages'].get(Stage, {})
+    Metrics.reset()
+    documents = documents if documents is not None else counters.get('processed', 0)
+    # a stage that failed on its documents measured nothing useful
+    if not error and documents == 0:
+        error = "No documents were processed"
+    elif not error and counters.get('failed'):
+        error = "{0} documents failed".format(counters['failed'])
+    result = {
+        'cpu_seconds': t.cpu,
+        'documents': documents,
+        'seconds': t.elapsed,
+        'throughput': documents / t.elapsed if t.elapsed and not error else None,
+    }
+    result.update([(counter, counters[counter]) for counter in ['bytes_read', 'bytes_written', 'failed'] if counter in counters])
+    if error:
+        result['error'] = error
+    return result
+
+
+def print_result(Result, Baseline):
+    """
+    Print the timings of each stage, and the change in wall clock time from
+    the baseline.
+    """
+    print("{0} entities, {1} digital objects, seed {2}, {3} workers, {4}".format(
+        Result['entities'], Result['digital_objects'], Result['seed'], Result['workers'], Result['commit']))
+    print("{0:<10} {1:>8} {2:>10} {3:>10} {4:>10} {5:>10} {6:>8}".format(
+        "stage", "docs", "wall s", "cpu s", "docs/s", "base s", "change"))
+    for stage, values in Result['stages'].items():
+        base = Baseline['stages'].get(stage) if Baseline else None
+        change = ''
+        if base and base['seconds'] and 'error' not in values and 'error' not in base:
+            change = "{0:+.1%}".format(values['seconds'] / base['seconds'] - 1)
+        print("{0:<10} {1:>8} {2:>10.2f} {3:>10.2f} {4:>10} {5:>10} {6:>8}".format(
+            stage, values['documents'], values['seconds'], values['cpu_seconds'],
+            "{0:.1f}".format(values['throughput']) if values['throughput'] is not None else '-',
+            "{0:.2f}".format(base['seconds']) if base else '', change))
+        if 'error' in values:
+            print("{0:<10} failed: {1}".format('', values['error']))
+    if Baseline:
+        print("compared with {0} at {1}".format(Baseline['commit'], Baseline['timestamp']))
+    print('')
+
+
+def run(Sizes, Seed, Stages, Workers, Sites, Results, Compare):
+    """
+    Execute the benchmark for each site size, print timings, and append the
+    results to the results file.
+    """
+    temp = tempfile.mkdtemp()
+    commit = get_commit()
+    try:
+        for size in Sizes:
+            site = (Sites if Sites else temp) + os.sep + "site-{0}-{1}".format(size, Seed)
+            manifest = SyntheticSite.make_site(site, size, Seed)
+            work = temp + os.sep + "work-{0}".format(size)
+            result = {
+                'commit': commit,
+                'digital_objects': manifest['digital_objects'],
+                'entities': manifest['entities'],
+                'python': platform.python_version(),
+                'seed': Seed,
+                'size': size,
+                'stages': {},
+                'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+                'workers': Workers,
+            }
+            for stage in [s for s in STAGES if s in Stages]:
+                result['stages'][stage] = run_stage(stage, site, work, manifest, Workers)
+            shutil.rmtree(work, ignore_errors=True)
+            print_result(result, find_baseline(load_results(Results), result, Compare))
+            with open(Results, 'a') as f:
+                f.write(json.dumps(result, sort_keys=True) + "\n")
+    finally:
+        shutil.rmtree(temp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__description__)
+    parser.add_argument('--sizes', help="comma separated numbers of entities", default="1000,10000")
+    parser.add_argument('--seed', help="random seed of the synthetic sites", type=int, default=SyntheticSite.SEED)
+    parser.add_argument('--stages', help="comma separated stages to run", default=','.join(STAGES))
+    parser.add_argument('--workers', help="number of transform worker processes", type=int, default=1)
+    parser.add_argument('--sites', help="folder to keep the generated sites in between runs")
+    parser.add_argument('--results', help="file to append the results to", default=RESULTS)
+    parser.add_argument('--compare', help="commit to compare with, defaults to the last other commit measured")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+    run([int(s) for s in args.sizes.split(',')], args.seed, args.stages.split(','), args.workers, args.sites,
+        args.results, args.compare)
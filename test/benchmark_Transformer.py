@@ -0,0 +1,89 @@
+"""
+This file is subject to the terms and conditions defined in the
+LICENSE file, which is part of this source code package.
+"""
+
+from Indexer import Transformer
+
+import argparse
+import inspect
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+
+__description__ = """Time the EAC-CPF to Solr Input Document transform with
+different numbers of worker processes and report documents per second. The
+test/transform documents are copied until the corpus has the requested size.
+Then time the set-fields and boost actions over the transformed documents with
+increasing numbers of configured fields, to show that each document is read
+and written once regardless of the number of fields."""
+
+
+def make_corpus(Source, Output, Size):
+    """
+    Copy the EAC-CPF documents in the source folder to the output folder under
+    new names until the output folder holds the specified number of documents.
+    """
+    filenames = sorted([f for f in os.listdir(Source) if f.endswith(".xml")])
+    for i in range(Size):
+        filename = filenames[i % len(filenames)]
+        shutil.copy(Source + os.sep + filename, Output + os.sep + "B{0:07d}.xml".format(i))
+
+
+def run_set_fields(Source, Output, Fields):
+    """
+    Time the set-fields and boost actions over the Solr Input Documents in the
+    source folder for each number of configured fields.
+    """
+    size = len([f for f in os.listdir(Source) if f.endswith(".xml")])
+    print("\nset-fields and boost")
+    for count in Fields:
+        shutil.rmtree(Output, ignore_errors=True)
+        shutil.copytree(Source, Output)
+        names = ["field{0}".format(i) for i in range(count)]
+        transformer = Transformer.Transformer([Output], Output, boosts=[n + ":10" for n in names],
+                                              set_fields=[n + ":value" for n in names])
+        start = time.time()
+        transformer.setFieldValue(Output)
+        transformer.setBoosts(Output)
+        elapsed = time.time() - start
+        print("{0:>4} fields {1:>8.2f} s {2:>10.3f} ms/doc".format(count, elapsed, elapsed * 1000 / size))
+
+
+def run(Size, Workers, Xslt, Fields):
+    """
+    Execute the benchmark and print timings.
+    """
+    module_path = os.path.dirname(os.path.abspath(inspect.getfile(run)))
+    source = module_path + os.sep + "transform"
+    xslt = Xslt if Xslt else source + os.sep + "test.xsl"
+    temp = tempfile.mkdtemp()
+    try:
+        corpus = temp + os.sep + "corpus"
+        os.mkdir(corpus)
+        make_corpus(source + os.sep + "clean", corpus, Size)
+        print("{0} documents, {1}".format(Size, os.path.basename(xslt)))
+        for workers in Workers:
+            output = temp + os.sep + "output-{0}".format(workers)
+            transformer = Transformer.Transformer([corpus], output, actions=['eaccpf-to-sid'], transform=xslt, workers=workers)
+            start = time.time()
+            transformer.run()
+            elapsed = time.time() - start
+            print("{0:>3} workers {1:>8.2f} s {2:>10.1f} docs/s".format(workers, elapsed, Size / elapsed))
+        run_set_fields(output, temp + os.sep + "set-fields", Fields)
+    finally:
+        shutil.rmtree(temp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__description__)
+    parser.add_argument('--size', help="number of documents to transform", type=int, default=2000)
+    parser.add_argument('--workers', help="comma separated worker counts", default="1,2,4")
+    parser.add_argument('--fields', help="comma separated numbers of configured fields", default="1,4,16,64")
+    parser.add_argument('--xslt', help="stylesheet to benchmark, defaults to test/transform/test.xsl")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+    run(args.size, [int(w) for w in args.workers.split(',')], args.xslt, [int(f) for f in args.fields.split(',')])
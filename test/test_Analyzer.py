@@ -218,13 +218,13 @@ class TestAnalyzer(unittest.TestCase):
         '''
         It should determine whether an EAC-CPF file is valid and conforms to 
         the document schema.
-        @todo this test is failing systematically, likely because the schema is not in sync w the files we are producing
         '''
         cases = [
-            ('E000001.xml', True),
-            ('E000002.xml', True),
-            ('E000003.xml', True),
-            # ('invalid.xml', False),
+            ('E000001.xml', False),
+            ('E000002.xml', False),
+            ('E000004.xml', True),
+            ('E000009.xml', True),
+            ('invalid.xml', False),
         ]
         for case in cases:
             filename, expected = case
@@ -232,6 +232,7 @@ class TestAnalyzer(unittest.TestCase):
                 data = f.read()
             result, errors = self.analyzer._isConformantToEacCpfSchema(data)
             self.assertEqual(expected, result)
+            self.assertEqual(expected, len(errors) == 0)
 
     def test__isEacCpfFile(self):
         '''
@@ -3,9 +3,16 @@ This file is subject to the terms and conditions defined in the
 LICENSE file, which is part of this source code package.
 '''
 
+from Indexer import Cfg
 from Indexer import Cleaner
+from Indexer import Utils
 
+import inspect
+import os
+import shutil
+import tempfile
 import unittest
+import yaml
 
 
 class TestCleaner(unittest.TestCase):
@@ -17,13 +24,20 @@ class TestCleaner(unittest.TestCase):
         '''
         Setup the test environment.
         '''
-        pass
-    
+        self.module = os.path.abspath(inspect.getfile(self.__class__))
+        self.module_path = os.path.dirname(self.module)
+        self.exceptions = self.module_path + os.sep + "exceptions"
+        self.temp = tempfile.mkdtemp()
+        self.source = self.temp + os.sep + "source"
+        self.output = self.temp + os.sep + "output"
+        self.quarantine = self.temp + os.sep + "quarantine"
+        os.mkdir(self.source)
+
     def tearDown(self):
         '''
         Tear down the test environment.
         '''
-        pass
+        shutil.rmtree(self.temp, ignore_errors=True)
 
     def test_init(self):
         '''
@@ -38,12 +52,153 @@ class TestCleaner(unittest.TestCase):
         '''
         pass
     
+    def test_clean_mixed_encodings(self):
+        '''
+        It should detect the encoding of each source file, write the cleaned
+        file as UTF-8, and quarantine files that can not be decoded.
+        '''
+        text = '<?xml version="1.0" encoding="{0}"?>\n<eac-cpf><name>Caf\u00e9</name></eac-cpf>'
+        cases = [
+            ("utf8.xml", text.format("UTF-8").encode('utf-8')),
+            ("utf16bom.xml", text.format("UTF-16").encode('utf-16')),
+            ("utf16le.xml", text.format("UTF-16").encode('utf-16-le')),
+            ("latin1.xml", text.format("ISO-8859-1").encode('latin-1')),
+        ]
+        for filename, data in cases:
+            with open(self.source + os.sep + filename, 'wb') as f:
+                f.write(data)
+        with open(self.source + os.sep + "broken.xml", 'wb') as f:
+            f.write(text.format("UTF-8").encode('latin-1'))
+        cleaner = Cleaner.Cleaner(self.output, self.source, quarantine=self.quarantine)
+        cleaner.run()
+        for filename, _ in cases:
+            with open(self.output + os.sep + filename, 'r', encoding='utf-8') as f:
+                data = f.read()
+            self.assertIn('Caf\u00e9', data)
+            self.assertNotIn('UTF-16', data)
+        self.assertFalse(os.path.exists(self.output + os.sep + "broken.xml"))
+        self.assertTrue(os.path.exists(self.quarantine + os.sep + "broken.xml"))
+        with open(self.quarantine + os.sep + Cleaner.QUARANTINE_REPORT_FILENAME, 'r') as f:
+            report = yaml.safe_load(f)
+        self.assertEqual(['broken.xml'], list(report.keys()))
+
+    def test_clean_update_quarantine(self):
+        '''
+        It should keep files quarantined by an earlier run when updating,
+        and release them once they are cleaned or deleted.
+        '''
+        text = '<?xml version="1.0" encoding="UTF-8"?>\n<eac-cpf><name>Café</name></eac-cpf>'
+        with open(self.source + os.sep + "good.xml", 'wb') as f:
+            f.write(text.encode('utf-8'))
+        with open(self.source + os.sep + "broken.xml", 'wb') as f:
+            f.write(text.encode('latin-1'))
+        with open(self.source + os.sep + "other.xml", 'wb') as f:
+            f.write(text.encode('latin-1'))
+        Cleaner.Cleaner(self.output, self.source, quarantine=self.quarantine).run()
+        # only the good file is cleaned in the update
+        cleaner = Cleaner.Cleaner(self.output, self.source, update=True, quarantine=self.quarantine)
+        cleaner.prepare()
+        cleaner.cleanFile("good.xml")
+        cleaner.complete(Partial=True)
+        report = Utils.readYaml(self.quarantine, Cleaner.QUARANTINE_REPORT_FILENAME)
+        self.assertEqual(['broken.xml', 'other.xml'], sorted(report.keys()))
+        self.assertTrue(os.path.exists(self.quarantine + os.sep + "broken.xml"))
+        # fix one file and delete the other
+        with open(self.source + os.sep + "broken.xml", 'wb') as f:
+            f.write(text.encode('utf-8'))
+        os.remove(self.source + os.sep + "other.xml")
+        Cleaner.Cleaner(self.output, self.source, update=True, quarantine=self.quarantine).run()
+        report = Utils.readYaml(self.quarantine, Cleaner.QUARANTINE_REPORT_FILENAME)
+        self.assertEqual({}, report)
+        self.assertFalse(os.path.exists(self.quarantine + os.sep + "broken.xml"))
+        self.assertFalse(os.path.exists(self.quarantine + os.sep + "other.xml"))
+        self.assertTrue(os.path.exists(self.output + os.sep + "broken.xml"))
+
+    def test_fixAmpersands(self):
+        '''
+        It should escape bare ampersands and leave entity and character
+        references intact.
+        '''
+        cleaner = Cleaner.Cleaner(self.output, self.source)
+        cases = [
+            ("A & B", "A &amp; B"),
+            ("A &amp; B &lt; C", "A &amp; B &lt; C"),
+            ("&#169; &#xA9; &frac12;", "&#169; &#xA9; &frac12;"),
+            ("&&", "&amp;&amp;"),
+        ]
+        for data, expected in cases:
+            self.assertEqual(expected, cleaner._fixAmpersands(data))
+
+    def test_removePreHeaderGarbage(self):
+        '''
+        It should remove characters preceding the first tag on the first line
+        of the document.
+        '''
+        cleaner = Cleaner.Cleaner(self.output, self.source)
+        cases = [
+            ('\ufeff\x00junk<?xml version="1.0"?><a>b</a>', '<?xml version="1.0"?><a>b</a>'),
+            ('<?xml version="1.0"?><a>b</a>', '<?xml version="1.0"?><a>b</a>'),
+            ('\n<a>b</a>', '\n<a>b</a>'),
+        ]
+        for data, expected in cases:
+            self.assertEqual(expected, cleaner._removePreHeaderGarbage(data))
+
+    def test_removeSpanTags_exceptions(self):
+        '''
+        It should remove every span tag, with or without attributes, from the
+        problem documents and leave the remaining content unchanged.
+        '''
+        cleaner = Cleaner.Cleaner(self.output, self.source)
+        for filename in [f for f in os.listdir(self.exceptions) if f.endswith(('.xml', '.htm', '.html'))]:
+            with open(self.exceptions + os.sep + filename, 'r', encoding='utf-8') as f:
+                data = f.read()
+            # strip the span tags by scanning for each tag in turn
+            expected = data
+            for tag in ['<span>', '</span>', '<span ']:
+                i = expected.find(tag)
+                while i > -1:
+                    end = expected.index('>', i) + 1
+                    expected = expected[:i] + expected[end:]
+                    i = expected.find(tag, i)
+            result = cleaner._removeSpanTags(data)
+            self.assertNotIn('<span', result)
+            self.assertNotIn('</span>', result)
+            self.assertEqual(expected, result, filename)
+
     def test_clean_html(self):
         '''
         It should fix errors and common problems found in HTML files, then 
         write a cleaned file to the specified location.
         '''
         pass
+
+    def test_run_shards(self):
+        '''
+        It should clean only the files of the records in the shard, so that
+        shards cleaning into the same output folder together clean every
+        file once, and the merged file hash index describes the whole output.
+        '''
+        filenames = ["E{0:06d}.xml".format(i) for i in range(20)]
+        for filename in filenames:
+            with open(self.source + os.sep + filename, 'w') as f:
+                f.write('<?xml version="1.0" encoding="UTF-8"?>\n<eac-cpf><name>{0}</name></eac-cpf>'.format(filename))
+        shards = [Utils.getShard("1/2"), Utils.getShard("2/2")]
+        for shard in shards:
+            cleaner = Cleaner.Cleaner(self.output, self.source, shard=shard)
+            cleaner.run()
+            self.assertEqual(sorted([f for f in filenames if Utils.inShard(f, shard)]), sorted(cleaner.records))
+        self.assertEqual(filenames, sorted([f for f in os.listdir(self.output) if not f.startswith('.')]))
+        Cleaner.Cleaner(self.output, self.source).merge()
+        self.assertEqual(filenames, sorted(Utils.loadFileHashIndex(self.output).keys()))
+        self.assertEqual([], Utils.getShardFilenames(self.output, Cfg.HASH_INDEX_FILENAME))
+        # an update of the shard of a deleted file removes it from the output
+        # and the merged index
+        os.remove(self.source + os.sep + filenames[0])
+        shard = [s for s in shards if Utils.inShard(filenames[0], s)][0]
+        Cleaner.Cleaner(self.output, self.source, update=True, shard=shard).run()
+        Cleaner.Cleaner(self.output, self.source).merge()
+        self.assertEqual(filenames[1:], sorted([f for f in os.listdir(self.output) if not f.startswith('.')]))
+        self.assertEqual(filenames[1:], sorted(Utils.loadFileHashIndex(self.output).keys()))
     
 if __name__ == '__main__':
     unittest.main()
@@ -577,6 +577,37 @@ class TestCrawler(unittest.TestCase):
             result_count += 1
         self.assertEqual(expected_count, result_count)
 
+    def test_crawlPaths(self):
+        """
+        It should crawl only the changed pages, and remove the records of
+        pages that were deleted from the output folder and the file hash
+        index.
+        """
+        source = self.temp + os.sep + "source"
+        output = self.temp + os.sep + "output"
+        shutil.copytree(self.source + os.sep + "update_original", source)
+        crawler = Crawler.Crawler(['html-all'], 'http://www.findandconnect.gov.au', source, output, self.cache,
+                                  "http://www.findandconnect.gov.au/cache", update=True)
+        crawler.run()
+        records = sorted([f for f in os.listdir(output) if f.endswith(".htm")])
+        self.assertEqual(4, len(records))
+        # a changed page and a deleted page
+        changed = source + os.sep + "vic" + os.sep + "biogs" + os.sep + "E000001b.htm"
+        deleted = source + os.sep + "vic" + os.sep + "biogs" + os.sep + "E000003b.htm"
+        with open(changed, 'a') as f:
+            f.write("\n")
+        os.remove(deleted)
+        notified = []
+        crawler.notify = notified.append
+        removed = crawler.crawlPaths([changed, deleted])
+        self.assertEqual(["E000003b.htm"], removed)
+        self.assertEqual(["E000001b.htm"], notified)
+        self.assertEqual([f for f in records if f != "E000003b.htm"],
+                         sorted([f for f in os.listdir(output) if f.endswith(".htm")]))
+        self.assertNotIn("E000003b.htm", Utils.loadFileHashIndex(output))
+        # a file that no page was crawled from
+        self.assertEqual([], crawler.crawlPaths([source + os.sep + "vic" + os.sep + "other.txt"]))
+
     def test_crawl_with_exclude_directories(self):
         """
         It should crawl the input folder for HTML files and skip those
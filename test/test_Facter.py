@@ -4,6 +4,7 @@ LICENSE file, which is part of this source code package.
 """
 
 from Indexer import Facter
+from Indexer import Utils
 
 import inspect
 import os
@@ -11,6 +12,8 @@ import shutil
 import tempfile
 import unittest
 
+from unittest import mock
+
 
 class TestFacter(unittest.TestCase):
     """
@@ -75,6 +78,22 @@ class TestFacter(unittest.TestCase):
             self.assertEqual(postal,cases[case][3])
             self.assertEqual(country,cases[case][4])
 
+    def test__getAddressMapping(self):
+        """
+        It should return the structured address mapping for mappings and for
+        addresses persisted in string form, without executing them.
+        """
+        facter = Facter.Facter([], None, self.temp)
+        mapping = {'city': 'Geelong', 'country': 'Australia', 'country_code': 'au'}
+        cases = [
+            (mapping, mapping),
+            (str(mapping), mapping),
+            ("Geelong VIC 3220, Australia", {'city': 'Geelong', 'state': 'VIC', 'postcode': '3220', 'country': 'Australia'}),
+            ("{'city': __import__('os').getcwd()}", {}),
+        ]
+        for address, expected in cases:
+            self.assertEqual(expected, facter._getAddressMapping(address))
+
     def test__getCalaisResultAsDictionary(self):
         """
         """
@@ -100,11 +119,52 @@ class TestFacter(unittest.TestCase):
         """
         pass
 
+    def test_migrate(self):
+        """
+        It should convert string form location addresses in the inferred data
+        files and the location cache to mappings, and leave other files
+        unchanged.
+        """
+        output = self.temp + os.sep + "infer"
+        cachedir = self.temp + os.sep + "cache"
+        os.mkdir(output)
+        os.mkdir(cachedir)
+        address = {'city': 'Geelong', 'country': 'Australia', 'country_code': 'au'}
+        Utils.writeYaml(output, "E000001.yml", {'locations': [{'address': str(address), 'city': 'Geelong'}]})
+        Utils.writeYaml(output, "E000002.yml", {'locations': [{'address': address}]})
+        Utils.writeYaml(cachedir, ".location_cache.yml", {'Geelong': {'address': str(address), 'lat': '-38.1'}})
+        facter = Facter.Facter([], None, output, cachedir=cachedir)
+        self.assertEqual([".location_cache.yml", "E000001.yml"], sorted(facter.migrate()))
+        self.assertEqual(address, Utils.readYaml(output, "E000001.yml")['locations'][0]['address'])
+        self.assertEqual(address, Utils.readYaml(cachedir, ".location_cache.yml")['Geelong']['address'])
+        # running it again should not change anything
+        facter = Facter.Facter([], None, output, cachedir=cachedir)
+        self.assertEqual([], facter.migrate())
+
     def test_inferLocations(self):
         """
-        It should infer
+        It should infer the coordinates and the parts of the address of each
+        place from the cached geocoder results, including addresses that have
+        no country.
         """
-        pass
+        facter = Facter.Facter([], None, self.temp)
+        facter.locationCache = {
+            "Geelong": {'address': {'city': 'Geelong', 'state': 'Victoria', 'country': 'Australia'},
+                        'lat': '-38.14', 'lon': '144.36'},
+            "Antarctic Ocean": {'address': {'state': 'Southern Ocean'}, 'lat': '-60.0', 'lon': '90.0'},
+        }
+        doc = mock.Mock()
+        doc.getLocations.return_value = [{'placeentry': "Geelong"}, {'placeentry': "Antarctic Ocean"}, {}]
+        # the geocoder is not called for cached places
+        with mock.patch('geopy.geocoders.osm.Nominatim') as geolocator:
+            locations = facter.inferLocations(doc, [], 0.0)
+        self.assertFalse(geolocator.return_value.geocode.called)
+        self.assertEqual(2, len(locations))
+        self.assertEqual([-38.14, 144.36], locations[0]['coordinates'])
+        self.assertEqual(("Geelong", "Victoria", "Australia"),
+                         (locations[0]['city'], locations[0]['region'], locations[0]['country']))
+        self.assertEqual('', locations[1]['country'])
+        self.assertEqual("Southern Ocean", locations[1]['region'])
 
 
 if __name__ == "__main__":
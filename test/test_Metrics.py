@@ -0,0 +1,178 @@
+"""
+This file is subject to the terms and conditions defined in the
+LICENSE file, which is part of this source code package.
+"""
+
+from Indexer import Cleaner
+from Indexer import Metrics
+from Indexer import Timer
+from configparser import ConfigParser
+
+import datetime
+import inspect
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    Executes unit tests against the Metrics module.
+    """
+
+    def setUp(self):
+        """
+        Set up the test environment.
+        """
+        self.module = os.path.abspath(inspect.getfile(self.__class__))
+        self.module_path = os.path.dirname(self.module)
+        self.temp = tempfile.mkdtemp()
+        Metrics.reset()
+
+    def tearDown(self):
+        """
+        Tear down the test environment.
+        """
+        shutil.rmtree(self.temp, ignore_errors=True)
+        Metrics.configure(ConfigParser())
+
+    def test_count(self):
+        """
+        It should add to the counters of each stage, and reject unknown
+        counters.
+        """
+        Metrics.count('clean', 'processed')
+        Metrics.count('clean', 'processed', 2)
+        Metrics.count('clean', 'skipped')
+        Metrics.count('post', 'failed')
+        Metrics.countFile('post', 'bytes_read', self.module)
+        Metrics.countFile('post', 'bytes_read', self.temp + os.sep + "missing.xml")
+        stages = Metrics.getReport()['stages']
+        self.assertEqual(['clean', 'post'], list(stages.keys()))
+        self.assertEqual(3, stages['clean']['processed'])
+        self.assertEqual(1, stages['clean']['skipped'])
+        self.assertEqual(0, stages['clean']['failed'])
+        self.assertEqual(1, stages['post']['failed'])
+        self.assertEqual(os.path.getsize(self.module), stages['post']['bytes_read'])
+        self.assertRaises(AssertionError, Metrics.count, 'clean', 'documents')
+
+    def test_getReport(self):
+        """
+        It should report the throughput of each stage in documents per second
+        of wall clock time.
+        """
+        Metrics.count('transform', 'processed', 50)
+        Metrics.recordTime('transform', 2.0, 1.5)
+        Metrics.recordTime('transform', 0.5)
+        Metrics.recordTime('post', 0.0)
+        report = Metrics.getReport()
+        self.assertEqual(2.5, report['stages']['transform']['wall_seconds'])
+        self.assertEqual(1.5, report['stages']['transform']['cpu_seconds'])
+        self.assertEqual(20.0, report['stages']['transform']['throughput'])
+        self.assertEqual(0.0, report['stages']['post']['throughput'])
+        self.assertTrue(report['started'] <= report['finished'])
+
+    def test_run(self):
+        """
+        It should record the documents and bytes that a stage processes.
+        """
+        source = self.temp + os.sep + "source"
+        output = self.temp + os.sep + "output"
+        shutil.copytree(self.module_path + os.sep + "transform" + os.sep + "clean", source)
+        files = [f for f in os.listdir(source) if not f.startswith('.')]
+        # the stage modules import the same registry as the package
+        self.assertIs(Metrics, Cleaner.Metrics)
+        Cleaner.Cleaner(output, source, True).run()
+        Cleaner.Cleaner(output, source, True).run()
+        stage = Metrics.getReport()['stages']['clean']
+        self.assertEqual(len(files), stage['processed'])
+        self.assertEqual(len(files), stage['skipped'])
+        self.assertEqual(2 * sum([os.path.getsize(source + os.sep + f) for f in files]), stage['bytes_read'])
+        self.assertEqual(sum([os.path.getsize(output + os.sep + f) for f in files]), stage['bytes_written'])
+        self.assertTrue(stage['wall_seconds'] > 0)
+
+    def test_timeDocument(self):
+        """
+        It should only time documents when the slow log is enabled, add the
+        times of the documents of each record, and report the records that
+        took longer than the threshold in any stage, slowest first.
+        """
+        Metrics.timeDocument('clean', "E000001.xml", time.perf_counter() - 5)
+        self.assertEqual({}, Metrics.getDocumentTimes())
+        config = ConfigParser()
+        config.read_string("[metrics]\nslow-log={0}\nslow-threshold=1.0\n".format(self.temp + os.sep + "slow.log"))
+        Metrics.configure(config)
+        now = time.perf_counter()
+        Metrics.count('crawl', 'processed')
+        Metrics.timeDocument('crawl', "E000001.xml", now - 0.5)
+        Metrics.timeDocument('transform', "E000001.xml", now - 0.75)
+        Metrics.timeDocument('transform', "/path/to/E000001.xml", now - 0.75)
+        Metrics.timeDocument('crawl', "E000002.xml", now - 0.5)
+        Metrics.timeDocument('post', "E000003.json", now - 3)
+        slow = Metrics.getSlowDocuments()
+        self.assertEqual(['E000003', 'E000001'], [record_id for record_id, total, stages in slow])
+        self.assertEqual(['crawl', 'transform'], [stage for stage, seconds in slow[1][2]])
+        self.assertAlmostEqual(2.0, slow[1][1], 1)
+        Metrics.write(config)
+        Metrics.write(config)
+        with open(self.temp + os.sep + "slow.log", 'r') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(4, len(lines))
+        self.assertEqual(['E000003', 'post=3.'], [lines[0].split(' ')[1], lines[0].split(' ')[3][:7]])
+
+    def test_writePrometheus(self):
+        """
+        It should write a gauge for each stage metric in the Prometheus text
+        format.
+        """
+        Metrics.count('clean', 'processed', 3)
+        Metrics.count('clean', 'bytes_written', 1024)
+        Metrics.recordTime('clean', 1.5, 0.5)
+        path = self.temp + os.sep + "textfile" + os.sep + "indexer.prom"
+        Metrics.writePrometheus(path)
+        with open(path, 'r') as f:
+            lines = f.read().splitlines()
+        self.assertIn('# TYPE indexer_stage_wall_seconds gauge', lines)
+        self.assertIn('indexer_stage_wall_seconds{stage="clean"} 1.5', lines)
+        self.assertIn('indexer_stage_cpu_seconds{stage="clean"} 0.5', lines)
+        self.assertIn('indexer_stage_documents{stage="clean",status="processed"} 3', lines)
+        self.assertIn('indexer_stage_bytes{stage="clean",direction="written"} 1024', lines)
+        self.assertIn('indexer_stage_throughput{stage="clean"} 2.0', lines)
+        self.assertEqual([], [l for l in lines if l and not l.startswith('#') and len(l.split(' ')) != 2])
+        self.assertEqual(["indexer.prom"], os.listdir(self.temp + os.sep + "textfile"))
+
+    def test_writeReport(self):
+        """
+        It should write the run report as JSON.
+        """
+        Metrics.count('post', 'processed', 10)
+        Metrics.recordTime('post', 5.0)
+        Metrics.writeReport(self.temp + os.sep + "run.json")
+        with open(self.temp + os.sep + "run.json", 'r') as f:
+            report = json.load(f)
+        self.assertEqual(10, report['stages']['post']['processed'])
+        self.assertEqual(2.0, report['stages']['post']['throughput'])
+        self.assertIn('wall_seconds', report)
+
+    def test_Timer(self):
+        """
+        It should count whole days in the hours, and keep the fraction of a
+        second.
+        """
+        with Timer.Timer() as t:
+            pass
+        self.assertTrue(t.elapsed >= 0 and t.cpu >= 0)
+        start = t._wall
+        t._wall = start - datetime.timedelta(days=1, hours=2, minutes=3, seconds=4.5).total_seconds()
+        t.__exit__()
+        self.assertEqual(26, t.hours)
+        self.assertEqual(3, t.minutes)
+        self.assertAlmostEqual(4.5, t.seconds, 1)
+        self.assertTrue(str(t).startswith("26:03:04.5"))
+
+
+if __name__ == "__main__":
+    unittest.main()
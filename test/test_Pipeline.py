@@ -0,0 +1,165 @@
+"""
+This file is subject to the terms and conditions defined in the
+LICENSE file, which is part of this source code package.
+"""
+
+from Indexer import Cfg
+from Indexer import Cleaner
+from Indexer import Crawler
+from Indexer import Pipeline
+from Indexer import Poster
+from Indexer import Transformer
+from Indexer import Utils
+from test.MockSolr import MockSolr
+
+import inspect
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+class TestPipeline(unittest.TestCase):
+    """
+    Executes unit tests against the Pipeline module.
+    """
+
+    def setUp(self):
+        """
+        Set up the test environment.
+        """
+        self.module = os.path.abspath(inspect.getfile(self.__class__))
+        self.module_path = os.path.dirname(self.module)
+        self.temp = tempfile.mkdtemp()
+        self.source = self.temp + os.sep + "source"
+        self.clean = self.temp + os.sep + "clean"
+        self.sid = self.temp + os.sep + "sid"
+        self.xslt = self.module_path + os.sep + "transform" + os.sep + "test.xsl"
+        shutil.copytree(self.module_path + os.sep + "transform" + os.sep + "clean", self.source)
+        self.solr = MockSolr()
+
+    def tearDown(self):
+        """
+        Tear down the test environment.
+        """
+        self.solr.close()
+        shutil.rmtree(self.temp, ignore_errors=True)
+
+    def _getPipeline(self, update=False):
+        """
+        Get a pipeline that cleans, transforms and posts the source documents.
+        """
+        cleaner = Cleaner.Cleaner(self.clean, self.source, update)
+        transformer = Transformer.Transformer([self.clean], self.sid, actions=['eaccpf-to-sid'], transform=self.xslt,
+                                              update=update)
+        poster = Poster.Poster(self.sid, self.solr.url, ['post', 'optimize'], batch_size=1, update=update)
+        return Pipeline.Pipeline(['clean', 'transform', 'post'], cleaner=cleaner, transformer=transformer,
+                                 poster=poster, workers=2, queue_size=2)
+
+    def test__init__(self):
+        """
+        It should only accept consecutive stages.
+        """
+        Pipeline.Pipeline(['crawl', 'clean'])
+        Pipeline.Pipeline(['transform'])
+        self.assertRaises(AssertionError, Pipeline.Pipeline, ['clean', 'post'])
+        self.assertRaises(AssertionError, Pipeline.Pipeline, ['post', 'transform'])
+        self.assertRaises(AssertionError, Pipeline.Pipeline, [])
+
+    def test_run(self):
+        """
+        It should post documents before the transform stage is complete, and
+        write the output folder and file hash index of each stage.
+        """
+        pipeline = self._getPipeline()
+        completed = []
+        complete = pipeline.transformer.complete
+        def record():
+            completed.append(time.time())
+            complete()
+        pipeline.transformer.complete = record
+        posted = []
+        post = pipeline.poster._postBatch
+        def recordPost(Batch, Format):
+            posted.append(time.time())
+            return post(Batch, Format)
+        pipeline.poster._postBatch = recordPost
+        pipeline.run()
+        sources = sorted([f for f in os.listdir(self.source) if not f.startswith('.')])
+        expected = sorted([f for f in sources if f.endswith(".xml")])
+        self.assertEqual(sources, sorted(Utils.loadFileHashIndex(self.clean).keys()))
+        self.assertEqual(expected, sorted([f for f in os.listdir(self.sid) if f.endswith(".xml")]))
+        self.assertEqual(expected, sorted(Utils.readYaml(self.sid, Cfg.MANIFEST_FILENAME).keys()))
+        self.assertEqual(expected, sorted(Utils.readYaml(self.sid, Cfg.POSTED_INDEX_FILENAME).keys()))
+        self.assertEqual(len(expected), len(self.solr.ids))
+        self.assertTrue(posted[0] < completed[0])
+        self.assertTrue(self.solr.requests[-1][1].startswith(b'<optimize'))
+
+    def test_run_update(self):
+        """
+        It should pass unchanged documents through each stage without
+        processing them, and remove the documents whose sources were deleted
+        from each stage and the index.
+        """
+        self._getPipeline().run()
+        self.solr.ids[:] = []
+        self.solr.requests[:] = []
+        self._getPipeline(update=True).run()
+        self.assertEqual([], self.solr.ids)
+        self.assertEqual(9, len([f for f in os.listdir(self.sid) if f.endswith(".xml")]))
+        # a changed document and a deleted document
+        with open(self.source + os.sep + "E000001.xml", 'r') as f:
+            data = f.read()
+        with open(self.source + os.sep + "E000001.xml", 'w') as f:
+            f.write(data.replace("<part>Wesley Mission Melbourne</part>", "<part>Wesley Mission</part>"))
+        os.remove(self.source + os.sep + "E000002.xml")
+        self._getPipeline(update=True).run()
+        self.assertEqual(1, len(self.solr.ids))
+        self.assertFalse(os.path.exists(self.clean + os.sep + "E000002.xml"))
+        self.assertFalse(os.path.exists(self.sid + os.sep + "E000002.xml"))
+        self.assertEqual(1, len([data for path, data in self.solr.requests if data.startswith(b'<delete>')]))
+        self.assertNotIn("E000002.xml", Utils.readYaml(self.sid, Cfg.POSTED_INDEX_FILENAME))
+
+    def test_run_paths(self):
+        """
+        It should crawl and clean only the records produced from the changed
+        files, keep the records of the files that did not change, and remove
+        the records of the files that were deleted.
+        """
+        source = self.temp + os.sep + "site"
+        crawl = self.temp + os.sep + "crawl"
+        shutil.copytree(self.module_path + os.sep + "crawl" + os.sep + "update_original", source)
+        crawler = Crawler.Crawler(['html-all'], 'http://www.findandconnect.gov.au', source, crawl, self.temp + os.sep + "cache",
+                                  "http://www.findandconnect.gov.au/cache", update=True)
+        cleaner = Cleaner.Cleaner(self.clean, crawl, True)
+        pipeline = Pipeline.Pipeline(['crawl', 'clean'], crawler=crawler, cleaner=cleaner, workers=2)
+        self.assertRaises(AssertionError, self._getPipeline(update=True).run, [source])
+        pipeline.run()
+        records = sorted([f for f in os.listdir(self.clean) if not f.startswith('.')])
+        self.assertEqual(4, len(records))
+        # a changed page and a deleted page
+        changed = source + os.sep + "vic" + os.sep + "biogs" + os.sep + "E000001b.htm"
+        deleted = source + os.sep + "vic" + os.sep + "biogs" + os.sep + "E000003b.htm"
+        with open(changed, 'r') as f:
+            data = f.read()
+        with open(changed, 'w') as f:
+            f.write(data.replace("</body>", "<p>Changed</p></body>"))
+        os.remove(deleted)
+        cleaned = []
+        clean = cleaner.cleanFile
+        def recordClean(Filename):
+            cleaned.append(Filename)
+            return clean(Filename)
+        cleaner.cleanFile = recordClean
+        pipeline.run([changed, deleted])
+        self.assertEqual(["E000001b.htm"], cleaned)
+        self.assertEqual([f for f in records if f != "E000003b.htm"],
+                         sorted([f for f in os.listdir(self.clean) if not f.startswith('.')]))
+        self.assertEqual([f for f in records if f != "E000003b.htm"], sorted(Utils.loadFileHashIndex(self.clean).keys()))
+        with open(self.clean + os.sep + "E000001b.htm", 'r') as f:
+            self.assertIn("Changed", f.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
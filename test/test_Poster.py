@@ -3,13 +3,23 @@ This file is subject to the terms and conditions defined in the
 LICENSE file, which is part of this source code package.
 """
 
+from Indexer import Cfg
 from Indexer import Poster
+from Indexer import Transformer
+from Indexer import Utils
 from lxml import etree
+from test.MockSolr import MockSolr
 
+import hashlib
 import inspect
 import os
+import shutil
+import tempfile
+import time
 import unittest
 
+from unittest import mock
+
 
 class TestPoster(unittest.TestCase):
     """
@@ -22,15 +32,29 @@ class TestPoster(unittest.TestCase):
         """
         self.module = os.path.abspath(inspect.getfile(self.__class__))
         self.module_path = os.path.dirname(self.module)
+        self.solr = MockSolr()
         self.source = self.module_path + os.sep + "poster"
+        self.temp = tempfile.mkdtemp()
         self.url = "http://idx.internal:8080/solr/TEST"
 
     def tearDown(self):
         """
         Tear down the test environment.
         """
-        pass
-    
+        self.solr.close()
+        shutil.rmtree(self.temp, ignore_errors=True)
+
+    def _writeDocuments(self, Count, Path=None, Fields=''):
+        """
+        Write a Solr Input Document for each of the specified number of
+        records to the folder. Return the record IDs.
+        """
+        ids = ["E{0:06d}".format(i) for i in range(Count)]
+        for i in ids:
+            with open((Path if Path else self.temp) + os.sep + i + ".xml", 'w') as f:
+                f.write('<add><doc><field name="id">{0}</field>{1}</doc></add>'.format(i, Fields))
+        return ids
+
     def test__init__(self):
         """
         It should create an instance of the Poster class.
@@ -79,6 +103,411 @@ class TestPoster(unittest.TestCase):
         except:
             self.fail("Failed to execute post on {}".format(self.url))
 
+    def test_post_json(self):
+        """
+        It should post JSON documents to the JSON document update handler
+        without parsing them, and post XML documents to the XML update
+        handler.
+        """
+        shutil.copy(self.source + os.sep + "empty_tags_0.xml", self.temp)
+        with open(self.temp + os.sep + "E000001.json", 'wb') as f:
+            f.write(b'{"id":"E000001","title":"Alpha"}\n')
+        posted = {}
+        def post(url, data=None, headers=None, params=None):
+            data = data if isinstance(data, (bytes, str)) else b''.join(data)
+            posted.setdefault(url, []).append((data, headers['Content-type']))
+            return mock.Mock(status_code=200)
+        poster = Poster.Poster(self.temp, self.url, ['post'])
+        with mock.patch.object(poster.session, 'post', side_effect=post):
+            poster.post()
+        data, content_type = posted[self.url + "/update/json/docs"][0]
+        self.assertEqual(b'[{"id":"E000001","title":"Alpha"}]', data)
+        self.assertTrue(content_type.startswith('application/json'))
+        data, content_type = posted[self.url + "/update"][0]
+        self.assertTrue(data.startswith(b'<add>'))
+
+    def test_post_batches(self):
+        """
+        It should post documents in batches limited by document count and
+        size, and bisect rejected batches so that only the documents that
+        caused the failure are reported.
+        """
+        self._writeDocuments(10, Fields='<field name="x"/>')
+        def post(url, data=None, headers=None, params=None):
+            data = data if isinstance(data, (bytes, str)) else b''.join(data)
+            status = 400 if b'E000003' in data or b'E000007' in data else 200
+            return mock.Mock(status_code=status, content=b'')
+        cases = [
+            # batch size, batch bytes, expected number of batches
+            (4, Poster.BATCH_BYTES, 3),
+            (100, Poster.BATCH_BYTES, 1),
+            (100, 100, 5),
+            (100, 10, 10),
+        ]
+        for batch_size, batch_bytes, expected in cases:
+            poster = Poster.Poster(self.temp, self.url, ['post'], batch_size=batch_size, batch_bytes=batch_bytes)
+            documents = poster._readDocuments(self.temp, sorted(os.listdir(self.temp)))
+            batches = list(poster._getBatches(documents))
+            self.assertEqual(expected, len(batches))
+            self.assertEqual(10, sum([len(b) for b in batches]))
+            for batch in batches:
+                for _, data in batch:
+                    self.assertTrue(data.startswith(b'<doc>'))
+                    self.assertNotIn(b'name="x"', data)
+            with mock.patch.object(poster.session, 'post', side_effect=post):
+                posted, failed = [], []
+                for batch in batches:
+                    p, f = poster._postBatch(batch, 'xml')
+                    posted += p
+                    failed += f
+            self.assertEqual(8, len(posted))
+            self.assertEqual(["E000003.xml", "E000007.xml"], [f for f, _ in failed])
+            self.assertTrue(failed[0][1].startswith("HTTP 400"))
+
+    def test_post_concurrency(self):
+        """
+        It should post batches concurrently to a local Solr update handler,
+        with no more requests in flight than the concurrency, and reuse the
+        pooled connections.
+        """
+        self.solr.latency = 0.05
+        self._writeDocuments(40)
+        poster = Poster.Poster(self.temp, self.solr.url, ['post'], batch_size=2, concurrency=4)
+        poster.post()
+        self.assertEqual(20, len(self.solr.updates))
+        self.assertEqual(40, len(self.solr.ids))
+        self.assertTrue(1 < self.solr.max_in_flight <= 4)
+        self.assertTrue(len(self.solr.connections) <= 4)
+
+    def test_post_compress(self):
+        """
+        It should stream batch request bodies in chunks, gzip compress them
+        when compression is enabled, and count the bytes sent.
+        """
+        self._writeDocuments(20, Fields='<field name="abstract">{0}</field>'.format("Lorem ipsum dolor sit amet. " * 200))
+        for compress in [False, True]:
+            self.solr.ids[:] = []
+            self.solr.encodings[:] = []
+            self.solr.bytes = 0
+            poster = Poster.Poster(self.temp, self.solr.url, ['post'], batch_size=10, compress=compress)
+            poster.post()
+            self.assertEqual(20, len(self.solr.ids))
+            self.assertEqual(["gzip" if compress else None] * 2, self.solr.encodings[:2])
+            self.assertEqual(self.solr.bytes - len(b'<commit/>'), poster.bytes_sent)
+            if compress:
+                self.assertTrue(poster.bytes_sent < poster.bytes_raw / 10)
+            else:
+                self.assertEqual(poster.bytes_raw, poster.bytes_sent)
+
+    def test_post_commit_policy(self):
+        """
+        It should commit according to the commit policy, and end the post
+        with a hard commit.
+        """
+        self._writeDocuments(10)
+        cases = [
+            # policy, expected soft commits, expected add element
+            ('hard', 0, b'<add>'),
+            ('soft', 2, b'<add>'),
+            ('within', 0, b'<add commitWithin="5000">'),
+        ]
+        for policy, soft_commits, add in cases:
+            self.solr.requests[:] = []
+            self.solr.updates[:] = []
+            poster = Poster.Poster(self.temp, self.solr.url, ['post'], batch_size=2, commit_policy=policy,
+                                   commit_interval=4, commit_within=5000)
+            poster.post()
+            commits = [data for path, data in self.solr.requests if data.startswith(b'<commit')]
+            self.assertEqual(soft_commits, commits.count(b'<commit softCommit="true"/>'))
+            self.assertEqual(b'<commit/>', commits[-1])
+            self.assertEqual(b'<commit/>', self.solr.requests[-1][1])
+            self.assertEqual(5, len([u for u in self.solr.updates if u.startswith(add + b'<doc>')]))
+
+    def _runPost(self, Update):
+        """
+        Post the documents in the temporary folder to the mock Solr server.
+        Return the IDs posted, the delete requests and the number of commits.
+        """
+        self.solr.requests[:] = []
+        self.solr.ids[:] = []
+        Poster.Poster(self.temp, self.solr.url, ['post'], update=Update).run()
+        deletes = [data for path, data in self.solr.requests if data.startswith(b'<delete>')]
+        commits = [data for path, data in self.solr.requests if data.startswith(b'<commit')]
+        return sorted(self.solr.ids), deletes, len(commits)
+
+    def test_post_update(self):
+        """
+        It should post only new and changed documents when updating, and
+        delete the documents whose files were removed by ID on every post.
+        """
+        self._writeDocuments(4)
+        self.assertEqual(([b"E000000", b"E000001", b"E000002", b"E000003"], [], 1), self._runPost(True))
+        self.assertIn("E000002.xml", Utils.readYaml(self.temp, Cfg.POSTED_INDEX_FILENAME))
+        # nothing has changed
+        self.assertEqual(([], [], 0), self._runPost(True))
+        # a changed document and a removed document
+        with open(self.temp + os.sep + "E000001.xml", 'w') as f:
+            f.write('<add><doc><field name="id">E000001</field><field name="title">Changed</field></doc></add>')
+        os.remove(self.temp + os.sep + "E000002.xml")
+        self.assertEqual(([b"E000001"], [b'<delete><id>E000002</id></delete>'], 1), self._runPost(True))
+        self.assertNotIn("E000002.xml", Utils.readYaml(self.temp, Cfg.POSTED_INDEX_FILENAME))
+        # a document ID that moved to a new file is not deleted
+        os.rename(self.temp + os.sep + "E000003.xml", self.temp + os.sep + "X000003.xml")
+        self.assertEqual(([b"E000003"], [], 1), self._runPost(True))
+        self.assertNotIn("E000003.xml", Utils.readYaml(self.temp, Cfg.POSTED_INDEX_FILENAME))
+        # without the update flag, every document is posted
+        self.assertEqual(([b"E000000", b"E000001", b"E000003"], [], 1), self._runPost(False))
+        # and the documents whose files were removed are still deleted
+        os.remove(self.temp + os.sep + "E000000.xml")
+        self.assertEqual(([b"E000001", b"E000003"], [b'<delete><id>E000000</id></delete>'], 1), self._runPost(False))
+        self.assertNotIn(b"E000000", self.solr.cores['TEST'])
+        self.assertNotIn("E000000.xml", Utils.readYaml(self.temp, Cfg.POSTED_INDEX_FILENAME))
+        # a removed file stays in the index until its documents are deleted
+        os.remove(self.temp + os.sep + "E000001.xml")
+        self.solr.errors = [400]
+        self._runPost(True)
+        self.assertIn(b"E000001", self.solr.cores['TEST'])
+        self.assertIn("E000001.xml", Utils.readYaml(self.temp, Cfg.POSTED_INDEX_FILENAME))
+        self.assertEqual(([], [b'<delete><id>E000001</id></delete>'], 1), self._runPost(True))
+        self.assertNotIn(b"E000001", self.solr.cores['TEST'])
+
+    def test_post_after_clear(self):
+        """
+        It should delete the documents of removed records when the Transformer
+        clears its output folder before the post.
+        """
+        clean = self.temp + os.sep + "clean"
+        output = self.temp + os.sep + "output"
+        shutil.copytree(self.module_path + os.sep + "transform" + os.sep + "clean", clean)
+        xslt = self.module_path + os.sep + "transform" + os.sep + "test.xsl"
+        def run():
+            Transformer.Transformer([clean], output, actions=['clear', 'eaccpf-to-sid'], transform=xslt).run()
+            self.solr.requests[:] = []
+            Poster.Poster(output, self.solr.url, ['post']).run()
+            return [data for path, data in self.solr.requests if data.startswith(b'<delete>')]
+        self.assertEqual([], run())
+        self.assertIn(b"E000004", self.solr.cores['TEST'])
+        os.remove(clean + os.sep + "E000004.xml")
+        self.assertEqual([b'<delete><id>E000004</id></delete>'], run())
+        self.assertNotIn(b"E000004", self.solr.cores['TEST'])
+
+    def test_post_shards(self):
+        """
+        It should post and delete only the documents of the records in the
+        shard, and write a shard index of posted documents that merges into
+        the index of posted documents. It should not flush or reindex the
+        core from a shard.
+        """
+        ids = self._writeDocuments(10)
+        shards = [(1, 2), (2, 2)]
+        for shard in shards:
+            self.solr.ids[:] = []
+            Poster.Poster(self.temp, self.solr.url, ['post'], update=True, shard=shard).run()
+            expected = [i.encode('utf-8') for i in ids if Utils.inShard(i + ".xml", shard)]
+            self.assertEqual(expected, sorted(self.solr.ids))
+        self.assertEqual(set(ids), set([i.decode('utf-8') for i in self.solr.cores['TEST']]))
+        self.assertFalse(os.path.exists(self.temp + os.sep + Cfg.POSTED_INDEX_FILENAME))
+        # a removed document is deleted by the shard that posted it
+        os.remove(self.temp + os.sep + ids[0] + ".xml")
+        for shard in shards:
+            Poster.Poster(self.temp, self.solr.url, ['post'], update=True, shard=shard).run()
+        self.assertNotIn(ids[0].encode('utf-8'), self.solr.cores['TEST'])
+        self.assertEqual(len(ids) - 1, len(self.solr.cores['TEST']))
+        Poster.Poster(self.temp, self.solr.url, []).merge()
+        posted = Utils.readYaml(self.temp, Cfg.POSTED_INDEX_FILENAME)
+        self.assertEqual(sorted([i + ".xml" for i in ids[1:]]), sorted(posted.keys()))
+        self.assertEqual([], Utils.getShardFilenames(self.temp, Cfg.POSTED_INDEX_FILENAME))
+        for actions in [['flush', 'post'], ['reindex']]:
+            self.assertRaises(AssertionError, Poster.Poster, self.temp, self.solr.url, actions, shard=(1, 2))
+
+    def test_reindex(self):
+        """
+        It should post all documents to the staging core, then swap it with
+        the live core once its document count matches the source folder. It
+        should not swap a staging core that is missing documents.
+        """
+        self._writeDocuments(5)
+        self.solr.cores['TEST'] = set([b"OLD"])
+        poster = Poster.Poster(self.temp, self.solr.url, ['reindex'], staging="TEST-staging", update=True)
+        poster.run()
+        self.assertEqual(set([b"E000000", b"E000001", b"E000002", b"E000003", b"E000004"]), self.solr.cores['TEST'])
+        self.assertEqual(set([b"OLD"]), self.solr.cores['TEST-staging'])
+        self.assertEqual(5, len(Utils.readYaml(self.temp, Cfg.POSTED_INDEX_FILENAME)))
+        # the staging core is flushed before the next reindex
+        os.remove(self.temp + os.sep + "E000004.xml")
+        poster.run()
+        self.assertEqual(4, len(self.solr.cores['TEST']))
+        self.assertEqual(5, len(self.solr.cores['TEST-staging']))
+        # a document that could not be posted fails verification
+        with open(self.temp + os.sep + "E000001.xml", 'w') as f:
+            f.write('<add><doc><field name="id">E000001</field><field name="title">Changed</field></doc></add>')
+        live = set(self.solr.cores['TEST'])
+        posted = Utils.readYaml(self.temp, Cfg.POSTED_INDEX_FILENAME)
+        self.solr.errors = [200, 200, 400, 400, 400]
+        self.assertRaises(Exception, poster.run)
+        self.assertEqual(live, self.solr.cores['TEST'])
+        self.assertEqual(posted, Utils.readYaml(self.temp, Cfg.POSTED_INDEX_FILENAME))
+
+    def test_reindex_alias(self):
+        """
+        It should alternate between the staging collections, and point the
+        live collection alias at the collection that was reindexed.
+        """
+        self._writeDocuments(3)
+        self.solr.aliases['TEST'] = "TEST_a"
+        poster = Poster.Poster(self.temp, self.solr.url, ['reindex'], staging="TEST_a,TEST_b", swap='alias')
+        poster.run()
+        self.assertEqual("TEST_b", self.solr.aliases['TEST'])
+        self.assertEqual(3, len(self.solr.cores['TEST_b']))
+        poster.run()
+        self.assertEqual("TEST_a", self.solr.aliases['TEST'])
+        self.assertEqual(3, len(self.solr.cores['TEST_a']))
+
+    def test_post_manifest(self):
+        """
+        It should post documents that are recorded in the Transformer manifest
+        as they are, and parse documents that are not recorded or that have
+        changed since they were recorded.
+        """
+        manifest = {}
+        for i in range(3):
+            data = '<?xml version=\'1.0\' encoding=\'UTF-8\'?>\n<add>\n  <doc>\n    <field name="id">E{0:06d}</field>\n  </doc>\n</add>\n'.format(i).encode('utf-8')
+            with open(self.temp + os.sep + "E{0:06d}.xml".format(i), 'wb') as f:
+                f.write(data)
+            manifest["E{0:06d}.xml".format(i)] = {'hash': hashlib.sha1(data).hexdigest(), 'ids': ["E{0:06d}".format(i)]}
+        Utils.writeYaml(self.temp, Cfg.MANIFEST_FILENAME, manifest)
+        with open(self.temp + os.sep + "E000002.xml", 'w') as f:
+            f.write('<add><doc><field name="id">E000002</field><field name="x"/></doc></add>')
+        with open(self.temp + os.sep + "E000003.xml", 'w') as f:
+            f.write('<add><doc><field name="id">E000003</field><field name="x"/></doc></add>')
+        poster = Poster.Poster(self.temp, self.url, ['post'])
+        poster.manifest = Utils.readYaml(self.temp, Cfg.MANIFEST_FILENAME)
+        filenames = sorted([f for f in os.listdir(self.temp) if f.endswith(".xml")])
+        with mock.patch.object(poster, 'strip_empty_elements', wraps=poster.strip_empty_elements) as strip:
+            documents = list(poster._readDocuments(self.temp, filenames))
+        self.assertEqual(2, strip.call_count)
+        for filename, data in documents:
+            self.assertTrue(data.startswith(b'<doc>'))
+            self.assertTrue(data.endswith(b'</doc>'))
+            self.assertNotIn(b'name="x"', data)
+        self.assertEqual(["E000000", "E000001", "E000002", "E000003"], [poster.read[f][1][0] for f in filenames])
+
+    def test_post_retry(self):
+        """
+        It should retry requests that fail because Solr is unavailable, write
+        documents that still could not be posted to the dead letter folder,
+        then resend them from the dead letter folder.
+        """
+        source = self.temp + os.sep + "post"
+        dead_letter = self.temp + os.sep + "dead-letter"
+        os.mkdir(source)
+        self._writeDocuments(6, source)
+        # transient errors are retried
+        self.solr.errors = [503, 502]
+        poster = Poster.Poster(source, self.solr.url, ['post'], batch_size=3, dead_letter=dead_letter, retries=2,
+                               backoff=0.001)
+        poster.post()
+        self.assertEqual(6, len(self.solr.ids))
+        self.assertEqual({}, Utils.tryReadYaml(dead_letter, Poster.DEAD_LETTER_REPORT_FILENAME))
+        # the first batch fails on every attempt and is dead lettered
+        self.solr.ids[:] = []
+        self.solr.errors = [503, 503, 503]
+        poster = Poster.Poster(source, self.solr.url, ['post'], batch_size=3, dead_letter=dead_letter, retries=2,
+                               backoff=0.001)
+        poster.post()
+        self.assertEqual(3, len(self.solr.ids))
+        report = Utils.tryReadYaml(dead_letter, Poster.DEAD_LETTER_REPORT_FILENAME)
+        self.assertEqual(["E000000.xml", "E000001.xml", "E000002.xml"], sorted(report.keys()))
+        self.assertEqual("HTTP 503", report["E000000.xml"])
+        self.assertEqual(sorted(report.keys()), sorted([f for f in os.listdir(dead_letter) if f.endswith(".xml")]))
+        # resend the dead lettered documents only
+        self.solr.ids[:] = []
+        poster = Poster.Poster(source, self.solr.url, ['retry'], dead_letter=dead_letter)
+        poster.run()
+        self.assertEqual([b"E000000", b"E000001", b"E000002"], sorted(self.solr.ids))
+        self.assertEqual({}, Utils.tryReadYaml(dead_letter, Poster.DEAD_LETTER_REPORT_FILENAME))
+        self.assertEqual([], [f for f in os.listdir(dead_letter) if f.endswith(".xml")])
+
+    def test_post_interrupted(self):
+        """
+        It should record the documents that were posted and write the
+        documents that failed to the dead letter folder when Solr becomes
+        unavailable during the post, and when one half of a bisected batch
+        could not be sent.
+        """
+        dead_letter = self.temp + os.sep + "dead-letter"
+        source = self.temp + os.sep + "post"
+        os.mkdir(source)
+        self._writeDocuments(6, source)
+        # the circuit breaker opens after the first batch, so the commit fails
+        self.solr.errors = [200, 503]
+        poster = Poster.Poster(source, self.solr.url, ['post'], batch_size=3, concurrency=1, retries=0,
+                               breaker_threshold=1, dead_letter=dead_letter)
+        poster.post()
+        posted = Utils.readYaml(source, Cfg.POSTED_INDEX_FILENAME)
+        self.assertEqual(["E000000.xml", "E000001.xml", "E000002.xml"], sorted(posted.keys()))
+        report = Utils.tryReadYaml(dead_letter, Poster.DEAD_LETTER_REPORT_FILENAME)
+        self.assertEqual(["E000003.xml", "E000004.xml", "E000005.xml"], sorted(report.keys()))
+        # the batch is rejected, then the second half could not be sent
+        shutil.rmtree(dead_letter)
+        os.remove(source + os.sep + Cfg.POSTED_INDEX_FILENAME)
+        self.solr.ids[:] = []
+        self.solr.errors = [400, 200, 503]
+        poster = Poster.Poster(source, self.solr.url, ['post'], batch_size=4, concurrency=1, retries=0,
+                               dead_letter=dead_letter)
+        poster.post()
+        posted = Utils.readYaml(source, Cfg.POSTED_INDEX_FILENAME)
+        report = Utils.tryReadYaml(dead_letter, Poster.DEAD_LETTER_REPORT_FILENAME)
+        self.assertEqual(["E000000.xml", "E000001.xml", "E000004.xml", "E000005.xml"], sorted(posted.keys()))
+        self.assertEqual(["E000002.xml", "E000003.xml"], sorted(report.keys()))
+        self.assertEqual("HTTP 503", report["E000002.xml"])
+        self.assertEqual([b"E000000", b"E000001", b"E000004", b"E000005"], sorted(self.solr.ids))
+
+    def test__getBackoff(self):
+        """
+        It should return a random delay up to an exponentially increasing
+        limit.
+        """
+        poster = Poster.Poster(self.source, self.url, ['post'], backoff=1.0, max_backoff=10.0)
+        for attempt, limit in [(0, 1.0), (1, 2.0), (2, 4.0), (3, 8.0), (4, 10.0), (10, 10.0)]:
+            delays = [poster._getBackoff(attempt) for _ in range(20)]
+            self.assertTrue(all([0 <= d <= limit for d in delays]))
+            self.assertTrue(len(set(delays)) > 1)
+
+    def test__recordFailure(self):
+        """
+        It should open the circuit breaker after the threshold number of
+        consecutive failures, then allow a trial request after the reset
+        period.
+        """
+        poster = Poster.Poster(self.source, self.url, ['post'], breaker_threshold=3, breaker_reset=0.1)
+        poster._recordFailure()
+        poster._recordFailure()
+        self.assertTrue(poster._isCircuitClosed())
+        poster._recordFailure()
+        self.assertFalse(poster._isCircuitClosed())
+        self.assertRaises(Exception, poster._request, self.url, b'<commit/>', poster.headers)
+        time.sleep(0.1)
+        self.assertTrue(poster._isCircuitClosed())
+
+    def test_recordLatency(self):
+        """
+        It should halve the number of requests in flight while Solr responds
+        slower than the target latency, and increase it again as Solr
+        recovers.
+        """
+        poster = Poster.Poster(self.source, self.url, ['post'], concurrency=8, target_latency=1.0)
+        self.assertEqual(8, poster.limit)
+        poster._recordLatency(3.0)
+        self.assertEqual(4, poster.limit)
+        poster._recordLatency(3.0)
+        poster._recordLatency(3.0)
+        poster._recordLatency(3.0)
+        self.assertEqual(1, poster.limit)
+        for _ in range(40):
+            poster._recordLatency(0.1)
+        self.assertEqual(8, poster.limit)
+
     def test_strip_empty_elements(self):
         """
         It should remove any elements that have no content.
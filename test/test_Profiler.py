@@ -0,0 +1,100 @@
+"""
+This file is subject to the terms and conditions defined in the
+LICENSE file, which is part of this source code package.
+"""
+
+from Indexer import Profiler
+
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+import tracemalloc
+import unittest
+
+
+def _parse(Count):
+    """
+    Do some work to be profiled.
+    """
+    return [str(i).zfill(8) for i in range(Count)]
+
+
+class TestProfiler(unittest.TestCase):
+    """
+    Executes unit tests against the Profiler module.
+    """
+
+    def setUp(self):
+        """
+        Set up the test environment.
+        """
+        self.temp = tempfile.mkdtemp()
+        self.output = self.temp + os.sep + "profile"
+
+    def tearDown(self):
+        """
+        Tear down the test environment.
+        """
+        Profiler.configure(None)
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        shutil.rmtree(self.temp, ignore_errors=True)
+
+    def _getFunctions(self, Stage):
+        """
+        Get the names of the functions in the stage profile.
+        """
+        stats = pstats.Stats(self.output + os.sep + Stage + ".prof")
+        return [name for _, _, name in stats.stats]
+
+    def test_profile(self):
+        """
+        It should not profile when no mode is configured.
+        """
+        with Profiler.profile('clean'):
+            _parse(10)
+        self.assertFalse(os.path.exists(self.output))
+
+    def test_profile_cprofile(self):
+        """
+        It should write a profile of each stage that includes the calls of
+        every thread that worked on the stage, and profile nested contexts
+        as part of the outer stage.
+        """
+        Profiler.configure('cprofile', self.output)
+        def work():
+            with Profiler.profile('transform'):
+                _parse(1000)
+        threads = [threading.Thread(target=work) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with Profiler.profile('clean'):
+            with Profiler.profile('nested'):
+                sorted(_parse(10))
+        self.assertEqual(['clean.prof', 'transform.prof'], sorted(os.listdir(self.output)))
+        self.assertIn('_parse', self._getFunctions('transform'))
+        self.assertIn('_parse', self._getFunctions('clean'))
+        stats = pstats.Stats(self.output + os.sep + "transform.prof")
+        calls = [stats.stats[f][1] for f in stats.stats if f[2] == '_parse']
+        self.assertEqual([3], calls)
+
+    def test_profile_tracemalloc(self):
+        """
+        It should write a snapshot of the memory allocated at the end of each
+        stage.
+        """
+        Profiler.configure('tracemalloc', self.output)
+        self.assertTrue(tracemalloc.is_tracing())
+        with Profiler.profile('transform'):
+            data = _parse(10000)
+        snapshot = tracemalloc.Snapshot.load(self.output + os.sep + "transform.snapshot")
+        self.assertTrue(sum([s.size for s in snapshot.statistics('filename')]) > 0)
+        self.assertEqual(10000, len(data))
+
+
+if __name__ == "__main__":
+    unittest.main()
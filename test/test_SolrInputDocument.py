@@ -0,0 +1,122 @@
+"""
+This file is subject to the terms and conditions defined in the
+LICENSE file, which is part of this source code package.
+"""
+
+from Indexer import SolrInputDocument
+from lxml import etree
+
+import json
+import unittest
+
+
+SID = b"""<?xml version='1.0' encoding='UTF-8'?>
+<add>
+  <doc>
+    <field name="id">E000001</field>
+    <field name="title">Alpha</field>
+    <field name="function">One</field>
+    <field name="function">Two</field>
+  </doc>
+</add>
+"""
+
+
+class TestSolrInputDocument(unittest.TestCase):
+    """
+    Executes unit tests against the Solr Input Document module.
+    """
+
+    def setUp(self):
+        """
+        Set test environment.
+        """
+        parser = etree.XMLParser(remove_blank_text=True)
+        self.sid = SolrInputDocument.SolrInputDocument(etree.fromstring(SID, parser))
+
+    def test__init__(self):
+        """
+        It should index the document fields by name.
+        """
+        self.assertEqual(['function', 'id', 'title'], sorted(self.sid.fields.keys()))
+        self.assertEqual(2, len(self.sid.get('function')))
+        self.assertEqual([], self.sid.get('missing'))
+
+    def test_append(self):
+        """
+        It should append a new field and add it to the index.
+        """
+        self.sid.append('function', 'Three')
+        self.sid.append('region', 'VIC')
+        self.assertEqual(['One', 'Two', 'Three'], [f.text for f in self.sid.get('function')])
+        self.assertEqual('VIC', self.sid.getValue('region'))
+        self.assertEqual(6, len(self.sid.doc.findall('field')))
+
+    def test_boost(self):
+        """
+        It should set the boost value on all fields with the specified name,
+        and ignore fields that do not exist.
+        """
+        self.sid.boost('function', '10')
+        self.sid.boost('missing', '10')
+        self.assertEqual(['10', '10'], [f.get('boost') for f in self.sid.doc.findall('field[@name="function"]')])
+        self.assertEqual(None, self.sid.doc.find('field[@name="title"]').get('boost'))
+        self.assertFalse(self.sid.has('missing'))
+
+    def test_reindex(self):
+        """
+        It should find fields that were added to the tree directly after the
+        index is rebuilt.
+        """
+        etree.SubElement(self.sid.doc, 'field', name='region').text = 'VIC'
+        self.assertFalse(self.sid.has('region'))
+        self.sid.reindex()
+        self.assertEqual('VIC', self.sid.getValue('region'))
+
+    def test_set(self):
+        """
+        It should change the value of existing fields, or append the field if
+        it does not exist.
+        """
+        self.sid.set('function', 'Other')
+        self.sid.set('region', 'VIC')
+        self.assertEqual(['Other', 'Other'], [f.text for f in self.sid.doc.findall('field[@name="function"]')])
+        self.assertEqual('VIC', self.sid.doc.find('field[@name="region"]').text)
+
+    def test_strip(self):
+        """
+        It should remove the fields that have no value from the document and
+        the index.
+        """
+        self.sid.append('empty')
+        self.sid.append('function')
+        self.sid.strip()
+        self.assertFalse(self.sid.has('empty'))
+        self.assertEqual(['One', 'Two'], [f.text for f in self.sid.get('function')])
+        self.assertEqual(4, len(self.sid.doc.findall('field')))
+
+    def test_tojson(self):
+        """
+        It should serialize the document to a single line of compact JSON,
+        with multiple values in arrays and without empty fields.
+        """
+        self.sid.append('empty')
+        self.sid.boost('title', '10')
+        data = self.sid.tojson()
+        self.assertTrue(data.endswith(b'\n'))
+        self.assertEqual(1, data.count(b'\n'))
+        self.assertEqual({'id': 'E000001', 'title': 'Alpha', 'function': ['One', 'Two']}, json.loads(data.decode('utf-8')))
+
+    def test_tostring(self):
+        """
+        It should serialize the document to UTF-8 encoded XML.
+        """
+        self.sid.set('title', 'Ålpha')
+        data = self.sid.tostring()
+        self.assertTrue(data.startswith(b"<?xml version='1.0' encoding='UTF-8'?>"))
+        xml = etree.fromstring(data)
+        self.assertEqual('Ålpha', xml.find('doc/field[@name="title"]').text)
+
+
+if __name__ == "__main__":
+    unittest.main()
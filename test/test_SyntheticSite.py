@@ -0,0 +1,102 @@
+"""
+This file is subject to the terms and conditions defined in the
+LICENSE file, which is part of this source code package.
+"""
+
+from Indexer import HtmlPage
+from Indexer import Utils
+from lxml import etree
+from test import SyntheticSite
+from test import benchmark_Stages
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestSyntheticSite(unittest.TestCase):
+    """
+    Executes unit tests against the synthetic site generator.
+    """
+
+    def setUp(self):
+        """
+        Set up the test environment.
+        """
+        self.temp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        Tear down the test environment.
+        """
+        shutil.rmtree(self.temp, ignore_errors=True)
+
+    def _getHashes(self, Path):
+        """
+        Get a hash of each generated document in the site.
+        """
+        hashes = {}
+        for path, _, filenames in os.walk(Path):
+            for filename in [f for f in filenames if f != SyntheticSite.MANIFEST]:
+                with open(path + os.sep + filename, 'rb') as f:
+                    hashes[os.path.relpath(path + os.sep + filename, Path)] = hashlib.sha1(f.read()).hexdigest()
+        return hashes
+
+    def test_crawl_site(self):
+        """
+        It should write a site that the crawler indexes without failures,
+        with a document for each entity and each digital object.
+        """
+        site = self.temp + os.sep + "site"
+        manifest = SyntheticSite.make_site(site, 20)
+        result = benchmark_Stages.run_stage('crawl', site, self.temp + os.sep + "work", manifest, 1)
+        self.assertNotIn('error', result)
+        self.assertTrue(result['documents'] > 0)
+        self.assertEqual(manifest['entities'] + manifest['digital_objects'], result['documents'])
+        crawled = os.listdir(self.temp + os.sep + "work" + os.sep + "crawl")
+        self.assertEqual(20, len([f for f in crawled if f.endswith(".xml")]))
+
+    def test_make_site(self):
+        """
+        It should write an HTML page and a valid EAC-CPF document for each
+        entity, and an HTML page and an image for each digital object, that
+        are linked to each other by their public URLs.
+        """
+        site = self.temp + os.sep + "site"
+        manifest = SyntheticSite.make_site(site, 50)
+        base = manifest['base']
+        pages = sorted(os.listdir(site + os.sep + "biogs"))
+        objects = sorted([f for f in os.listdir(site + os.sep + "objects") if f.endswith(".htm")])
+        self.assertEqual(50, len(pages))
+        self.assertEqual(50, len(os.listdir(site + os.sep + "eac")))
+        self.assertEqual(manifest['digital_objects'], len(objects))
+        self.assertTrue(manifest['digital_objects'] > 0)
+        schema = Utils.loadSchema(Utils.EACCPF_SCHEMA)
+        for filename in pages:
+            html = HtmlPage.HtmlPage(site + os.sep + "biogs", filename, base + "biogs/")
+            eaccpf = site + os.sep + html.getEacCpfUrl().replace(base, '')
+            self.assertTrue(schema.validate(etree.parse(eaccpf)), eaccpf)
+        for filename in objects:
+            html = HtmlPage.HtmlPage(site + os.sep + "objects", filename, base + "objects/")
+            self.assertTrue(os.path.exists(site + os.sep + html.getDigitalObjectUrl().replace(base, '')))
+
+    def test_make_site_seed(self):
+        """
+        It should write the same site for the same seed, a different site for
+        a different seed, and keep a site that was already written.
+        """
+        SyntheticSite.make_site(self.temp + os.sep + "a", 20, 7)
+        SyntheticSite.make_site(self.temp + os.sep + "b", 20, 7)
+        SyntheticSite.make_site(self.temp + os.sep + "c", 20, 8)
+        a = self._getHashes(self.temp + os.sep + "a")
+        self.assertEqual(a, self._getHashes(self.temp + os.sep + "b"))
+        self.assertNotEqual(a, self._getHashes(self.temp + os.sep + "c"))
+        os.remove(self.temp + os.sep + "a" + os.sep + "eac" + os.sep + "E000000.xml")
+        SyntheticSite.make_site(self.temp + os.sep + "a", 20, 7)
+        self.assertFalse(os.path.exists(self.temp + os.sep + "a" + os.sep + "eac" + os.sep + "E000000.xml"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,18 +3,28 @@ This file is subject to the terms and conditions defined in the
 LICENSE file, which is part of this source code package.
 """
 
+from Indexer import Cfg
+from Indexer import SolrInputDocument
 from Indexer import Transformer
+from Indexer import Utils
 from lxml import etree
 
+import hashlib
 import inspect
+import json
 import os
+import pickle
 import random
 import re
 import shutil
 import string
 import tempfile
+import threading
+import time
 import unittest
 
+from unittest import mock
+
 
 class TestTransformer(unittest.TestCase):
     """
@@ -27,6 +37,18 @@ class TestTransformer(unittest.TestCase):
         """
         return ''.join(random.choice(chars) for _ in range(size))
 
+    def _getWritten(self, Path):
+        """
+        Get the names of the documents in the folder that were written since
+        the last call, and mark them as unchanged for the next call.
+        """
+        written = []
+        for filename in [f for f in os.listdir(Path) if not f.startswith('.')]:
+            if os.stat(Path + os.sep + filename).st_mtime != 0:
+                written.append(filename)
+                os.utime(Path + os.sep + filename, (0, 0))
+        return sorted(written)
+
     def setUp(self):
         """
         Set test environment.
@@ -62,9 +84,184 @@ class TestTransformer(unittest.TestCase):
 
     def test_mergeInferredRecordToSID(self):
         """
-        Merge inferred data into Solr Input Document record.
+        Merge inferred data into Solr Input Document record. Structured
+        addresses are read directly and string form addresses are never
+        executed.
         """
-        pass
+        address = {'city': 'Geelong', 'country': 'Australia', 'country_code': 'au', 'county': 'Barwon'}
+        location = {'city': 'Geelong', 'coordinates': [-38.1, 144.3], 'country': 'Australia', 'region': 'VIC'}
+        cases = [
+            (address, {'in_us': 'false', 'county': 'Barwon', 'countyregioncountry': 'Barwon, VIC, Australia',
+                       'cityregioncountry': 'Geelong, VIC, Australia', 'regioncountry': 'VIC, Australia'}),
+            ("{'country_code': __import__('os').getcwd()}", {'in_us': None, 'county': None,
+                                                            'cityregioncountry': 'Geelong, VIC, Australia'}),
+        ]
+        t = Transformer.Transformer(self.temp, self.temp)
+        for addr, expected in cases:
+            sid = SolrInputDocument.SolrInputDocument(etree.fromstring("<add><doc/></add>"))
+            inferred = {'locations': [dict(location, address=addr)]}
+            self.assertTrue(t._mergeInferredRecord(inferred, sid))
+            for name, value in expected.items():
+                self.assertEqual(value, sid.getValue(name))
+            self.assertEqual('-38.1,144.3', sid.getValue('location'))
+
+    def test_run(self):
+        """
+        It should transform, merge, set fields and boost each document in
+        memory, then write each Solr Input Document once.
+        """
+        sources = [self.source + os.sep + "clean", self.source + os.sep + "infer"]
+        actions = ['eaccpf-to-sid', 'merge-digitalobjects', 'merge-inferred', 'set-fields', 'boost']
+        t = Transformer.Transformer(sources, self.temp, actions=actions, boosts=['title:1000'],
+                                    set_fields=['region:VIC'], transform=self.source + os.sep + "test.xsl")
+        with mock.patch.object(t, '_writeSID', wraps=t._writeSID) as write:
+            t.run()
+        expected = sorted([f for f in os.listdir(sources[0]) if f.endswith(".xml")])
+        self.assertEqual(expected, sorted([f for f in os.listdir(self.temp) if f.endswith(".xml")]))
+        # each document was written exactly once
+        self.assertEqual(len(expected), write.call_count)
+        self.assertEqual(expected, sorted([c[0][1] for c in write.call_args_list]))
+        self.assertEqual(expected, sorted(Utils.readYaml(self.temp, Cfg.MANIFEST_FILENAME)))
+        for stage in ['boost', 'merge-digitalobjects', 'set-fields', 'write', 'xslt']:
+            self.assertIn(stage, t.timings)
+        # every action was applied before the document was written
+        for filename in expected:
+            doc = etree.parse(self.temp + os.sep + filename).getroot().getchildren()[0]
+            self.assertEqual("1000", doc.find('field[@name="title"]').attrib['boost'])
+            self.assertEqual("VIC", doc.find('field[@name="region"]').text)
+        xml = etree.parse(self.temp + os.sep + "E000002.xml")
+        doc = xml.getroot().getchildren()[0]
+        self.assertEqual("image", doc.find('field[@name="dobj_type"]').text)
+
+    def test_run_json(self):
+        """
+        It should write each Solr Input Document as a single line of JSON
+        when the JSON output format is selected.
+        """
+        sources = [self.source + os.sep + "clean"]
+        actions = ['eaccpf-to-sid', 'merge-digitalobjects', 'set-fields']
+        t = Transformer.Transformer(sources, self.temp, actions=actions, set_fields=['region:VIC'],
+                                    transform=self.source + os.sep + "test.xsl", output_format='json')
+        t.run()
+        expected = sorted([f.replace(".xml", ".json") for f in os.listdir(sources[0]) if f.endswith(".xml")])
+        self.assertEqual(expected, sorted([f for f in os.listdir(self.temp) if not f.startswith('.')]))
+        with open(self.temp + os.sep + "E000002.json", 'rb') as f:
+            lines = f.readlines()
+        self.assertEqual(1, len(lines))
+        doc = json.loads(lines[0].decode('utf-8'))
+        self.assertEqual("VIC", doc['region'])
+        self.assertEqual("image", doc['dobj_type'])
+        self.assertFalse([name for name in doc if doc[name] in ('', None, [])])
+
+    def test_run_manifest(self):
+        """
+        It should write Solr Input Documents without empty fields, and record
+        the content hash and ID of each document in the manifest.
+        """
+        sources = [self.source + os.sep + "clean"]
+        t = Transformer.Transformer(sources, self.temp, actions=['eaccpf-to-sid'], transform=self.source + os.sep + "test.xsl")
+        t.run()
+        manifest = Utils.readYaml(self.temp, Cfg.MANIFEST_FILENAME)
+        expected = sorted([f for f in os.listdir(self.temp) if f.endswith(".xml")])
+        self.assertEqual(expected, sorted(manifest))
+        for filename in expected:
+            with open(self.temp + os.sep + filename, 'rb') as f:
+                data = f.read()
+            self.assertEqual(hashlib.sha1(data).hexdigest(), manifest[filename]['hash'])
+            doc = etree.fromstring(data).getchildren()[0]
+            self.assertEqual([doc.find('field[@name="id"]').text], manifest[filename]['ids'])
+            self.assertEqual([], [field for field in doc.iter('field') if not field.text])
+
+    def test_run_update(self):
+        """
+        It should regenerate only those Solr Input Documents whose source
+        document, merged YAML records or transform configuration changed since
+        the last run, and remove documents whose sources were deleted.
+        """
+        clean = self.temp + os.sep + "clean"
+        infer = self.temp + os.sep + "infer"
+        output = self.temp + os.sep + "output"
+        shutil.copytree(self.source + os.sep + "clean", clean)
+        shutil.copytree(self.source + os.sep + "infer", infer)
+        xslt = self.source + os.sep + "test.xsl"
+        def run(set_fields):
+            actions = ['eaccpf-to-sid', 'merge-digitalobjects', 'set-fields']
+            t = Transformer.Transformer([clean, infer], output, actions=actions, set_fields=set_fields,
+                                        transform=xslt, update=True)
+            t.run()
+            return self._getWritten(output)
+        expected = sorted([f for f in os.listdir(clean) if f.endswith(".xml")])
+        self.assertEqual(expected, run(['region:VIC']))
+        # nothing has changed
+        self.assertEqual([], run(['region:VIC']))
+        # a changed source document
+        with open(clean + os.sep + "E000001.xml", 'a') as f:
+            f.write("\n<!-- changed -->\n")
+        self.assertEqual(["E000001.xml"], run(['region:VIC']))
+        # a changed YAML record merged into the document
+        with open(infer + os.sep + "E000003.yml", 'a') as f:
+            f.write("\n# changed\n")
+        self.assertEqual(["E000003.xml"], run(['region:VIC']))
+        # a deleted source document
+        os.remove(clean + os.sep + "E000004.xml")
+        self.assertEqual([], run(['region:VIC']))
+        self.assertFalse(os.path.exists(output + os.sep + "E000004.xml"))
+        self.assertNotIn("E000004.xml", Utils.loadFileHashIndex(output))
+        self.assertNotIn("E000004.xml", Utils.readYaml(output, Cfg.MANIFEST_FILENAME))
+        # a changed configuration
+        expected.remove("E000004.xml")
+        self.assertEqual(expected, run(['region:NSW']))
+
+    def test_transformFile_threads(self):
+        """
+        It should count, index and time every document when documents are
+        recorded from several threads at once, and send its state to worker
+        processes without its lock.
+        """
+        t = Transformer.Transformer([self.temp], self.temp)
+        def record(thread):
+            for i in range(1000):
+                start = time.time()
+                t._recordSID("T{0}-{1}.xml".format(thread, i), "hash")
+                t._time('xslt', start)
+        threads = [threading.Thread(target=record, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(8000, t.transformed)
+        self.assertEqual(8000, len(t.hashIndex))
+        self.assertIn('xslt', t.timings)
+        copy = pickle.loads(pickle.dumps(t))
+        self.assertEqual(t.hashIndex, copy.hashIndex)
+        self.assertIsNot(t.lock, copy.lock)
+
+    def test_transformEacCpfsToSID_with_workers(self):
+        """
+        It should transform documents in parallel worker processes, produce
+        the same output as a single process, and collect the errors from all
+        workers.
+        """
+        source = self.temp + os.sep + "source"
+        shutil.copytree(self.source + os.sep + "clean", source)
+        with open(source + os.sep + "malformed.xml", 'w') as f:
+            f.write("<eac-cpf><control></eac-cpf>")
+        xslt = self.source + os.sep + "test.xsl"
+        outputs = {}
+        for workers in [1, 3]:
+            output = self.temp + os.sep + str(workers)
+            os.mkdir(output)
+            t = Transformer.Transformer([source], output, actions=['eaccpf-to-sid'], transform=xslt, workers=workers)
+            errors = t.transformEacCpfsToSID([source], output, Utils.loadTransform(xslt))
+            self.assertEqual([source + os.sep + "malformed.xml"], [path for path, _ in errors])
+            self.assertIn('xslt', t.timings)
+            outputs[workers] = {}
+            for filename in os.listdir(output):
+                with open(output + os.sep + filename, 'rb') as f:
+                    outputs[workers][filename] = f.read()
+            self.assertEqual(sorted(outputs[workers]), sorted(t.manifest))
+        self.assertEqual(9, len(outputs[1]))
+        self.assertEqual(outputs[1], outputs[3])
 
     def test_setBoosts(self):
         """
@@ -123,6 +320,35 @@ class TestTransformer(unittest.TestCase):
                     for node in nodes:
                         self.assertEqual(expected, node.text)
 
+    def test_setFields_and_boosts_single_pass(self):
+        """
+        It should rewrite each document once per pass, with every configured
+        field set and boosted, regardless of the number of fields.
+        """
+        source = self.source + os.sep + "setfields"
+        fields = ['field{0}'.format(i) for i in range(10)]
+        t = Transformer.Transformer(self.temp, self.temp, boosts=[f + ':10' for f in fields],
+                                    set_fields=[f + ':value' for f in fields])
+        for filename in os.listdir(source):
+            shutil.copy(source + os.sep + filename, self.temp)
+        expected = sorted(os.listdir(source))
+        self.assertEqual(expected, self._getWritten(self.temp))
+        with mock.patch.object(t, '_writeSID', wraps=t._writeSID) as write:
+            t.setFieldValue(self.temp)
+            self.assertEqual(len(expected), write.call_count)
+            self.assertEqual(expected, sorted([c[0][1] for c in write.call_args_list]))
+            write.reset_mock()
+            t.setBoosts(self.temp)
+            self.assertEqual(len(expected), write.call_count)
+            self.assertEqual(expected, sorted([c[0][1] for c in write.call_args_list]))
+        self.assertEqual(expected, self._getWritten(self.temp))
+        for filename in expected:
+            doc = etree.parse(self.temp + os.sep + filename).getroot().getchildren()[0]
+            for fieldname in fields:
+                field = doc.find('field[@name="' + fieldname + '"]')
+                self.assertEqual('value', field.text)
+                self.assertEqual('10', field.attrib['boost'])
+
     def test_transformDigitalObjectToSID(self):
         """
         It should transform a path with digital object YAML records to Solr 
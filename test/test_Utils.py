@@ -3,6 +3,7 @@ This file is subject to the terms and conditions defined in the
 LICENSE file, which is part of this source code package.
 """
 
+from Indexer import Cfg
 from Indexer import Utils
 
 import inspect
@@ -94,6 +95,44 @@ class TestUtils(unittest.TestCase):
         self.assertNotEqual(len(s1), len(s2))
         self.assertNotEqual(s2[0], ' ')
 
+    def test_decodeText(self):
+        """
+        It should decode the data using the sniffed encoding and return the
+        text with the encoding used. It should raise an exception when the data
+        can not be decoded.
+        """
+        cases = [
+            ('<a>\u00e9</a>'.encode('utf-8'), 'utf-8'),
+            ('<a>\u00e9</a>'.encode('utf-16'), 'utf-16'),
+            ('<?xml version="1.0" encoding="latin-1"?><a>\u00e9</a>'.encode('latin-1'), 'latin-1'),
+        ]
+        for data, encoding in cases:
+            text, result = Utils.decodeText(data)
+            self.assertIn('\u00e9', text)
+            self.assertEqual(encoding, result)
+        self.assertRaises(UnicodeDecodeError, Utils.decodeText, '<a>\u00e9</a>'.encode('latin-1'))
+
+    def test_detectEncoding(self):
+        """
+        It should determine the encoding from the byte order mark or XML
+        declaration, and otherwise return the default encoding.
+        """
+        cases = [
+            (b'<a/>', 'utf-8'),
+            (b'\xef\xbb\xbf<a/>', 'utf-8-sig'),
+            ('<a/>'.encode('utf-16'), 'utf-16'),
+            ('<?xml version="1.0"?><a/>'.encode('utf-16-le'), 'utf-16-le'),
+            ('<?xml version="1.0"?><a/>'.encode('utf-16-be'), 'utf-16-be'),
+            ('<eac-cpf xmlns="urn:isbn:1-931666-33-4"/>'.encode('utf-16-le'), 'utf-16-le'),
+            ('<eac-cpf xmlns="urn:isbn:1-931666-33-4"/>'.encode('utf-16-be'), 'utf-16-be'),
+            ('<a/>'.encode('utf-32'), 'utf-32-le'),
+            (b'<?xml version="1.0" encoding="ISO-8859-1"?><a/>', 'iso-8859-1'),
+            (b"\n<?xml version='1.0' encoding='windows-1252'?><a/>", 'windows-1252'),
+            (b'<?xml version="1.0" encoding="UTF-16"?><a/>', 'utf-8'),
+        ]
+        for data, expected in cases:
+            self.assertEqual(expected, Utils.detectEncoding(data))
+
     def test_fixIncorrectDateEncoding(self):
         pass
 
@@ -192,6 +231,29 @@ class TestUtils(unittest.TestCase):
             renamed = Utils.getFilenameWithAlternateExtension(filename, ext)
             self.assertEquals(newname, renamed)
 
+    def test_getShard(self):
+        """
+        It should parse a shard specification of the form i/N, and reject
+        shard numbers outside 1 to N.
+        """
+        self.assertEqual((1, 1), Utils.getShard("1/1"))
+        self.assertEqual((3, 4), Utils.getShard("3/4"))
+        for value in ["0/4", "5/4", "1/0", "1", "a/b", "1/2/3"]:
+            self.assertRaises(ValueError, Utils.getShard, value)
+
+    def test_getShardFilename(self):
+        """
+        It should insert the shard before the file name extension.
+        """
+        cases = [
+            (".index.yml", None, ".index.yml"),
+            (".index.yml", (2, 4), ".index.2-of-4.yml"),
+            ("report.yml", (1, 3), "report.1-of-3.yml"),
+            ("Test_Inferrer_cache", (1, 2), "Test_Inferrer_cache.1-of-2"),
+        ]
+        for filename, shard, expected in cases:
+            self.assertEqual(expected, Utils.getShardFilename(filename, shard))
+
     def test_getTemporaryFileFromResource(self):
         """
         It should retrieve the web or file system resource and write it to a
@@ -213,6 +275,23 @@ class TestUtils(unittest.TestCase):
                 self.assertEqual(False, expected)
                 # logging.error("Could not create temporary resource", exc_info=True)
 
+    def test_inShard(self):
+        """
+        It should assign each record to exactly one shard by its record ID,
+        so that the files of a record in each stage are in the same shard.
+        """
+        filenames = ["E{0:06d}.xml".format(i) for i in range(200)]
+        shards = [(i, 4) for i in range(1, 5)]
+        counts = []
+        for shard in shards:
+            counts.append(len([f for f in filenames if Utils.inShard(f, shard)]))
+        self.assertEqual(len(filenames), sum(counts))
+        self.assertTrue(min(counts) > 0)
+        for filename in filenames:
+            shard = [s for s in shards if Utils.inShard(filename, s)][0]
+            self.assertTrue(Utils.inShard(filename.replace(".xml", ".yml"), shard))
+            self.assertTrue(Utils.inShard(filename, None))
+
     def test_isDigitalObjectYaml(self):
         """
         It should determine if a file is in YAML format, and if it represents a
@@ -268,6 +347,12 @@ class TestUtils(unittest.TestCase):
             hash_index = Utils.loadFileHashIndex(path)
             self.assertNotEqual(None, hash_index)
             self.assertEqual(expected, len(hash_index))
+        # a shard without an index of its own loads its part of the index
+        path = source + os.sep + "2"
+        hash_index = Utils.loadFileHashIndex(path)
+        parts = [Utils.loadFileHashIndex(path, Shard=(i, 2)) for i in [1, 2]]
+        self.assertEqual(hash_index, dict(list(parts[0].items()) + list(parts[1].items())))
+        self.assertEqual([], [k for k in parts[0] if k in parts[1]])
 
     def test_map_url_to_local_path(self):
         """
@@ -287,6 +372,33 @@ class TestUtils(unittest.TestCase):
             self.assertNotEqual(result, None)
             self.assertEqual(result, expected)
 
+    def test_mergeShardIndexes(self):
+        """
+        It should replace the entries of each shard in the index with the
+        shard index, remove the shard indexes, and add the entries of shard
+        caches that are not partitioned by record.
+        """
+        filenames = ["E{0:06d}.xml".format(i) for i in range(20)]
+        shards = [(1, 2), (2, 2)]
+        Utils.writeFileHashIndex(dict([(f, 'old') for f in filenames]), self.temp)
+        # each shard changes one record and deletes another
+        for shard in shards:
+            index = Utils.loadFileHashIndex(self.temp, Shard=shard)
+            records = sorted(index.keys())
+            index[records[0]] = 'new'
+            del index[records[1]]
+            Utils.writeFileHashIndex(index, self.temp, Shard=shard)
+        index = Utils.mergeShardIndexes(self.temp)
+        self.assertEqual(len(filenames) - 2, len(index))
+        self.assertEqual(2, len([k for k in index if index[k] == 'new']))
+        self.assertEqual(index, Utils.loadFileHashIndex(self.temp))
+        self.assertEqual([], Utils.getShardFilenames(self.temp, Cfg.HASH_INDEX_FILENAME))
+        # caches keep the entries of every shard
+        Utils.writeYaml(self.temp, "cache.yml", {'a': 1})
+        Utils.writeYaml(self.temp, "cache.1-of-2.yml", {'a': 1, 'b': 2})
+        Utils.writeYaml(self.temp, "cache.2-of-2.yml", {'c': 3})
+        self.assertEqual({'a': 1, 'b': 2, 'c': 3}, Utils.mergeShardIndexes(self.temp, "cache.yml", Partitioned=False))
+
     def test_parseUnitDate(self):
         """
         Parse unit date value into fromDate, toDate values.
@@ -339,6 +451,15 @@ class TestUtils(unittest.TestCase):
             # the file count should be equal to expected
             files = os.listdir(dest)
             self.assertEqual(expected_count, len(files))
+        # a shard only purges the files of its own records
+        dest = self.temp + os.sep + "shard"
+        os.mkdir(dest)
+        filenames = ["E{0:06d}.xml".format(i) for i in range(20)] + [".index.yml"]
+        for filename in filenames:
+            Utils.write(dest, filename, "-----")
+        Utils.purgeFolder(dest, {}, shard=(1, 2))
+        expected = [f for f in filenames if f.startswith('.') or not Utils.inShard(f, (1, 2))]
+        self.assertEqual(sorted(expected), sorted(os.listdir(dest)))
 
     def test_purgeIndex(self):
         """
@@ -398,8 +519,46 @@ class TestUtils(unittest.TestCase):
             self.assertNotEqual(result, None)
             self.assertEqual(path, result)
 
+    def test_loadSchema(self):
+        """
+        It should compile the schema once and return the cached schema on
+        subsequent calls.
+        """
+        schema = Utils.loadSchema(Utils.EACCPF_SCHEMA)
+        self.assertNotEqual(None, schema)
+        self.assertIs(schema, Utils.loadSchema(Utils.EACCPF_SCHEMA))
+
     def test_validate(self):
-        pass
+        """
+        It should return a list of errors for each file in the source folder,
+        in which the list is empty for valid files. It should produce the same
+        result when validating with multiple workers.
+        """
+        source = os.sep.join([self.module_path, "analyzer"])
+        expected = {
+            'E000001.xml': False,
+            'E000004.xml': True,
+            'E000009.xml': True,
+            'invalid.xml': False,
+        }
+        for workers in [1, 2]:
+            report = Utils.validate(source, Workers=workers)
+            self.assertEqual(10, len(report))
+            for filename, valid in expected.items():
+                self.assertEqual(valid, len(report[filename]) == 0)
+        errors = Utils.validate(source, Files=['invalid.xml'])['invalid.xml']
+        self.assertEqual(['column', 'line', 'message'], sorted(errors[0].keys()))
+
+    def test_validateFile(self):
+        """
+        It should report syntax errors in files that can not be parsed.
+        """
+        path = self.temp + os.sep + "malformed.xml"
+        with open(path, 'w') as f:
+            f.write("<eac-cpf><control></eac-cpf>")
+        errors = Utils.validateFile(path)
+        self.assertGreater(len(errors), 0)
+        self.assertEqual(1, errors[0]['line'])
 
     def test_write(self):
         pass
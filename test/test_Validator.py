@@ -0,0 +1,81 @@
+"""
+This file is subject to the terms and conditions defined in the
+LICENSE file, which is part of this source code package.
+"""
+
+from Indexer import Cfg
+from Indexer import Validator
+
+import inspect
+import os
+import shutil
+import tempfile
+import unittest
+import yaml
+
+
+class TestValidator(unittest.TestCase):
+    """
+    Executes unit tests against the Validator module.
+    """
+
+    def setUp(self):
+        """
+        Set up the test environment.
+        """
+        self.module = os.path.abspath(inspect.getfile(self.__class__))
+        self.module_path = os.path.dirname(self.module)
+        self.source = self.module_path + os.sep + "analyzer"
+        self.temp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        Tear down the test environment.
+        """
+        shutil.rmtree(self.temp, ignore_errors=True)
+
+    def _readReport(self):
+        with open(self.temp + os.sep + Cfg.VALIDATION_REPORT_FILENAME, 'r') as f:
+            return yaml.safe_load(f)
+
+    def test__init__(self):
+        """
+        It should create an instance of the Validator class.
+        """
+        validator = Validator.Validator(self.source, self.temp)
+        self.assertNotEqual(None, validator)
+
+    def test_run(self):
+        """
+        It should write a report with the validity and errors of each document
+        in the source folder.
+        """
+        validator = Validator.Validator(self.source, self.temp, workers=2)
+        validator.run()
+        report = self._readReport()
+        self.assertEqual(10, len(report))
+        self.assertEqual(True, report['E000004.xml']['valid'])
+        self.assertEqual([], report['E000004.xml']['errors'])
+        self.assertEqual(False, report['invalid.xml']['valid'])
+        self.assertGreater(len(report['invalid.xml']['errors']), 0)
+
+    def test_run_with_update(self):
+        """
+        It should keep the prior report entries for unchanged documents and
+        remove entries for documents that were deleted from the source.
+        """
+        source = self.temp + os.sep + "source"
+        output = self.temp + os.sep + "output"
+        shutil.copytree(self.source, source)
+        Validator.Validator(source, output).run()
+        os.remove(source + os.sep + "E000001.xml")
+        validator = Validator.Validator(source, output, update=True)
+        validator.run()
+        with open(output + os.sep + Cfg.VALIDATION_REPORT_FILENAME, 'r') as f:
+            report = yaml.safe_load(f)
+        self.assertEqual(9, len(report))
+        self.assertNotIn('E000001.xml', report)
+
+
+if __name__ == "__main__":
+    unittest.main()
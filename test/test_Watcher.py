@@ -0,0 +1,137 @@
+"""
+This file is subject to the terms and conditions defined in the
+LICENSE file, which is part of this source code package.
+"""
+
+from Indexer import Watcher
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from unittest import mock
+
+
+class TestWatcher(unittest.TestCase):
+    """
+    Executes unit tests against the Watcher module.
+    """
+
+    def setUp(self):
+        """
+        Set up the test environment.
+        """
+        self.temp = tempfile.mkdtemp()
+        os.makedirs(self.temp + os.sep + "biogs")
+        os.makedirs(self.temp + os.sep + "browse")
+        self._write("biogs", "E000001b.htm")
+
+    def tearDown(self):
+        """
+        Tear down the test environment.
+        """
+        shutil.rmtree(self.temp, ignore_errors=True)
+
+    def _write(self, Folder, Filename, Data="<html></html>"):
+        """
+        Write the file to the folder in the watched tree. Return its path.
+        """
+        path = self.temp + os.sep + Folder + os.sep + Filename
+        with open(path, 'w') as f:
+            f.write(Data)
+        return path
+
+    def _getWatchers(self):
+        """
+        Get a watcher for each available backend in turn, polling first.
+        """
+        yield Watcher.Watcher(self.temp, exclude=['browse'], debounce=0.3, poll_interval=0.05, polling=True)
+        watcher = Watcher.Watcher(self.temp, exclude=['browse'], debounce=0.3)
+        if watcher.fd is not None:
+            yield watcher
+
+    def test_wait(self):
+        """
+        It should return the changed, created and deleted files once there
+        have been no changes for the debounce interval, and ignore folders
+        that are excluded.
+        """
+        for watcher in self._getWatchers():
+            try:
+                self.assertEqual([], watcher.wait(0.1))
+                # wait for a new modification time
+                time.sleep(0.05)
+                changed = self._write("biogs", "E000001b.htm", "<html><body></body></html>")
+                created = self._write("biogs", "E000002b.htm")
+                self._write("browse", "browse_a.htm")
+                self.assertEqual(sorted([changed, created]), watcher.wait(1.0))
+                os.remove(created)
+                self.assertEqual([created], watcher.wait(1.0))
+                self.assertEqual([], watcher.wait(0.1))
+            finally:
+                watcher.close()
+
+    def test_wait_poll_interval(self):
+        """
+        It should scan the tree at most once per poll interval when polling,
+        however short the timeout of each wait.
+        """
+        watcher = Watcher.Watcher(self.temp, debounce=0.0, poll_interval=0.5, polling=True)
+        try:
+            with mock.patch.object(watcher, '_scan', wraps=watcher._scan) as scan:
+                start = time.time()
+                while time.time() - start < 1.2:
+                    self.assertEqual([], watcher.wait(0.05))
+                self.assertEqual(2, scan.call_count)
+                # a change is found by the next scan
+                time.sleep(0.05)
+                changed = self._write("biogs", "E000001b.htm", "<html><body></body></html>")
+                self.assertEqual([changed], watcher.wait(1.0))
+                self.assertEqual(3, scan.call_count)
+        finally:
+            watcher.close()
+
+    def test_wait_debounce(self):
+        """
+        It should report a file that is written several times once, after
+        the writes have stopped.
+        """
+        for watcher in self._getWatchers():
+            try:
+                path = self.temp + os.sep + "biogs" + os.sep + "E000003b.htm"
+                def write():
+                    for i in range(5):
+                        self._write("biogs", "E000003b.htm", "<html>{0}</html>".format(i))
+                        time.sleep(0.1)
+                writer = threading.Thread(target=write)
+                start = time.time()
+                writer.start()
+                changes = watcher.wait(1.0)
+                writer.join()
+                self.assertEqual([path], changes)
+                self.assertTrue(time.time() - start >= 0.7)
+                self.assertEqual([], watcher.wait(0.1))
+            finally:
+                watcher.close()
+
+    def test_wait_new_folder(self):
+        """
+        It should report the files in folders that are created in the tree.
+        """
+        for watcher in self._getWatchers():
+            try:
+                folder = self.temp + os.sep + ("objects" if watcher.fd is None else "inotify")
+                os.makedirs(folder)
+                path = self._write(os.path.basename(folder), "D00000013.htm")
+                self.assertEqual([path], watcher.wait(1.0))
+                path = self._write(os.path.basename(folder), "D00000014.htm")
+                self.assertEqual([path], watcher.wait(1.0))
+            finally:
+                watcher.close()
+
+
+if __name__ == "__main__":
+    unittest.main()